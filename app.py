@@ -7,13 +7,12 @@ import importlib.util
 from flask import Flask, render_template, request, Response, jsonify, session, redirect, url_for
 import json
 import time
+# Início da importação do app, para medir o tempo de subida do worker
+STARTUP_STARTED = time.time()
 import uuid
 import threading
+import queue
 import concurrent.futures
-from html import escape, unescape
-import re
-from markdown_it import MarkdownIt
-from markdown2 import markdown as markdown2_render
 from dotenv import load_dotenv
 
 # Carrega as variáveis de ambiente do arquivo .env
@@ -24,17 +23,36 @@ sys.stdout.reconfigure(line_buffering=True)
 sys.stderr.reconfigure(line_buffering=True)
 
 # Importações do LangChain
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
-# Importa os LLMs
-from llms import claude_llm, gemini_llm, openai_llm
+# Importa os LLMs (criados na primeira utilização, ver llms.ProviderRegistry)
+from llms import ProviderNotConfigured, llm_registry
 
 # Importa os prompts
 from config import *
 
 # Importa nosso processador RAG
-from rag_processor import get_relevant_context
+from rag_processor import get_relevant_context, index_into_library, slice_context
+from document_library import LibraryError, get_collection, list_collections, parse_collection_names
+from embeddings import embedding_service, start_warmup
+from llm_scheduler import llm_scheduler
+from llm_cache import llm_cache
+from prompt_cache import prefix_cached, usage_stats
+from latency import HEDGE_ALTERNATES, latency_tracker, prompt_chars
+from provider_health import health_tracker
+from rate_limit import rate_limiter
+from document_cache import document_cache
+from markdown_render import MARKDOWN_BATCH_MAX_ITEMS, markdown_renderer
+from token_budget import fit_prompt, output_tokens_for_chars
+from serving import PRELOAD_ENABLED, gevent_active, memory_report
+from sse import ResultChunks, accepts_gzip, encode_json, encode_stream
+from jobs import jobs
+from result_store import result_store
+from sectioned import (
+    SECTIONED_CONTEXT_CHARS, SECTIONED_MAX_SECTIONS, SECTIONED_MIN_SECTIONS, SECTIONED_TIMEOUT,
+    OrderedSectionStream, Section, allocate_chars, describe_outline, parse_outline, stitch
+)
 
 app = Flask(__name__)
 
@@ -47,82 +65,164 @@ if not os.path.exists('uploads'):
 
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
 
-# Instancia o conversor de Markdown
-md = MarkdownIt()
+# Aquece o modelo de embeddings em segundo plano para a primeira consulta não esperar o carregamento.
+# No modo de pré-carregamento o modelo é carregado no mestre e aquecido em cada worker (serving.after_fork)
+if os.getenv("EMBEDDING_WARMUP", "1") == "1" and not PRELOAD_ENABLED:
+    start_warmup()
 
-# Variável global para controle de interrupção
-processing_cancelled = False
+# Provedor de cada modelo da página (orçamento de tokens, LLM, cotas)
+MODEL_PROVIDERS = {'openai': 'openai', 'sonnet': 'claude', 'gemini': 'gemini'}
+
+def model_llm(model_name):
+    """LLM de um modelo da página; levanta ProviderNotConfigured se o provedor não estiver configurado."""
+    return llm_registry.get(MODEL_PROVIDERS[model_name])
+
+def unavailable_notice(model_name):
+    """Motivo para pular um modelo da página (provedor sem configuração ou com o circuito aberto), ou None."""
+    provider = MODEL_PROVIDERS[model_name]
+    if not llm_registry.configured(provider):
+        return f"{provider} não está configurado (variáveis de ambiente ausentes: {', '.join(llm_registry.missing_env(provider))})."
+    if not health_tracker.available(provider):
+        return health_tracker.describe(provider)
+    return None
 
 def log_print(message):
     """Função para garantir que os logs apareçam no container"""
     print(f"[DEBUG] {message}", flush=True)
     sys.stdout.flush()
 
-# ... (Mantenha as funções safe_json_dumps, merge_full_content, render_markdown_cascata, is_html_empty) ...
+# ... (Mantenha as funções safe_json_dumps, render_markdown_cascata, is_html_empty) ...
 
 def safe_json_dumps(data):
-    """Função para criar JSON de forma segura, com tratamento de strings muito grandes"""
+    """
+    Função para criar JSON de forma segura. Resultados grandes não chegam
+    aqui inteiros: result_events os divide em partes numeradas (ver
+    sse.ResultChunks), que o cliente remonta e confere.
+    """
     try:
-        json_str = json.dumps(data, ensure_ascii=False)
-        
-        # Se o JSON for muito grande (> 50MB), trunca o conteúdo
-        if len(json_str.encode('utf-8')) > 50 * 1024 * 1024:
-            log_print(f"JSON muito grande ({len(json_str)} chars), truncando...")
-            if 'content' in str(data):
-                # Cria uma versão truncada
-                truncated_data = data.copy() if isinstance(data, dict) else {}
-                if 'final_result' in truncated_data and 'content' in truncated_data['final_result']:
-                    original_content = truncated_data['final_result']['content']
-                    truncated_content = original_content[:10000] + "\n\n[CONTEÚDO TRUNCADO DEVIDO AO TAMANHO - Use o botão 'Copiar' para obter o texto completo]"
-                    truncated_data['final_result']['content'] = truncated_content
-                elif 'partial_result' in truncated_data and 'content' in truncated_data['partial_result']:
-                    original_content = truncated_data['partial_result']['content']
-                    truncated_content = original_content[:10000] + "\n\n[CONTEÚDO TRUNCADO DEVIDO AO TAMANHO - Use o botão 'Copiar' para obter o texto completo]"
-                    truncated_data['partial_result']['content'] = truncated_content
-                
-                return json.dumps(truncated_data, ensure_ascii=False)
-        
-        return json_str
+        return encode_json(data)
     except Exception as e:
         log_print(f"Erro ao criar JSON: {e}")
-        return json.dumps({'error': f'Erro na serialização JSON: {str(e)}'})
-
-# Variável global para armazenar o conteúdo completo do merge
-merge_full_content = ""
-
-# Função para renderização com fallback: tenta MarkdownIt, depois markdown2
-def render_markdown_cascata(texto: str) -> str:
-    try:
-        html_1 = md.render(texto)
-        if not is_html_empty(html_1):
-            return html_1
-    except Exception as e:
-        log_print(f"MarkdownIt falhou: {e}")
+        return encode_json({'error': f'Erro na serialização JSON: {str(e)}'})
+
+# Streaming de tokens: os deltas dos modelos são agrupados em quadros para
+# não gerar um evento SSE por token
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+# Tempo limite de cada modelo no modo atômico (segundos), enquanto o
+# histograma de latência do provedor não tiver amostras suficientes
+ATOMIC_TIMEOUT = float(os.getenv("ATOMIC_TIMEOUT", 300))
+STREAM_FRAME_MIN_CHARS = int(os.getenv("STREAM_FRAME_MIN_CHARS", 400))
+STREAM_FRAME_MAX_INTERVAL = float(os.getenv("STREAM_FRAME_MAX_INTERVAL", 0.5))
+
+# Cabeçalhos das respostas SSE: sem cache e sem buffer em proxies (nginx),
+# para que os eventos cheguem assim que são gerados em conexões longas
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def streaming_requested(params) -> bool:
+    """Lê a opção 'streaming' do formulário/JSON, com o padrão do ambiente."""
+    return params.get('streaming', 'on' if STREAMING_ENABLED else 'off') == 'on'
+
+def cache_requested(params) -> bool:
+    """Lê a opção 'cache' do formulário/JSON; 'off' gera as respostas de novo, sem ler o cache."""
+    return params.get('cache', 'on') != 'off'
+
+class FrameCoalescer:
+    """
+    Agrupa os deltas de texto de um modelo em quadros (STREAM_FRAME_MIN_CHARS
+    ou STREAM_FRAME_MAX_INTERVAL, o que vier antes) e registra no log o tempo
+    até o primeiro token.
+    """
 
+    def __init__(self, label):
+        self.label = label
+        self.started = time.time()
+        self.first_token_at = None
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = self.started
+
+    def add(self, piece):
+        """Acrescenta um delta; devolve um quadro quando há texto suficiente."""
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+            log_print(f"=== {self.label}: primeiro token em {self.first_token_at - self.started:.2f}s ===")
+        self.buffer.append(piece)
+        self.buffered += len(piece)
+        now = time.time()
+        if self.buffered >= STREAM_FRAME_MIN_CHARS or now - self.last_flush >= STREAM_FRAME_MAX_INTERVAL:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Devolve o que restou no buffer (ou None)."""
+        frame = "".join(self.buffer) if self.buffer else None
+        self.buffer, self.buffered, self.last_flush = [], 0, time.time()
+        return frame
+
+def iter_chain_deltas(chain, inputs, label, timeout=None, token=None, use_cache=True, provider=None):
+    """Executa a chain em streaming pelo agendador e produz quadros agrupados."""
+    coalescer = FrameCoalescer(label)
+    for piece in llm_scheduler.stream(chain, inputs, timeout=timeout, token=token, use_cache=use_cache, provider=provider):
+        frame = coalescer.add(piece)
+        if frame:
+            yield frame
+    frame = coalescer.flush()
+    if frame:
+        yield frame
+    log_print(f"=== {label}: streaming concluído em {time.time() - coalescer.started:.2f}s ===")
+
+def stream_chain_events(chain, inputs, output_id, label, job, provider=None):
+    """Envia os quadros como eventos 'delta' e devolve o texto completo (use com `yield from`)."""
+    parts = []
     try:
-        html_2 = markdown2_render(texto, extras=["fenced-code-blocks", "tables"])
-        if not is_html_empty(html_2):
-            return html_2
-    except Exception as e:
-        log_print(f"markdown2 falhou: {e}")
-
-    return f"<pre>{escape(texto)}</pre>"
+        for frame in iter_chain_deltas(chain, inputs, label, token=job.token, use_cache=job.use_cache, provider=provider):
+            parts.append(frame)
+            json_data = safe_json_dumps(job.streamed.delta(output_id, frame))
+            yield f"data: {json_data}\n\n"
+            if job.cancelled:
+                break
+    except concurrent.futures.CancelledError:
+        # Job cancelado: quem chamou verifica job.cancelled e avisa o usuário
+        pass
+    return "".join(parts)
+
+def result_events(job, output_id, text, result_key='partial_result', extra=None, **fields):
+    """
+    Eventos do resultado final de uma caixa (use com `yield from`): só o que
+    falta depois dos deltas e, se for grande, em partes numeradas ('chunk')
+    seguidas do evento do resultado com o CRC32 para conferência.
+    """
+    chunks = ResultChunks(job.streamed.result(output_id, text))
+    for chunk in chunks:
+        yield f"data: {safe_json_dumps(chunk)}\n\n"
+    if chunks.result.get('chunked'):
+        log_print(f"{output_id}: {chunks.result['chunked']['chars']} chars enviados em {chunks.result['chunked']['count']} partes")
+    yield f"data: {safe_json_dumps({**fields, result_key: {**chunks.result, **(extra or {})}})}\n\n"
+
+def job_response(job, params):
+    """
+    Responde a /process ou /merge: por padrão com o stream SSE do job; com
+    respond=job, apenas com o id (os eventos ficam em /jobs/<id>/events).
+    """
+    if params.get('respond') == 'job':
+        return jsonify({'job_id': job.id, 'events_url': url_for('job_events', job_id=job.id)}), 202
+    return sse_response(jobs.stream(job.id), f"job {job.id}")
 
-def is_html_empty(html: str) -> bool:
+def sse_response(events, label):
     """
-    Verifica de forma robusta se uma string HTML não contém texto visível,
-    lidando com entidades HTML e múltiplos tipos de espaços em branco.
+    Resposta text/event-stream com os eventos codificados uma única vez
+    (ver sse.encode_stream), comprimida com gzip se o cliente aceitar.
     """
-    if not html:
-        return True
-    # 1. Remove todas as tags HTML
-    text_only = re.sub('<[^<]+?>', '', html)
-    # 2. Decodifica entidades HTML (ex: &nbsp; para ' ')
-    decoded_text = unescape(text_only)
-    # 3. Substitui qualquer sequência de caracteres de espaço em branco por um único espaço
-    normalized_space = re.sub(r'\s+', ' ', decoded_text)
-    # 4. Verifica se o texto restante (após remover espaços nas pontas) está de fato vazio
-    return not normalized_space.strip()
+    compress = accepts_gzip(request.accept_encodings)
+    headers = dict(SSE_HEADERS)
+    if compress:
+        headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    return Response(encode_stream(events, label, compress), mimetype='text/event-stream', headers=headers)
+
+# Função para renderização com fallback: tenta MarkdownIt, depois markdown2
+# (bloco a bloco, reaproveitando os blocos já convertidos; ver markdown_render)
+def render_markdown_cascata(texto: str) -> str:
+    return markdown_renderer.render(texto)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -165,41 +265,261 @@ def convert():
     converted_html = render_markdown_cascata(text_to_convert)
     return jsonify({'html': converted_html})
 
+# NOVA ROTA: Converte várias saídas numa única requisição. Cada item traz o
+# texto ou, para saídas que chegaram truncadas no stream, o job de onde lê-lo
+@app.route('/convert-batch', methods=['POST'])
+def convert_batch():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Nenhum texto fornecido'}), 400
+    if len(items) > MARKDOWN_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'No máximo {MARKDOWN_BATCH_MAX_ITEMS} saídas por conversão'}), 400
+
+    texts, errors = {}, {}
+    for item in items:
+        output_id = item.get('id') if isinstance(item, dict) else None
+        if not output_id:
+            return jsonify({'error': 'Item sem id'}), 400
+        if isinstance(item.get('text'), str):
+            texts[output_id] = item['text']
+        elif item.get('job_id'):
+            stored = result_store.get(item['job_id'], output_id, 0, 2 ** 31 - 1)
+            if stored is None:
+                errors[output_id] = 'Conteúdo não encontrado'
+            else:
+                texts[output_id] = stored[0]
+        else:
+            errors[output_id] = 'Nenhum texto fornecido'
+
+    started = time.time()
+    converted = markdown_renderer.render_many(texts)
+    log_print(f"Conversão em lote: {len(converted)} saídas, {sum(len(t) for t in texts.values())} chars em {time.time() - started:.3f}s")
+    return jsonify({'html': converted, 'errors': errors})
+
 # NOVA ROTA: Para cancelar processamento
 @app.route('/cancel', methods=['POST'])
 def cancel():
     if not session.get('logged_in'):
         return jsonify({'error': 'Não autorizado'}), 401
-    global processing_cancelled
-    processing_cancelled = True
-    log_print("=== PROCESSAMENTO CANCELADO PELO USUÁRIO ===")
-    return jsonify({'status': 'cancelled'})
-
-# NOVA ROTA: Para obter o conteúdo completo do merge
+    data = request.get_json(silent=True) or {}
+    job_id = data.get('job_id')
+    if not job_id:
+        return jsonify({'error': 'Nenhum job informado'}), 400
+    if not jobs.cancel(job_id):
+        return jsonify({'error': 'Job não encontrado ou já concluído'}), 404
+    log_print(f"=== JOB {job_id} CANCELADO PELO USUÁRIO ===")
+    return jsonify({'status': 'cancelled', 'job_id': job_id})
+
+# NOVA ROTA: Para obter o conteúdo completo de uma saída (em partes, se for muito grande)
 @app.route('/get-full-content', methods=['POST'])
 def get_full_content():
     if not session.get('logged_in'):
         return jsonify({'error': 'Não autorizado'}), 401
-    global merge_full_content
-    data = request.get_json()
-    content_type = data.get('type', 'merge')
-    
-    if content_type == 'merge' and merge_full_content:
-        return jsonify({'content': merge_full_content})
-    else:
+    data = request.get_json(silent=True) or {}
+    job_id = data.get('job_id')
+    if not job_id:
+        return jsonify({'error': 'Nenhum job informado'}), 400
+    # 'type': 'merge' é o nome antigo da saída do merge
+    output_id = data.get('output_id') or ('final-output' if data.get('type', 'merge') == 'merge' else data.get('type'))
+    try:
+        offset = int(data.get('offset', 0))
+        length = int(data['length']) if data.get('length') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'offset/length inválidos'}), 400
+
+    result = result_store.get(job_id, output_id, offset, length)
+    if result is None:
+        return jsonify({'error': 'Conteúdo não encontrado'}), 404
+    content, total_length = result
+    end = offset + len(content)
+    return jsonify({
+        'job_id': job_id,
+        'output_id': output_id,
+        'content': content,
+        'offset': offset,
+        # Offsets e tamanhos em caracteres (code points), como no armazenamento;
+        # o cliente usa next_offset em vez de medir o texto (o JS conta UTF-16)
+        'next_offset': end,
+        'total_length': total_length,
+        'complete': end >= total_length
+    })
+
+# NOVA ROTA: Download de uma saída como arquivo Markdown, lida do armazenamento
+# em partes e enviada com transferência em blocos (sem carregar o texto inteiro)
+@app.route('/jobs/<job_id>/outputs/<output_id>/download', methods=['GET'])
+def download_output(job_id, output_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    first = result_store.get(job_id, output_id)
+    if first is None:
         return jsonify({'error': 'Conteúdo não encontrado'}), 404
 
+    def generate(content, total_length):
+        offset = 0
+        while content:
+            yield content.encode('utf-8')
+            offset += len(content)
+            if offset >= total_length:
+                return
+            chunk = result_store.get(job_id, output_id, offset)
+            if chunk is None:
+                return
+            content, total_length = chunk
+
+    filename = f"{output_id}-{job_id[:8]}.md"
+    return Response(generate(*first), mimetype='text/markdown',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-cache'})
+
+# NOVAS ROTAS: Acompanhamento dos jobs em segundo plano
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    status['outputs'] = result_store.list_outputs(job_id)
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Reenvia os eventos do job após Last-Event-ID e acompanha os novos."""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    if not jobs.exists(job_id):
+        return jsonify({'error': 'Job não encontrado'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID inválido'}), 400
+    log_print(f"=== RECONEXÃO AO JOB {job_id} A PARTIR DO EVENTO {last_event_id} ===")
+    return sse_response(jobs.stream(job_id, last_event_id), f"job {job_id} (a partir do evento {last_event_id})")
+
+# NOVA ROTA: Estado interno do servidor (fila e concorrência das chamadas aos LLMs)
+@app.route('/status', methods=['GET'])
+def status():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return jsonify({'llm_scheduler': llm_scheduler.stats(), 'llm_cache': llm_cache.status(), 'prompt_cache': usage_stats(), 'latency': latency_tracker.status(), 'providers': health_tracker.status(), 'rate_limits': rate_limiter.status(), 'llms': llm_registry.status(), 'markdown': markdown_renderer.status(), 'jobs': {'running': jobs.running(), 'queued': jobs.queued(), 'max_concurrency': jobs.max_concurrency}, 'server': {'pid': os.getpid(), 'gevent': gevent_active(), 'startup_seconds': STARTUP_SECONDS}})
+
+# NOVA ROTA: Prontidão do worker, para o balanceador/orquestrador (sem login e sem
+# segredos): pronto quando ao menos um provedor de LLM está configurado
+@app.route('/ready', methods=['GET'])
+def ready():
+    providers = {name: info['state'] for name, info in llm_registry.status().items()}
+    is_ready = any(state != 'missing_env' for state in providers.values())
+    payload = {'ready': is_ready, 'pid': os.getpid(), 'startup_seconds': STARTUP_SECONDS, 'providers': providers,
+               'embeddings_loaded': embedding_service.loaded}
+    return jsonify(payload), 200 if is_ready else 503
+
+# NOVA ROTA: Cria os clientes dos LLMs (e, se pedido, carrega o modelo de embeddings)
+# neste worker, para o primeiro pedido não pagar a inicialização
+@app.route('/warmup', methods=['POST'])
+def warmup():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    data = request.get_json(silent=True) or {}
+    started = time.time()
+    result = {'providers': llm_registry.warmup(data.get('providers'))}
+    if data.get('embeddings'):
+        embedding_service.warmup()
+        result['embeddings'] = embedding_service.stats['load_seconds']
+    result['seconds'] = round(time.time() - started, 3)
+    log_print(f"Aquecimento do worker {os.getpid()}: {result}")
+    return jsonify(result)
+
+# NOVA ROTA: Memória do mestre e de cada worker (RSS x compartilhada), para
+# acompanhar o ganho do pré-carregamento antes do fork
+@app.route('/memory', methods=['GET'])
+def memory():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return jsonify(memory_report())
+
+# NOVA ROTA: Saúde dos provedores (estado dos disjuntores, taxa de erro e latência)
+@app.route('/providers/health', methods=['GET'])
+def providers_health():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return jsonify({'pid': os.getpid(), 'providers': health_tracker.status()})
+
+# NOVA ROTA: Estatísticas do cache de documentos extraídos
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return jsonify({'documents': document_cache.stats(), 'embeddings': embedding_service.status(), 'results': result_store.status()})
+
+# NOVAS ROTAS: Biblioteca persistente de documentos
+@app.route('/library', methods=['GET'])
+def library():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return jsonify({'collections': list_collections()})
+
+@app.route('/library/<collection_name>', methods=['GET'])
+def library_collection(collection_name):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    try:
+        collection = get_collection(collection_name)
+    except LibraryError as e:
+        return jsonify({'error': str(e)}), 400
+    if not collection.exists():
+        return jsonify({'error': 'Coleção não encontrada'}), 404
+    return jsonify({'name': collection_name, 'documents': collection.list_documents()})
+
+@app.route('/library/<collection_name>/documents', methods=['POST'])
+def library_add_documents(collection_name):
+    """Indexa os arquivos enviados na coleção (uma única vez por conteúdo)."""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo fornecido'}), 400
+
+    added = []
+    for file in files:
+        filename = os.path.basename(file.filename)
+        file_path = os.path.join('uploads', str(uuid.uuid4()) + "_" + filename)
+        file.save(file_path)
+        try:
+            added.append(index_into_library(collection_name, file_path, filename))
+        except (LibraryError, ValueError) as e:
+            return jsonify({'error': str(e), 'documents': added}), 400
+        finally:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+    return jsonify({'collection': collection_name, 'documents': added})
+
+@app.route('/library/<collection_name>/documents/<int:document_id>', methods=['DELETE'])
+def library_remove_document(collection_name, document_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    try:
+        get_collection(collection_name).remove_document(document_id)
+    except LibraryError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'status': 'removed', 'id': document_id})
+
 @app.route('/process', methods=['POST'])
 def process():
-    """Processa a solicitação do usuário nos modos Hierárquico ou Atômico."""
+    """Processa a solicitação do usuário nos modos Hierárquico, Atômico ou Por Seções."""
     if not session.get('logged_in'):
         return jsonify({'error': 'Não autorizado'}), 401
-    global processing_cancelled
-    processing_cancelled = False  # Reset do flag de cancelamento
+    # Cada execução tem seu próprio job e token de cancelamento
+    job = jobs.create('process')
     
-    log_print("=== ROTA PROCESS ACESSADA ===")
+    log_print(f"=== ROTA PROCESS ACESSADA (job {job.id}) ===")
     
     form_data = request.form
+    job.use_cache = cache_requested(form_data)
     files = request.files.getlist('files')
     contexto = form_data.get('contexto', '').strip()
     mode = form_data.get('mode', 'real')
@@ -208,8 +528,9 @@ def process():
     # NOVOS PARÂMETROS: Tamanho do texto
     min_chars = int(form_data.get('min_chars', 24000))
     max_chars = int(form_data.get('max_chars', 30000))
+    streaming = streaming_requested(form_data)
     
-    log_print(f"Mode: {mode}, Processing: {processing_mode}")
+    log_print(f"Mode: {mode}, Processing: {processing_mode}, Streaming: {streaming}")
     log_print(f"Tamanho solicitado: {min_chars} - {max_chars} caracteres")
     
     temp_file_paths = []
@@ -223,9 +544,11 @@ def process():
 
     def generate_stream(current_mode, form_data, file_paths):
         """Gera a resposta em streaming para o front-end."""
-        global processing_cancelled
-        
         log_print(f"=== GENERATE_STREAM INICIADO - Mode: {current_mode} ===")
+
+        # O primeiro evento informa o job, usado pelo front-end para cancelar
+        json_data = safe_json_dumps({'job_id': job.id})
+        yield f"data: {json_data}\n\n"
         
         solicitacao_usuario = form_data.get('solicitacao', '')
         contexto = form_data.get('contexto', '')
@@ -234,9 +557,9 @@ def process():
             log_print("=== MODO TESTE EXECUTADO ===")
             mock_text = form_data.get('mock_text', 'Este é um **texto** de `simulação`.')
             # json_data = safe_json_dumps({'progress': 100, 'message': 'Simulação concluída!', 'partial_result': {'id': 'grok-output', 'content': mock_text}, 'done': True, 'mode': 'atomic' if processing_mode == 'atomic' else 'hierarchical'})
-            json_data = safe_json_dumps({'progress': 100, 'message': 'Simulação concluída!', 'partial_result': {'id': 'openai-output', 'content': mock_text}, 'done': True, 'mode': 'atomic' if processing_mode == 'atomic' else 'hierarchical'})
+            json_data = safe_json_dumps({'progress': 100, 'message': 'Simulação concluída!', 'partial_result': {'id': 'openai-output', 'content': mock_text}, 'done': True, 'mode': processing_mode if processing_mode in ('atomic', 'sectioned') else 'hierarchical'})
             yield f"data: {json_data}\n\n"
-            if processing_mode == 'atomic':
+            if processing_mode in ('atomic', 'sectioned'):
                 json_data = safe_json_dumps({'partial_result': {'id': 'sonnet-output', 'content': mock_text}})
                 yield f"data: {json_data}\n\n"
                 json_data = safe_json_dumps({'partial_result': {'id': 'gemini-output', 'content': mock_text}})
@@ -252,7 +575,37 @@ def process():
                 log_print("=== INICIANDO PROCESSAMENTO REAL ===")
                 json_data = safe_json_dumps({'progress': 0, 'message': 'Processando arquivos e extraindo contexto...'})
                 yield f"data: {json_data}\n\n"
-                rag_context = get_relevant_context(file_paths, solicitacao_usuario)
+                # A extração roda em segundo plano e reporta o progresso por arquivo
+                extraction_events = queue.Queue()
+                extraction_result = {}
+
+                def run_extraction():
+                    try:
+                        extraction_result['context'] = get_relevant_context(
+                            file_paths, solicitacao_usuario, form_data.get('rag_mode'),
+                            progress_callback=lambda done, total, filename: extraction_events.put((done, total, filename)),
+                            collections=parse_collection_names(form_data.get('library_collections'))
+                        )
+                    except Exception as e:
+                        extraction_result['error'] = e
+                    finally:
+                        extraction_events.put(None)
+
+                threading.Thread(target=run_extraction, daemon=True).start()
+                while True:
+                    event = extraction_events.get()
+                    if event is None:
+                        break
+                    if job.cancelled:
+                        json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
+                        yield f"data: {json_data}\n\n"
+                        return
+                    done, total, filename = event
+                    json_data = safe_json_dumps({'progress': int(10 * done / total), 'message': f'Arquivo {done}/{total} processado: {filename}'})
+                    yield f"data: {json_data}\n\n"
+                if 'error' in extraction_result:
+                    raise extraction_result['error']
+                rag_context = extraction_result['context']
                 log_print(f"=== RAG CONTEXT OBTIDO: {len(rag_context)} chars ===")
                 
                 output_parser = StrOutputParser()
@@ -261,39 +614,28 @@ def process():
                     log_print("=== MODO ATÔMICO SELECIONADO ===")
                     # --- LÓGICA ATÔMICA (PARALELA) ---
                     results = {}
-                    threads = []
-                    
-                    def run_chain_with_timeout(chain, inputs, key, timeout=300):
-                        def task():
-                            if processing_cancelled:
-                                return "CANCELLED"
-                            return chain.invoke(inputs)
-                        
-                        with concurrent.futures.ThreadPoolExecutor() as executor:
-                            future = executor.submit(task)
-                            try:
-                                result = future.result(timeout=timeout)
-                                if result == "CANCELLED":
-                                    results[key] = "CANCELLED"
-                                elif not result or not result.strip():
-                                    results[key] = "Error:EmptyResponse"
-                                else:
-                                    results[key] = result
-                            except concurrent.futures.TimeoutError:
-                                results[key] = f"Erro ao processar {key.upper()}: Tempo limite excedido."
-                            except Exception as e:
-                                results[key] = f"Erro ao processar {key.upper()}: {e}"
-
-                    claude_atomic_llm = claude_llm.bind(max_tokens=60000)
+                    futures = {}
+                    delta_queue = queue.Queue()
+                    coalescers = {}
+                    # Modelos cuja caixa recebeu um aviso (ignorados ou com falha)
+                    notified = set()
+
+                    def on_piece(key, piece):
+                        # Executado na thread do agendador: agrupa e repassa ao gerador SSE
+                        frame = coalescers[key].add(piece)
+                        if frame:
+                            delta_queue.put((key, frame))
+
                     #models = {'grok': grok_llm, 'sonnet': claude_atomic_llm, 'gemini': gemini_llm, 'openai': openai_llm}
                     # Melhoria 05/08/2025 - Multi-modelo
+                    # (os LLMs são obtidos em build_atomic_call; aqui só o provedor de cada modelo)
                     models = {}
                     if form_data.get('modelo-openai') == 'on':
-                        models['openai'] = openai_llm
+                        models['openai'] = MODEL_PROVIDERS['openai']
                     if form_data.get('modelo-sonnet') == 'on':
-                        models['sonnet'] = claude_atomic_llm
+                        models['sonnet'] = MODEL_PROVIDERS['sonnet']
                     if form_data.get('modelo-gemini') == 'on':
-                        models['gemini'] = gemini_llm
+                        models['gemini'] = MODEL_PROVIDERS['gemini']
                     
                     # Verificação se pelo menos um modelo foi selecionado
                     if not models:
@@ -314,37 +656,123 @@ def process():
                               f"{updated_prompt_template.format(contexto=contexto, solicitacao_usuario=solicitacao_usuario, rag_context=rag_context)}\n""-"*80)                   
                     
                     prompt = PromptTemplate(template=updated_prompt_template, input_variables=["contexto", "solicitacao_usuario", "rag_context"])
+
+                    def build_atomic_call(model_name):
+                        """(chain, inputs, provedor, prazo) de um modelo, com o prazo adaptativo do provedor."""
+                        # Ajusta o contexto e a saída à janela de cada provedor
+                        provider = MODEL_PROVIDERS[model_name]
+                        inputs, max_tokens, _ = fit_prompt(
+                            provider, updated_prompt_template,
+                            {"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "rag_context": rag_context},
+                            max_tokens=60000 if model_name == 'sonnet' else None,
+                            min_output_tokens=output_tokens_for_chars(max_chars, provider),
+                            trimmable=("rag_context",)
+                        )
+                        llm = model_llm(model_name)
+                        if model_name == 'sonnet':
+                            llm = llm.bind(max_tokens=max_tokens)
+                        chain = prompt | prefix_cached(llm) | output_parser
+                        deadline = latency_tracker.deadline(provider, prompt_chars(inputs), default=ATOMIC_TIMEOUT)
+                        return chain, inputs, provider, deadline
+
                     json_data = safe_json_dumps({'progress': 15, 'message': 'Iniciando processamento paralelo...'})
                     yield f"data: {json_data}\n\n"
                     
-                    for name, llm in models.items():
-                        if processing_cancelled:
+                    for name in list(models):
+                        if job.cancelled:
                             json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                             yield f"data: {json_data}\n\n"
                             return
-                            
-                        chain = prompt | llm | output_parser
-                        thread = threading.Thread(target=run_chain_with_timeout, args=(chain, {"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "rag_context": rag_context}, name))
-                        threads.append(thread)
-                        thread.start()
-
-                    for thread in threads:
-                        thread.join()
+
+                        # Provedor sem configuração ou com o circuito aberto: pula o modelo e avisa, sem esperar o timeout
+                        notice = unavailable_notice(name)
+                        if notice is None:
+                            try:
+                                primary = build_atomic_call(name)
+                            except ProviderNotConfigured as e:
+                                notice = str(e)
+                        if notice is not None:
+                            log_print(f"Modelo {name} ignorado: {notice}")
+                            json_data = safe_json_dumps({'notice': {'id': f'{name}-output', 'message': f'{name.upper()} ignorado: {notice}'}})
+                            yield f"data: {json_data}\n\n"
+                            notified.add(name)
+                            del models[name]
+                            continue
+
+                        # Reserva (hedging): o mesmo modelo ou o alternativo configurado, se estiver disponível
+                        backup_name = HEDGE_ALTERNATES.get(name, name)
+                        hedge_after = None
+                        backup_provider = MODEL_PROVIDERS.get(backup_name)
+                        if backup_provider and llm_registry.configured(backup_provider) and health_tracker.available(backup_provider):
+                            hedge_after = latency_tracker.hedge_delay(primary[2], prompt_chars(primary[1]))
+                        backup = None
+                        if hedge_after:
+                            try:
+                                backup = build_atomic_call(backup_name)
+                            except ProviderNotConfigured:
+                                hedge_after = None
+                        # Todas as chamadas passam pelo agendador compartilhado (concorrência limitada)
+                        if streaming:
+                            coalescers[name] = FrameCoalescer(name.upper())
+                            future = llm_scheduler.submit_hedged(primary, backup, hedge_after, on_piece=lambda piece, key=name: on_piece(key, piece), token=job.token, use_cache=job.use_cache)
+                        else:
+                            future = llm_scheduler.submit_hedged(primary, backup, hedge_after, token=job.token, use_cache=job.use_cache)
+                        future.add_done_callback(lambda _, key=name: delta_queue.put((key, None)))
+                        futures[name] = future
+
+                    if not futures:
+                        json_data = safe_json_dumps({'error': 'Nenhum dos modelos selecionados está disponível no momento. Tente novamente em alguns instantes.'})
+                        yield f"data: {json_data}\n\n"
+                        return
+
+                    # Encaminha os deltas de todos os modelos até que terminem
+                    pending = set(futures)
+                    # (cancelar o job cancela as tarefas, que também chegam aqui como concluídas)
+                    while pending:
+                        key, frame = delta_queue.get()
+                        if frame is None:
+                            pending.discard(key)
+                            frame = coalescers[key].flush() if key in coalescers else None
+                            if not frame:
+                                continue
+                        json_data = safe_json_dumps(job.streamed.delta(f'{key}-output', frame))
+                        yield f"data: {json_data}\n\n"
+
+                    for key, future in futures.items():
+                        try:
+                            result = future.result()
+                            results[key] = result if result and result.strip() else "Error:EmptyResponse"
+                        except concurrent.futures.CancelledError:
+                            results[key] = "CANCELLED"
+                        except TimeoutError:
+                            results[key] = f"Erro ao processar {key.upper()}: Tempo limite excedido."
+                        except Exception as e:
+                            results[key] = f"Erro ao processar {key.upper()}: {e}"
                     
                     # Verificar se foi cancelado
-                    if processing_cancelled or any(result == "CANCELLED" for result in results.values()):
+                    if job.cancelled or any(result == "CANCELLED" for result in results.values()):
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
                     
+                    # Um modelo que falhou não derruba os demais: a caixa dele recebe o aviso
+                    # e o processamento segue com as respostas que chegaram
+                    failed = {}
                     for key, result in results.items():
                         if result == "Error:EmptyResponse" or "Erro ao processar" in result:
-                            error_msg = result if "Erro ao processar" in result else f"Falha no serviço {key.upper()}: Sem resposta."
-                            json_data = safe_json_dumps({'error': error_msg})
+                            failed[key] = result if "Erro ao processar" in result else f"Falha no serviço {key.upper()}: Sem resposta."
+                            notified.add(key)
+                            log_print(f"Modelo {key} falhou: {failed[key]}")
+                            json_data = safe_json_dumps({'notice': {'id': f'{key}-output', 'message': failed[key]}})
                             yield f"data: {json_data}\n\n"
-                            return
 
-                    json_data = safe_json_dumps({'progress': 80, 'message': 'Todos os modelos responderam. Formatando saídas...'})
+                    if len(failed) == len(results):
+                        json_data = safe_json_dumps({'error': ' | '.join(failed.values())})
+                        yield f"data: {json_data}\n\n"
+                        return
+
+                    message = 'Todos os modelos responderam. Formatando saídas...' if not failed else f'{len(results) - len(failed)} de {len(results)} modelos responderam. Formatando saídas...'
+                    json_data = safe_json_dumps({'progress': 80, 'message': message})
                     yield f"data: {json_data}\n\n"
                     
                     # Envia o texto bruto para cada modelo
@@ -353,24 +781,221 @@ def process():
                     ##json_data = safe_json_dumps({'partial_result': {'id': 'grok-output', 'content': grok_text}})
                     ##yield f"data: {json_data}\n\n"
 
-                    openai_text = results.get('openai', '')
-                    log_print(f"--- Resposta Bruta do OPEN AI (Atômico) ---\n{openai_text[:200]}...\n--------------------------------------")
-                    json_data = safe_json_dumps({'partial_result': {'id': 'openai-output', 'content': openai_text}})
+                    for key, label in (('openai', 'OPEN AI'), ('sonnet', 'Sonnet'), ('gemini', 'Gemini')):
+                        if key in notified:
+                            continue
+                        text = results.get(key, '')
+                        log_print(f"--- Resposta Bruta do {label} (Atômico) ---\n{text[:200]}...\n--------------------------------------")
+                        if text:
+                            result_store.put(job.id, f'{key}-output', text)
+                        yield from result_events(job, f'{key}-output', text)
+                    
+                    json_data = safe_json_dumps({'progress': 100, 'message': 'Processamento Atômico concluído!', 'done': True, 'mode': 'atomic'})
                     yield f"data: {json_data}\n\n"
+                
+                elif processing_mode == 'sectioned':
+                    log_print("=== MODO POR SEÇÕES SELECIONADO ===")
+                    # --- ESBOÇO PRIMEIRO, DEPOIS AS SEÇÕES EM PARALELO ---
+                    started = time.time()
+                    selected = [name for name in ('openai', 'sonnet', 'gemini') if form_data.get(f'modelo-{name}') == 'on']
+                    if not selected:
+                        json_data = safe_json_dumps({'error': 'Você deve selecionar pelo menos um modelo para processamento.'})
+                        yield f"data: {json_data}\n\n"
+                        return
+
+                    # Provedor sem configuração ou com o circuito aberto: pula o modelo e avisa, como no modo atômico
+                    models = {}
+                    for name in selected:
+                        notice = unavailable_notice(name)
+                        if notice is None:
+                            try:
+                                models[name] = model_llm(name)
+                            except ProviderNotConfigured as e:
+                                notice = str(e)
+                        if notice is not None:
+                            log_print(f"Modelo {name} ignorado: {notice}")
+                            json_data = safe_json_dumps({'notice': {'id': f'{name}-output', 'message': f'{name.upper()} ignorado: {notice}'}})
+                            yield f"data: {json_data}\n\n"
+
+                    if not models:
+                        json_data = safe_json_dumps({'error': 'Nenhum dos modelos selecionados está disponível no momento. Tente novamente em alguns instantes.'})
+                        yield f"data: {json_data}\n\n"
+                        return
 
-                    sonnet_text = results.get('sonnet', '')
-                    log_print(f"--- Resposta Bruta do Sonnet (Atômico) ---\n{sonnet_text[:200]}...\n----------------------------------------")
-                    json_data = safe_json_dumps({'partial_result': {'id': 'sonnet-output', 'content': sonnet_text}})
+                    json_data = safe_json_dumps({'progress': 15, 'message': 'Gerando o esboço das seções...'})
                     yield f"data: {json_data}\n\n"
 
-                    gemini_text = results.get('gemini', '')
-                    log_print(f"--- Resposta Bruta do Gemini (Atômico) ---\n{gemini_text[:200]}...\n----------------------------------------")
-                    json_data = safe_json_dumps({'partial_result': {'id': 'gemini-output', 'content': gemini_text}})
+                    outline_template = PROMPT_SECOES_ESBOCO.replace(
+                        "MIN_CHARS_PLACEHOLDER", str(min_chars)
+                    ).replace(
+                        "MAX_CHARS_PLACEHOLDER", str(max_chars)
+                    ).replace(
+                        "NUM_SECOES_MIN_PLACEHOLDER", str(SECTIONED_MIN_SECTIONS)
+                    ).replace(
+                        "NUM_SECOES_MAX_PLACEHOLDER", str(SECTIONED_MAX_SECTIONS)
+                    )
+                    outline_prompt = PromptTemplate(template=outline_template, input_variables=["contexto", "solicitacao_usuario", "rag_context"])
+                    outline_futures = {}
+                    for name, llm in models.items():
+                        inputs, _, _ = fit_prompt(
+                            MODEL_PROVIDERS[name], outline_template,
+                            {"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "rag_context": rag_context},
+                            trimmable=("rag_context",)
+                        )
+                        chain = outline_prompt | prefix_cached(llm) | output_parser
+                        outline_futures[name] = llm_scheduler.submit_invoke(chain, inputs, timeout=SECTIONED_TIMEOUT, token=job.token, use_cache=job.use_cache, provider=MODEL_PROVIDERS[name])
+
+                    def failure_message(name, error):
+                        if isinstance(error, TimeoutError):
+                            return f'Erro ao processar {name.upper()}: Tempo limite excedido.'
+                        return f'Erro ao processar {name.upper()}: {error}'
+
+                    # Um modelo que falhou não derruba os demais (como no modo atômico): a caixa
+                    # dele recebe o aviso e o processamento segue com os outros
+                    failed = {}
+                    outlines = {}
+                    for name, future in outline_futures.items():
+                        try:
+                            outline_text = future.result()
+                        except concurrent.futures.CancelledError:
+                            raise
+                        except Exception as e:
+                            failed[name] = failure_message(name, e)
+                            log_print(f"Modelo {name} falhou no esboço: {failed[name]}")
+                            json_data = safe_json_dumps({'notice': {'id': f'{name}-output', 'message': failed[name]}})
+                            yield f"data: {json_data}\n\n"
+                            continue
+                        sections = parse_outline(outline_text)
+                        if not sections:
+                            log_print(f"=== {name.upper()}: ESBOÇO NÃO APROVEITÁVEL, USANDO SEÇÃO ÚNICA ===")
+                            sections = [Section(title='', summary='O texto completo solicitado pelo usuário.')]
+                        outlines[name] = allocate_chars(sections, min_chars, max_chars)
+                        log_print(f"--- Esboço do {name.upper()} ---\n{describe_outline(sections)}\n--------------------------------------")
+
+                    if not outlines:
+                        json_data = safe_json_dumps({'error': ' | '.join(failed.values())})
+                        yield f"data: {json_data}\n\n"
+                        return
+
+                    total_sections = sum(len(sections) for sections in outlines.values())
+                    json_data = safe_json_dumps({'progress': 25, 'message': f'Esboço pronto. Escrevendo {total_sections} seções em paralelo...'})
                     yield f"data: {json_data}\n\n"
-                    
-                    json_data = safe_json_dumps({'progress': 100, 'message': 'Processamento Atômico concluído!', 'done': True, 'mode': 'atomic'})
+
+                    # Cada seção recebe sua parte do tamanho e o recorte do contexto mais relevante para ela
+                    section_futures = {}
+                    delta_queue = queue.Queue()
+                    coalescers = {}
+                    ordered = {name: OrderedSectionStream(sections) for name, sections in outlines.items()}
+
+                    def on_section_piece(key, piece):
+                        frame = coalescers[key].add(piece)
+                        if frame:
+                            delta_queue.put((key, frame))
+
+                    for name, sections in outlines.items():
+                        llm = models[name]
+                        provider = MODEL_PROVIDERS[name]
+                        esboco = describe_outline(sections)
+                        for index, section in enumerate(sections):
+                            section_template = PROMPT_SECOES_SECAO.replace(
+                                "MIN_CHARS_PLACEHOLDER", str(section.min_chars)
+                            ).replace(
+                                "MAX_CHARS_PLACEHOLDER", str(section.max_chars)
+                            )
+                            section_prompt = PromptTemplate(template=section_template, input_variables=["contexto", "solicitacao_usuario", "esboco", "rag_context", "posicao_secao", "titulo_secao", "resumo_secao"])
+                            inputs, max_tokens, _ = fit_prompt(
+                                provider, section_template,
+                                {
+                                    "contexto": contexto,
+                                    "solicitacao_usuario": solicitacao_usuario,
+                                    "esboco": esboco,
+                                    "rag_context": slice_context(rag_context, f"{section.title}. {section.summary}", SECTIONED_CONTEXT_CHARS),
+                                    "posicao_secao": f"{index + 1} de {len(sections)}",
+                                    "titulo_secao": section.title,
+                                    "resumo_secao": section.summary
+                                },
+                                max_tokens=60000 if name == 'sonnet' else None,
+                                min_output_tokens=output_tokens_for_chars(section.max_chars, provider),
+                                trimmable=("rag_context",)
+                            )
+                            section_llm = llm.bind(max_tokens=max_tokens) if name == 'sonnet' else llm
+                            chain = section_prompt | prefix_cached(section_llm) | output_parser
+                            key = (name, index)
+                            if streaming:
+                                coalescers[key] = FrameCoalescer(f"{name.upper()} SEÇÃO {index + 1}")
+                                future = llm_scheduler.submit_stream(chain, inputs, lambda piece, key=key: on_section_piece(key, piece), timeout=SECTIONED_TIMEOUT, token=job.token, use_cache=job.use_cache, provider=provider)
+                            else:
+                                future = llm_scheduler.submit_invoke(chain, inputs, timeout=SECTIONED_TIMEOUT, token=job.token, use_cache=job.use_cache, provider=provider)
+                            future.add_done_callback(lambda _, key=key: delta_queue.put((key, None)))
+                            section_futures[key] = future
+
+                    # Repassa os deltas na ordem das seções e informa o progresso a cada seção concluída
+                    pending = set(section_futures)
+                    while pending:
+                        key, frame = delta_queue.get()
+                        name, index = key
+                        text = ''
+                        if frame is None:
+                            pending.discard(key)
+                            future = section_futures[key]
+                            if name not in failed and not future.cancelled() and future.exception() is not None:
+                                # Seção com erro: as demais seções do modelo são canceladas e a caixa recebe o aviso
+                                failed[name] = failure_message(name, future.exception())
+                                log_print(f"Modelo {name} falhou na seção {index + 1}: {failed[name]}")
+                                for (other, _), sibling in section_futures.items():
+                                    if other == name:
+                                        sibling.cancel()
+                                json_data = safe_json_dumps({'notice': {'id': f'{name}-output', 'message': failed[name]}})
+                                yield f"data: {json_data}\n\n"
+                            if streaming:
+                                leftover = coalescers[key].flush()
+                                text = (ordered[name].add(index, leftover) if leftover else None) or ''
+                                text += ordered[name].finish(index) or ''
+                            done_sections = len(section_futures) - len(pending)
+                            json_data = safe_json_dumps({'progress': 25 + int(55 * done_sections / len(section_futures)), 'message': f'Seções concluídas: {done_sections}/{len(section_futures)}'})
+                            yield f"data: {json_data}\n\n"
+                        else:
+                            text = ordered[name].add(index, frame) or ''
+                        if text and name not in failed:
+                            json_data = safe_json_dumps(job.streamed.delta(f'{name}-output', text))
+                            yield f"data: {json_data}\n\n"
+
+                    if job.cancelled:
+                        json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
+                        yield f"data: {json_data}\n\n"
+                        return
+
+                    results = {}
+                    for name, sections in outlines.items():
+                        if name in failed:
+                            continue
+                        contents = [section_futures[(name, index)].result() for index in range(len(sections))]
+                        if not any(content and content.strip() for content in contents):
+                            failed[name] = f'Falha no serviço {name.upper()}: Sem resposta.'
+                            log_print(f"Modelo {name} falhou: {failed[name]}")
+                            json_data = safe_json_dumps({'notice': {'id': f'{name}-output', 'message': failed[name]}})
+                            yield f"data: {json_data}\n\n"
+                            continue
+                        results[name] = stitch(sections, contents)
+
+                    if not results:
+                        json_data = safe_json_dumps({'error': ' | '.join(failed.values())})
+                        yield f"data: {json_data}\n\n"
+                        return
+
+                    log_print(f"=== SEÇÕES CONCLUÍDAS EM {time.time() - started:.1f}s ===")
+                    message = 'Todas as seções foram escritas. Montando os textos...' if not failed else f'{len(results)} de {len(outline_futures)} modelos responderam. Montando os textos...'
+                    json_data = safe_json_dumps({'progress': 90, 'message': message})
                     yield f"data: {json_data}\n\n"
-                
+
+                    for name, text in results.items():
+                        log_print(f"--- Resposta por seções do {name.upper()}: {len(text)} chars ---")
+                        result_store.put(job.id, f'{name}-output', text)
+                        yield from result_events(job, f'{name}-output', text)
+
+                    json_data = safe_json_dumps({'progress': 100, 'message': 'Processamento por seções concluído!', 'done': True, 'mode': 'sectioned'})
+                    yield f"data: {json_data}\n\n"
+
                 else:
                     log_print("=== MODO HIERÁRQUICO SELECIONADO ===")
                     
@@ -420,7 +1045,7 @@ def process():
                     json_data = safe_json_dumps({'progress': 15, 'message': 'A OPEN AI está processando sua solicitação...'})
                     yield f"data: {json_data}\n\n"
                     
-                    if processing_cancelled:
+                    if job.cancelled:
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
@@ -435,13 +1060,22 @@ def process():
                     # openai_with_max_tokens = openai_llm.bind(max_completion_tokens=100000)
                     prompt_openai = PromptTemplate(template=updated_openai_template, input_variables=["contexto", "solicitacao_usuario", "rag_context"])
                     # chain_openai = prompt_openai | openai_with_max_tokens | output_parser
-                    chain_openai = prompt_openai | openai_llm | output_parser
-                    resposta_openai = chain_openai.invoke({"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "rag_context": rag_context})
+                    chain_openai = prompt_openai | prefix_cached(model_llm('openai')) | output_parser
+                    inputs_openai, _, _ = fit_prompt(
+                        'openai', updated_openai_template,
+                        {"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "rag_context": rag_context},
+                        min_output_tokens=output_tokens_for_chars(max_chars, 'openai'),
+                        trimmable=("rag_context",)
+                    )
+                    if streaming:
+                        resposta_openai = yield from stream_chain_events(chain_openai, inputs_openai, 'openai-output', 'OPEN AI', job, provider='openai')
+                    else:
+                        resposta_openai = llm_scheduler.invoke(chain_openai, inputs_openai, token=job.token, use_cache=job.use_cache, provider='openai')
                     
                     log_print(f"=== OPEN AI TERMINOU: {len(resposta_openai)} chars ===")
 
 
-                    if processing_cancelled:
+                    if job.cancelled:
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
@@ -463,23 +1097,33 @@ def process():
                         return
                     
                     log_print("=== ENVIANDO RESPOSTA OPEN AI PARA FRONTEND ===")
-                    json_data = safe_json_dumps({'progress': 33, 'message': 'Claude Sonnet está processando...', 'partial_result': {'id': 'openai-output', 'content': resposta_openai}})
-                    yield f"data: {json_data}\n\n"
+                    result_store.put(job.id, 'openai-output', resposta_openai)
+                    yield from result_events(job, 'openai-output', resposta_openai, progress=33, message='Claude Sonnet está processando...')
                     
-                    if processing_cancelled:
+                    if job.cancelled:
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
                     
                     log_print("=== PROCESSANDO SONNET ===")
                     prompt_sonnet = PromptTemplate(template=updated_sonnet_template, input_variables=["contexto", "solicitacao_usuario", "texto_para_analise"])
-                    claude_with_max_tokens = claude_llm.bind(max_tokens=60000)
-                    chain_sonnet = prompt_sonnet | claude_with_max_tokens | output_parser
-                    resposta_sonnet = chain_sonnet.invoke({"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "texto_para_analise": resposta_openai})
+                    inputs_sonnet, sonnet_max_tokens, _ = fit_prompt(
+                        'claude', updated_sonnet_template,
+                        {"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "texto_para_analise": resposta_openai},
+                        max_tokens=60000,
+                        min_output_tokens=output_tokens_for_chars(max_chars, 'claude'),
+                        trimmable=("texto_para_analise",)
+                    )
+                    claude_with_max_tokens = model_llm('sonnet').bind(max_tokens=sonnet_max_tokens)
+                    chain_sonnet = prompt_sonnet | prefix_cached(claude_with_max_tokens) | output_parser
+                    if streaming:
+                        resposta_sonnet = yield from stream_chain_events(chain_sonnet, inputs_sonnet, 'sonnet-output', 'SONNET', job, provider='claude')
+                    else:
+                        resposta_sonnet = llm_scheduler.invoke(chain_sonnet, inputs_sonnet, token=job.token, use_cache=job.use_cache, provider='claude')
                     
                     log_print(f"=== SONNET TERMINOU: {len(resposta_sonnet)} chars ===")
                     
-                    if processing_cancelled:
+                    if job.cancelled:
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
@@ -491,22 +1135,31 @@ def process():
                         return
 
                     log_print("=== ENVIANDO RESPOSTA SONNET ===")
-                    json_data = safe_json_dumps({'progress': 66, 'message': 'Gemini está processando...', 'partial_result': {'id': 'sonnet-output', 'content': resposta_sonnet}})
-                    yield f"data: {json_data}\n\n"
+                    result_store.put(job.id, 'sonnet-output', resposta_sonnet)
+                    yield from result_events(job, 'sonnet-output', resposta_sonnet, progress=66, message='Gemini está processando...')
                     
-                    if processing_cancelled:
+                    if job.cancelled:
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
                     
                     log_print("=== PROCESSANDO GEMINI ===")
                     prompt_gemini = PromptTemplate(template=updated_gemini_template, input_variables=["contexto", "solicitacao_usuario", "texto_para_analise"])
-                    chain_gemini = prompt_gemini | gemini_llm | output_parser
-                    resposta_gemini = chain_gemini.invoke({"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "texto_para_analise": resposta_sonnet})
+                    chain_gemini = prompt_gemini | prefix_cached(model_llm('gemini')) | output_parser
+                    inputs_gemini, _, _ = fit_prompt(
+                        'gemini', updated_gemini_template,
+                        {"contexto": contexto, "solicitacao_usuario": solicitacao_usuario, "texto_para_analise": resposta_sonnet},
+                        min_output_tokens=output_tokens_for_chars(max_chars, 'gemini'),
+                        trimmable=("texto_para_analise",)
+                    )
+                    if streaming:
+                        resposta_gemini = yield from stream_chain_events(chain_gemini, inputs_gemini, 'gemini-output', 'GEMINI', job, provider='gemini')
+                    else:
+                        resposta_gemini = llm_scheduler.invoke(chain_gemini, inputs_gemini, token=job.token, use_cache=job.use_cache, provider='gemini')
                     
                     log_print(f"=== GEMINI TERMINOU: {len(resposta_gemini)} chars ===")
                     
-                    if processing_cancelled:
+                    if job.cancelled:
                         json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                         yield f"data: {json_data}\n\n"
                         return
@@ -518,10 +1171,14 @@ def process():
                         return
 
                     log_print("=== ENVIANDO RESPOSTA GEMINI ===")
-                    json_data = safe_json_dumps({'progress': 100, 'message': 'Processamento concluído!', 'partial_result': {'id': 'gemini-output', 'content': resposta_gemini}, 'done': True, 'mode': 'hierarchical'})
-                    yield f"data: {json_data}\n\n"
+                    result_store.put(job.id, 'gemini-output', resposta_gemini)
+                    yield from result_events(job, 'gemini-output', resposta_gemini, progress=100, message='Processamento concluído!', done=True, mode='hierarchical')
                     log_print("=== PROCESSAMENTO COMPLETO ===")
 
+            except concurrent.futures.CancelledError:
+                log_print(f"=== JOB {job.id} CANCELADO ===")
+                json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
+                yield f"data: {json_data}\n\n"
             except Exception as e:
                 log_print(f"Ocorreu um erro durante o processamento: {e}")
                 import traceback
@@ -529,15 +1186,16 @@ def process():
                 json_data = safe_json_dumps({'error': f'Ocorreu um erro inesperado na aplicação: {e}'})
                 yield f"data: {json_data}\n\n"
 
-    return Response(generate_stream(mode, form_data, temp_file_paths), mimetype='text/event-stream')
+    # O job roda em segundo plano; a conexão apenas acompanha seu log de eventos
+    jobs.start(job, generate_stream(mode, form_data, temp_file_paths))
+    return job_response(job, form_data)
 
 @app.route('/merge', methods=['POST'])
 def merge():
     """Recebe os textos do modo Atômico e os consolida usando Claude Sonnet."""
     if not session.get('logged_in'):
         return jsonify({'error': 'Não autorizado'}), 401
-    global merge_full_content, processing_cancelled
-    processing_cancelled = False  # Reset do flag
+    job = jobs.create('merge')
     
     data = request.get_json()
     
@@ -545,20 +1203,20 @@ def merge():
     contexto = data.get('contexto', '')
     min_chars = int(data.get('min_chars', 24000))
     max_chars = int(data.get('max_chars', 30000))
+    streaming = streaming_requested(data)
+    job.use_cache = cache_requested(data)
     
     log_print("=== ROTA MERGE ACESSADA ===")
     log_print("=== USANDO CLAUDE SONNET PARA MERGE ===")
     
     def generate_merge_stream():
         """Gera a resposta do merge em streaming."""
-        global merge_full_content, processing_cancelled
-        
         try:
-            log_print("=== INICIANDO MERGE STREAM ===")
-            json_data = safe_json_dumps({'progress': 0, 'message': 'Iniciando o processo de merge...'})
+            log_print(f"=== INICIANDO MERGE STREAM (job {job.id}) ===")
+            json_data = safe_json_dumps({'job_id': job.id, 'progress': 0, 'message': 'Iniciando o processo de merge...'})
             yield f"data: {json_data}\n\n"
             
-            if processing_cancelled:
+            if job.cancelled:
                 json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                 yield f"data: {json_data}\n\n"
                 return
@@ -596,9 +1254,24 @@ def merge():
             
             prompt_merge = PromptTemplate(template=updated_merge_template, input_variables=["contexto", "solicitacao_usuario", "texto_para_analise_openai", "texto_para_analise_sonnet", "texto_para_analise_gemini"])
 
+            # Ajusta os três textos e a saída à janela do Claude
+            inputs_merge, merge_max_tokens, _ = fit_prompt(
+                'claude', updated_merge_template,
+                {
+                    "contexto": data.get('contexto'),
+                    "solicitacao_usuario": data.get('solicitacao_usuario'),
+                    "texto_para_analise_openai": data.get('openai_text'),
+                    "texto_para_analise_sonnet": data.get('sonnet_text'),
+                    "texto_para_analise_gemini": data.get('gemini_text')
+                },
+                max_tokens=64000,
+                min_output_tokens=output_tokens_for_chars(max_chars, 'claude'),
+                trimmable=("texto_para_analise_openai", "texto_para_analise_sonnet", "texto_para_analise_gemini")
+            )
+
             # MUDANÇA: Usar Claude Sonnet para o merge
-            claude_with_max_tokens = claude_llm.bind(max_tokens=64000)
-            chain_merge = prompt_merge | claude_with_max_tokens | output_parser
+            claude_with_max_tokens = model_llm('sonnet').bind(max_tokens=merge_max_tokens)
+            chain_merge = prompt_merge | prefix_cached(claude_with_max_tokens) | output_parser
 
 
 
@@ -606,23 +1279,19 @@ def merge():
             yield f"data: {json_data}\n\n"
             log_print("=== INVOCANDO CLAUDE SONNET PARA MERGE ===")
 
-            if processing_cancelled:
+            if job.cancelled:
                 json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                 yield f"data: {json_data}\n\n"
                 return
 
-            resposta_merge = chain_merge.invoke({
-                "contexto": data.get('contexto'), 
-                "solicitacao_usuario": data.get('solicitacao_usuario'),
-                ##"texto_para_analise_grok": data.get('grok_text'),
-                "texto_para_analise_openai": data.get('openai_text'),
-                "texto_para_analise_sonnet": data.get('sonnet_text'),
-                "texto_para_analise_gemini": data.get('gemini_text')
-            })
+            if streaming:
+                resposta_merge = yield from stream_chain_events(chain_merge, inputs_merge, 'final-output', 'MERGE SONNET', job, provider='claude')
+            else:
+                resposta_merge = llm_scheduler.invoke(chain_merge, inputs_merge, token=job.token, use_cache=job.use_cache, provider='claude')
             
             log_print(f"=== MERGE CLAUDE SONNET CONCLUÍDO: {len(resposta_merge)} chars ===")
             
-            if processing_cancelled:
+            if job.cancelled:
                 json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
                 yield f"data: {json_data}\n\n"
                 return
@@ -632,26 +1301,19 @@ def merge():
                 yield f"data: {json_data}\n\n"
                 return
             
-            # Armazena o conteúdo completo na variável global
-            merge_full_content = resposta_merge
+            # Armazena o conteúdo completo no armazenamento compartilhado pelos workers
+            result_store.put(job.id, 'final-output', resposta_merge)
             word_count = len(resposta_merge.split())
             
-            log_print(f"=== CRIANDO JSON DE RESPOSTA DO MERGE ===")
-            # Usa a função safe para evitar problemas com JSON muito grande
-            json_data = safe_json_dumps({
-                'progress': 100, 
-                'message': 'Merge concluído!', 
-                'final_result': {
-                    'content': resposta_merge, 
-                    'word_count': word_count
-                }, 
-                'done': True
-            })
-            
-            log_print(f"=== JSON CRIADO: {len(json_data)} chars ===")
-            yield f"data: {json_data}\n\n"
+            # Texto grande vai em partes numeradas, sem montar um JSON gigante
+            yield from result_events(job, 'final-output', resposta_merge, 'final_result', extra={'word_count': word_count},
+                                     progress=100, message='Merge concluído!', done=True)
             log_print("=== MERGE STREAM FINALIZADO ===")
 
+        except concurrent.futures.CancelledError:
+            log_print(f"=== JOB {job.id} CANCELADO ===")
+            json_data = safe_json_dumps({'error': 'Processamento cancelado pelo usuário.'})
+            yield f"data: {json_data}\n\n"
         except Exception as e:
             log_print(f"Erro no processo de merge: {e}")
             import traceback
@@ -659,8 +1321,13 @@ def merge():
             json_data = safe_json_dumps({'error': str(e)})
             yield f"data: {json_data}\n\n"
             
-    return Response(generate_merge_stream(), mimetype='text/event-stream')
+    jobs.start(job, generate_merge_stream())
+    return job_response(job, data)
+
 
+# Tempo de importação do app (o que cada worker paga ao subir); ver tools/startup_benchmark.py
+STARTUP_SECONDS = round(time.time() - STARTUP_STARTED, 3)
+log_print(f"App carregado em {STARTUP_SECONDS}s (pid {os.getpid()})")
 
 if __name__ == '__main__':
     log_print("=== SERVIDOR FLASK INICIADO ===")
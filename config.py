@@ -1,5 +1,10 @@
 # config.py
 
+# A linha CACHE_BREAK_PLACEHOLDER marca o fim do prefixo estável de cada prompt
+# (papel, documentos e textos de entrada), que os provedores podem guardar em
+# cache; o tamanho pedido e as instruções da chamada vêm depois dela.
+# Ver prompt_cache.py.
+
 # --- PROMPTS PARA O MODO HIERÁRQUICO ---
 
 PROMPT_HIERARQUICO_OPENAI = """
@@ -9,10 +14,6 @@ PROMPT_HIERARQUICO_OPENAI = """
   </role>
 
   <requirements>
-    <length_requirements>
-        <min_characters_no_spaces>MIN_CHARS_PLACEHOLDER</min_characters_no_spaces>
-        <max_characters_no_spaces>MAX_CHARS_PLACEHOLDER</max_characters_no_spaces>
-    </length_requirements>
     <language>Português do Brasil</language>
     <paragraph_structure>Parágrafos curtos para facilitar a leitura</paragraph_structure>
     <language_style>
@@ -29,13 +30,18 @@ PROMPT_HIERARQUICO_OPENAI = """
     {rag_context}
     ---
   </context_from_documents>
-
+CACHE_BREAK_PLACEHOLDER
   <user_request>
     <solicitacao_usuario>
       {solicitacao_usuario}
     </solicitacao_usuario>
   </user_request>
 
+  <length_requirements>
+    <min_characters_no_spaces>MIN_CHARS_PLACEHOLDER</min_characters_no_spaces>
+    <max_characters_no_spaces>MAX_CHARS_PLACEHOLDER</max_characters_no_spaces>
+  </length_requirements>
+
   <instructions>
     Com base na solicitação do usuário acima, desenvolva um texto que:
     1. Explore o tema com profundidade filosófica e teológica
@@ -65,6 +71,7 @@ PROMPT_HIERARQUICO_SONNET = """
         <solicitacao_usuario>{solicitacao_usuario}</solicitacao_usuario>
         <texto_para_analise>{texto_para_analise}</texto_para_analise>
     </entrada>
+CACHE_BREAK_PLACEHOLDER
     
     <tamanhoDoTexto>
         <length_requirements>
@@ -132,6 +139,7 @@ PROMPT_HIERARQUICO_GEMINI = """
         <solicitacao_usuario>{solicitacao_usuario}</solicitacao_usuario>
         <texto_para_analise>{texto_para_analise}</texto_para_analise>
     </entrada>
+CACHE_BREAK_PLACEHOLDER
     
     <tamanhoDoTexto>
         <length_requirements>
@@ -200,10 +208,6 @@ PROMPT_ATOMICO_INICIAL = """
     {contexto}
   </role>
   <requirements>
-    <length_requirements>
-        <min_characters_no_spaces>MIN_CHARS_PLACEHOLDER</min_characters_no_spaces>
-        <max_characters_no_spaces>MAX_CHARS_PLACEHOLDER</max_characters_no_spaces>
-    </length_requirements>
     <language>Português do Brasil</language>
     <paragraph_structure>Parágrafos curtos para facilitar a leitura</paragraph_structure>
     <language_style>
@@ -219,11 +223,16 @@ PROMPT_ATOMICO_INICIAL = """
     {rag_context}
     ---
   </context_from_documents>
+CACHE_BREAK_PLACEHOLDER
   <user_request>
     <solicitacao_usuario>
       {solicitacao_usuario}
     </solicitacao_usuario>
   </user_request>
+  <length_requirements>
+    <min_characters_no_spaces>MIN_CHARS_PLACEHOLDER</min_characters_no_spaces>
+    <max_characters_no_spaces>MAX_CHARS_PLACEHOLDER</max_characters_no_spaces>
+  </length_requirements>
   <instructions>
     Com base na solicitação do usuário acima, desenvolva um texto que:
     1. Explore o tema com profundidade filosófica e teológica
@@ -273,6 +282,7 @@ PROMPT_ATOMICO_MERGE = """
         <content>{texto_para_analise_gemini}</content>
     </text_gemini>
     </inputs>
+CACHE_BREAK_PLACEHOLDER
 
     <instructions>
     <structure>
@@ -322,3 +332,97 @@ PROMPT_ATOMICO_MERGE = """
     </output>
 </prompt>
 """
+
+# --- PROMPTS PARA O MODO POR SEÇÕES (ESBOÇO + SEÇÕES EM PARALELO) ---
+
+PROMPT_SECOES_ESBOCO = """
+<prompt>
+  <role>
+    {contexto}
+  </role>
+
+  <task>
+    Planeje o texto que responderá à solicitação do usuário. Não escreva o texto: produza apenas o esboço das seções, que serão redigidas depois, cada uma separadamente.
+  </task>
+
+  <context_from_documents>
+    A seguir, trechos de documentos fornecidos pelo usuário para sua referência. Use-os para decidir quais assuntos cada seção deve cobrir.
+    ---
+    {rag_context}
+    ---
+  </context_from_documents>
+
+  <user_request>
+    <solicitacao_usuario>
+      {solicitacao_usuario}
+    </solicitacao_usuario>
+  </user_request>
+CACHE_BREAK_PLACEHOLDER
+  <instructions>
+    1. Divida o texto em no mínimo NUM_SECOES_MIN_PLACEHOLDER e no máximo NUM_SECOES_MAX_PLACEHOLDER seções, em ordem lógica e progressiva.
+    2. O texto completo terá entre MIN_CHARS_PLACEHOLDER e MAX_CHARS_PLACEHOLDER caracteres *desconsiderando os espaços*; distribua esse tamanho entre as seções pelo campo "peso" (seções mais importantes recebem peso maior).
+    3. Cada resumo deve dizer o que a seção desenvolve e o que ela NÃO deve repetir das demais, para que o texto final não seja redundante.
+    4. Títulos e resumos em Português do Brasil.
+  </instructions>
+
+  <output_format>
+    Responda somente com uma lista JSON, sem nenhum texto antes ou depois, no formato:
+    [{{"titulo": "Título da seção", "resumo": "O que a seção desenvolve", "peso": 1}}]
+  </output_format>
+</prompt>
+"""
+
+PROMPT_SECOES_SECAO = """
+<prompt>
+  <role>
+    {contexto}
+  </role>
+
+  <requirements>
+    <language>Português do Brasil</language>
+    <paragraph_structure>Parágrafos curtos para facilitar a leitura</paragraph_structure>
+    <language_style>
+      - Linguagem profunda e formal, mas acessível a leigos
+      - Evitar tecnicismos excessivos
+      - Evitar rigidez acadêmica desnecessária
+      - Manter profundidade intelectual sem perder clareza
+    </language_style>
+  </requirements>
+
+  <user_request>
+    <solicitacao_usuario>
+      {solicitacao_usuario}
+    </solicitacao_usuario>
+  </user_request>
+
+  <outline>
+    O texto foi planejado com as seções abaixo. Outras seções estão sendo escritas ao mesmo tempo que esta.
+    {esboco}
+  </outline>
+CACHE_BREAK_PLACEHOLDER
+  <length_requirements>
+    <min_characters_no_spaces>MIN_CHARS_PLACEHOLDER</min_characters_no_spaces>
+    <max_characters_no_spaces>MAX_CHARS_PLACEHOLDER</max_characters_no_spaces>
+  </length_requirements>
+
+  <context_from_documents>
+    A seguir, os trechos de documentos mais relevantes para esta seção. Use-os como base teórica.
+    ---
+    {rag_context}
+    ---
+  </context_from_documents>
+
+  <instructions>
+    Escreva SOMENTE a seção {posicao_secao}: "{titulo_secao}".
+    O que ela deve desenvolver: {resumo_secao}
+    1. Não escreva o título da seção, nem introdução ou conclusão do texto inteiro (a menos que esta seção seja a introdução ou a conclusão).
+    2. Não repita assuntos atribuídos às outras seções do esboço.
+    3. Explore o tema com profundidade filosófica e teológica, mantendo conexão com a tradição católica quando relevante.
+    4. Evite usar um estilo de escrita muito característico de textos gerados com IA, como por exemplo: "Não é mera..., mas é...". Coisas assim. Seja mais direto.
+    5. Todo o texto, incluindo citações, devem estar na lingua Português do Brasil.
+
+    <forbidden>Que a seção tenha menos de MIN_CHARS_PLACEHOLDER caracteres *desconsiderando os espaços*.</forbidden>
+    <forbidden>Que a seção tenha mais de MAX_CHARS_PLACEHOLDER caracteres *desconsiderando os espaços*.</forbidden>
+  </instructions>
+</prompt>
+"""
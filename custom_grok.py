@@ -1,19 +1,125 @@
 # custom_grok.py
 
-from typing import Any, List, Optional, Dict
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.outputs import ChatGeneration, ChatResult
-import requests
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# --- Configurações do transporte HTTP (ajustáveis por variáveis de ambiente) ---
+
+# Conexões mantidas abertas com a API da xAI, compartilhadas por todas as chamadas do processo
+GROK_POOL_SIZE = int(os.getenv("GROK_POOL_SIZE", 10))
+# Tempo que uma conexão ociosa fica no pool antes de ser fechada (segundos)
+GROK_KEEPALIVE_SECONDS = float(os.getenv("GROK_KEEPALIVE_SECONDS", 120))
+GROK_MAX_RETRIES = int(os.getenv("GROK_MAX_RETRIES", 3))
+# Espera entre tentativas: exponencial a partir da base, com jitter, até o máximo (segundos)
+GROK_RETRY_BASE_DELAY = float(os.getenv("GROK_RETRY_BASE_DELAY", 1.0))
+GROK_RETRY_MAX_DELAY = float(os.getenv("GROK_RETRY_MAX_DELAY", 30.0))
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+# --- Clientes HTTP compartilhados ---
+
+_clients_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+_sync_client_pid: Optional[int] = None
+# Um cliente assíncrono por event loop (o do agendador de LLMs, em geral)
+_async_clients: Dict[int, httpx.AsyncClient] = {}
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=GROK_POOL_SIZE,
+        max_keepalive_connections=GROK_POOL_SIZE,
+        keepalive_expiry=GROK_KEEPALIVE_SECONDS,
+    )
+
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client, _sync_client_pid
+    # Após um fork (workers do gunicorn) as conexões herdadas não são reaproveitadas
+    if _sync_client is None or _sync_client_pid != os.getpid():
+        with _clients_lock:
+            if _sync_client is None or _sync_client_pid != os.getpid():
+                _sync_client = httpx.Client(limits=_limits())
+                _sync_client_pid = os.getpid()
+    return _sync_client
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    key = id(loop)
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=_limits())
+            _async_clients[key] = client
+    return client
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Espera antes da próxima tentativa: Retry-After, se o servidor mandar, ou backoff exponencial com jitter."""
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), GROK_RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+    return random.uniform(0, min(GROK_RETRY_MAX_DELAY, GROK_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _message_content(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    # Conteúdo em blocos: junta os trechos de texto
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in message.content
+    )
+
+
+def _usage_metadata(usage: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Converte o campo 'usage' da API (formato OpenAI) para o usage_metadata do LangChain."""
+    if not usage:
+        return None
+    input_tokens = usage.get("prompt_tokens") or 0
+    output_tokens = usage.get("completion_tokens") or 0
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": usage.get("total_tokens") or input_tokens + output_tokens,
+        "input_token_details": {"cache_read": cached},
+    }
+
 
 class GrokChatModel(BaseChatModel):
     """
     Wrapper customizado e robusto para o modelo GROK da xAI,
     com tratamento aprimorado de timeouts e erros de resposta.
+
+    As chamadas usam clientes HTTP persistentes do processo (pool de conexões
+    com keep-alive), repetem com backoff e jitter em 429/5xx e erros de
+    conexão, e suportam `ainvoke` e streaming (SSE) nativos.
     """
     model: str
     api_key: str
     base_url: str
+    timeout: float = 300
+    temperature: float = 0.7
+    max_retries: int = GROK_MAX_RETRIES
 
     @property
     def _llm_type(self) -> str:
@@ -25,55 +131,197 @@ class GrokChatModel(BaseChatModel):
             "Content-Type": "application/json",
         }
 
+    def _payload(self, messages: List[BaseMessage], stop: Optional[List[str]], stream: bool, **kwargs: Any) -> Dict[str, Any]:
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": _ROLES.get(message.type, "user"), "content": _message_content(message)}
+                for message in messages
+            ],
+            "temperature": self.temperature,
+        }
+        # Adiciona max_tokens ao payload se for fornecido
+        if "max_tokens" in kwargs:
+            payload["max_tokens"] = kwargs["max_tokens"]
+        if stop:
+            payload["stop"] = stop
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    @staticmethod
+    def _chat_result(result: Dict[str, Any]) -> ChatResult:
+        # Validação robusta da resposta da API
+        if not result.get("choices") or not isinstance(result["choices"], list) or len(result["choices"]) == 0:
+            raise ValueError("Resposta da API do GROK inválida: campo 'choices' ausente ou vazio.")
+
+        message = result["choices"][0].get("message", {})
+        content = message.get("content")
+
+        if not content or not content.strip():
+            # Isso captura o caso de uma resposta bem-sucedida, mas com conteúdo vazio.
+            raise ValueError("Resposta da API do GROK retornou conteúdo vazio.")
+
+        ai_message = AIMessage(content=content)
+        usage = _usage_metadata(result.get("usage"))
+        if usage:
+            ai_message.usage_metadata = usage
+        return ChatResult(generations=[ChatGeneration(message=ai_message)])
+
+    @staticmethod
+    def _stream_chunk(line: str) -> Optional[ChatGenerationChunk]:
+        """Lê uma linha SSE ('data: {...}') e devolve o pedaço de texto/uso, se houver."""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            return None
+        try:
+            event = json.loads(data)
+        except ValueError as e:
+            # Quadro malformado ou cortado: descarta só ele, o stream continua
+            print(f"[grok] Evento SSE inválido ignorado ({e}): {data[:200]!r}", flush=True)
+            return None
+        if not isinstance(event, dict):
+            return None
+        choices = event.get("choices") or []
+        content = ((choices[0].get("delta") or {}).get("content") or "") if choices else ""
+        usage = _usage_metadata(event.get("usage"))
+        if not content and not usage:
+            return None
+        return ChatGenerationChunk(message=AIMessageChunk(content=content, usage_metadata=usage))
+
+    @staticmethod
+    def _error(e: Exception) -> ValueError:
+        if isinstance(e, httpx.TimeoutException):
+            return ValueError("Erro na chamada da API da Grok: Tempo limite excedido (Timeout).")
+        if isinstance(e, httpx.HTTPStatusError):
+            return ValueError(f"Erro na chamada da API da Grok: HTTP {e.response.status_code} - {e.response.text[:500]}")
+        # Outros erros de conexão (DNS, rede, etc.)
+        return ValueError(f"Erro de conexão com a API da Grok: {e}")
+
+    def _should_retry(self, attempt: int, error: Exception) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUSES
+        return isinstance(error, httpx.TransportError)
+
+    def _log_retry(self, attempt: int, error: Exception, delay: float) -> None:
+        print(f"[grok] Tentativa {attempt + 1} falhou ({self._error(error)}); nova tentativa em {delay:.1f}s", flush=True)
+
+    # --- Chamadas síncronas ---
+
     def _generate(
-        self, messages: List[HumanMessage],
+        self, messages: List[BaseMessage],
         stop: Optional[List[str]] = None,
+        run_manager=None,
         **kwargs: Any
     ) -> ChatResult:
-        last_message = messages[-1].content
+        payload = self._payload(messages, stop, stream=False, **kwargs)
+        attempt = 0
+        while True:
+            try:
+                response = _get_sync_client().post(self.base_url, headers=self._default_headers(), json=payload, timeout=self.timeout)
+                # Lança um erro para status HTTP 4xx ou 5xx
+                response.raise_for_status()
+                return self._chat_result(response.json())
+            except httpx.HTTPError as e:
+                if not self._should_retry(attempt, e):
+                    raise self._error(e) from e
+                delay = _retry_delay(attempt, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+                self._log_retry(attempt, e, delay)
+                time.sleep(delay)
+                attempt += 1
 
-        payload = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": last_message}],
-            "temperature": 0.7
-        }
+    def _stream(
+        self, messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        payload = self._payload(messages, stop, stream=True, **kwargs)
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with _get_sync_client().stream("POST", self.base_url, headers=self._default_headers(), json=payload, timeout=self.timeout) as response:
+                    if response.is_error:
+                        response.read()
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        chunk = self._stream_chunk(line)
+                        if chunk is None:
+                            continue
+                        started = True
+                        if run_manager and chunk.text:
+                            run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        yield chunk
+                return
+            except httpx.HTTPError as e:
+                # Depois do primeiro token não há como repetir sem duplicar o texto
+                if started or not self._should_retry(attempt, e):
+                    raise self._error(e) from e
+                delay = _retry_delay(attempt, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+                self._log_retry(attempt, e, delay)
+                time.sleep(delay)
+                attempt += 1
 
-         # Adiciona max_tokens ao payload se for fornecido
-        if "max_tokens" in kwargs:
-            payload["max_tokens"] = kwargs["max_tokens"]       
+    # --- Chamadas assíncronas (usadas pelo agendador de LLMs) ---
 
-        try:
-            response = requests.post(
-                self.base_url,
-                headers=self._default_headers(),
-                json=payload,
-                timeout=300  # Adiciona um timeout de 300 segundos (5 minutos)
-            )
-            # Lança um erro para status HTTP 4xx ou 5xx
-            response.raise_for_status()
-
-            result = response.json()
-            
-            # Validação robusta da resposta da API
-            if not result.get("choices") or not isinstance(result["choices"], list) or len(result["choices"]) == 0:
-                raise ValueError("Resposta da API do GROK inválida: campo 'choices' ausente ou vazio.")
-
-            message = result["choices"][0].get("message", {})
-            content = message.get("content")
-
-            if not content or not content.strip():
-                # Isso captura o caso de uma resposta bem-sucedida, mas com conteúdo vazio.
-                raise ValueError("Resposta da API do GROK retornou conteúdo vazio.")
-
-            return ChatResult(
-                generations=[ChatGeneration(message=AIMessage(content=content))]
-            )
-
-        except requests.exceptions.Timeout:
-            raise ValueError("Erro na chamada da API da Grok: Tempo limite excedido (Timeout).")
-        except requests.exceptions.RequestException as e:
-            # Captura outros erros de conexão (DNS, rede, etc.)
-            raise ValueError(f"Erro de conexão com a API da Grok: {e}")
+    async def _agenerate(
+        self, messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any
+    ) -> ChatResult:
+        payload = self._payload(messages, stop, stream=False, **kwargs)
+        attempt = 0
+        while True:
+            try:
+                response = await _get_async_client().post(self.base_url, headers=self._default_headers(), json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                return self._chat_result(response.json())
+            except httpx.HTTPError as e:
+                if not self._should_retry(attempt, e):
+                    raise self._error(e) from e
+                delay = _retry_delay(attempt, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+                self._log_retry(attempt, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _astream(
+        self, messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        payload = self._payload(messages, stop, stream=True, **kwargs)
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with _get_async_client().stream("POST", self.base_url, headers=self._default_headers(), json=payload, timeout=self.timeout) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        chunk = self._stream_chunk(line)
+                        if chunk is None:
+                            continue
+                        started = True
+                        if run_manager and chunk.text:
+                            await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        yield chunk
+                return
+            except httpx.HTTPError as e:
+                if started or not self._should_retry(attempt, e):
+                    raise self._error(e) from e
+                delay = _retry_delay(attempt, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+                self._log_retry(attempt, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
 
     @property
     def _identifying_params(self) -> Dict[str, Any]:
@@ -0,0 +1,337 @@
+# document_cache.py
+
+import os
+import io
+import json
+import time
+import atexit
+import shutil
+import fcntl
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# --- Configurações do cache (ajustáveis por variáveis de ambiente) ---
+
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", os.path.join(os.getenv("HF_HOME", ".cache"), "documents"))
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+# Ao passar do limite, a remoção LRU desce até esta fração dele, para que o
+# cache cheio não percorra a árvore a cada nova gravação
+DOCUMENT_CACHE_EVICT_TARGET = float(os.getenv("DOCUMENT_CACHE_EVICT_TARGET", 0.9))
+# Os contadores de hit/miss são somados em memória e gravados no arquivo de
+# estatísticas a cada N consultas ou T segundos, e não a cada consulta
+DOCUMENT_CACHE_STATS_FLUSH_EVERY = int(os.getenv("DOCUMENT_CACHE_STATS_FLUSH_EVERY", 50))
+DOCUMENT_CACHE_STATS_FLUSH_SECONDS = float(os.getenv("DOCUMENT_CACHE_STATS_FLUSH_SECONDS", 10))
+
+PAGES_ARTIFACT = "pages.jsonl"
+_STATS_FILE = "stats.json"
+_LOCK_FILE = ".lock"
+
+
+def _tmp_path(path: str) -> str:
+    """Arquivo temporário da escrita atômica de `path`, exclusivo por processo e por thread."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Calcula o SHA-256 do conteúdo do arquivo, lendo em blocos."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """
+    Cache persistente, endereçado pelo SHA-256 do arquivo enviado, para os
+    artefatos derivados de um documento (páginas extraídas, trechos,
+    embeddings). Cada documento ocupa um diretório; o mtime do diretório
+    marca o último acesso e guia a remoção LRU quando o tamanho total
+    ultrapassa `max_bytes`. O tamanho total é mantido no arquivo de
+    estatísticas a cada gravação, de modo que a árvore só é percorrida
+    quando o limite é de fato ultrapassado. Os contadores ficam em disco
+    para que todos os workers do gunicorn somem nas mesmas estatísticas;
+    os de hit/miss são acumulados por processo e gravados em lotes.
+    """
+
+    def __init__(self, cache_dir: str = DOCUMENT_CACHE_DIR, max_bytes: int = DOCUMENT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._reset_pending()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_pending)
+        atexit.register(self.flush_stats)
+
+    def _reset_pending(self) -> None:
+        """Contadores ainda não gravados; no filho após o fork começam vazios (os do pai são do pai)."""
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._pending_lookups = 0
+        self._flushed_at = time.monotonic()
+
+    # --- Utilitários internos ---
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _artifact_path(self, key: str, name: str) -> str:
+        return os.path.join(self._entry_dir(key), name)
+
+    def _locked(self):
+        """Abre o arquivo de trava compartilhado entre processos."""
+        lock = open(os.path.join(self.cache_dir, _LOCK_FILE), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _update_stats(self, **increments: int) -> Dict[str, int]:
+        with self._locked():
+            stats = self._read_stats()
+            for name, value in increments.items():
+                stats[name] = stats.get(name, 0) + value
+            self._write_stats(stats)
+        return stats
+
+    def _write_stats(self, stats: Dict[str, int]) -> None:
+        """Grava as estatísticas (com a trava tomada)."""
+        stats_path = os.path.join(self.cache_dir, _STATS_FILE)
+        tmp_path = _tmp_path(stats_path)
+        with open(tmp_path, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, stats_path)
+
+    def _count(self, **increments: int) -> None:
+        """Soma os contadores de uma consulta em memória, gravando o lote quando vence."""
+        with self._pending_lock:
+            for name, value in increments.items():
+                self._pending[name] = self._pending.get(name, 0) + value
+            self._pending_lookups += 1
+            due = (
+                self._pending_lookups >= DOCUMENT_CACHE_STATS_FLUSH_EVERY
+                or time.monotonic() - self._flushed_at >= DOCUMENT_CACHE_STATS_FLUSH_SECONDS
+            )
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Grava no arquivo de estatísticas os contadores acumulados por este processo."""
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_lookups = 0
+            self._flushed_at = time.monotonic()
+        if pending:
+            self._update_stats(**pending)
+
+    def _read_stats(self) -> Dict[str, int]:
+        try:
+            with open(os.path.join(self.cache_dir, _STATS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _touch(self, key: str) -> None:
+        try:
+            os.utime(self._entry_dir(key))
+        except OSError:
+            pass
+
+    # --- Artefatos genéricos ---
+
+    def get_bytes(self, key: str, name: str) -> Optional[bytes]:
+        try:
+            with open(self._artifact_path(key, name), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._touch(key)
+        return data
+
+    def put_bytes(self, key: str, name: str, data: bytes) -> None:
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = self._artifact_path(key, name)
+        # Escrita atômica: outro worker nunca lê um artefato pela metade
+        tmp_path = _tmp_path(path)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        self._publish(key, tmp_path, path)
+
+    def get_json(self, key: str, name: str) -> Any:
+        data = self.get_bytes(key, name)
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            return None
+
+    def put_json(self, key: str, name: str, value: Any) -> None:
+        self.put_bytes(key, name, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def get_array(self, key: str, name: str):
+        data = self.get_bytes(key, name)
+        if data is None:
+            return None
+        import numpy as np
+        return np.load(io.BytesIO(data), allow_pickle=False)
+
+    def put_array(self, key: str, name: str, array) -> None:
+        import numpy as np
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        self.put_bytes(key, name, buffer.getvalue())
+
+    # --- Páginas extraídas ---
+    # As páginas ficam em JSON Lines (uma página por linha) para poderem ser
+    # lidas e gravadas uma a uma, sem carregar o documento inteiro.
+
+    def open_pages(self, key: str, source_size: int = 0) -> Optional[Iterator[str]]:
+        """Abre as páginas em cache como um iterador, registrando hit/miss."""
+        try:
+            f = open(self._artifact_path(key, PAGES_ARTIFACT), encoding="utf-8")
+        except OSError:
+            self._count(misses=1)
+            return None
+        self._touch(key)
+        self._count(hits=1, bytes_saved=source_size)
+        return self._read_lines(f)
+
+    def has_pages(self, key: str) -> bool:
+        """Indica se as páginas estão em cache; a falta conta como miss (o hit é contado em open_pages)."""
+        if os.path.exists(self._artifact_path(key, PAGES_ARTIFACT)):
+            return True
+        self._count(misses=1)
+        return False
+
+    @staticmethod
+    def _read_lines(f) -> Iterator[str]:
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def get_pages(self, key: str, source_size: int = 0) -> Optional[List[str]]:
+        """Devolve as páginas já extraídas do documento, registrando hit/miss."""
+        pages = self.open_pages(key, source_size)
+        return list(pages) if pages is not None else None
+
+    def put_pages(self, key: str, pages: Iterable[str]) -> None:
+        for _ in self.stream_pages_into_cache(key, pages):
+            pass
+
+    def stream_pages_into_cache(self, key: str, pages: Iterable[str]) -> Iterator[str]:
+        """
+        Repassa as páginas ao chamador enquanto as grava no cache. O artefato
+        só é publicado se o iterador for consumido até o fim; uma leitura
+        interrompida (ex.: orçamento atingido) não deixa páginas parciais.
+        """
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = self._artifact_path(key, PAGES_ARTIFACT)
+        tmp_path = _tmp_path(path)
+        completed = False
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for page in pages:
+                    f.write(json.dumps(page, ensure_ascii=False) + "\n")
+                    yield page
+            completed = True
+        finally:
+            if completed:
+                self._publish(key, tmp_path, path)
+            else:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    # --- Remoção LRU e estatísticas ---
+
+    def _publish(self, key: str, tmp_path: str, path: str) -> None:
+        """
+        Publica um artefato gravado em `tmp_path` e soma a diferença de
+        tamanho ao total mantido nas estatísticas; a remoção LRU (que percorre
+        a árvore) só roda quando o total passa de `max_bytes`.
+        """
+        size = os.path.getsize(tmp_path)
+        with self._locked():
+            try:
+                previous = os.path.getsize(path)
+            except OSError:
+                previous = 0
+            os.replace(tmp_path, path)
+            stats = self._read_stats()
+            if "size_bytes" in stats:
+                stats["size_bytes"] += size - previous
+            else:
+                # Cache de uma versão anterior (ou estatísticas perdidas): mede uma vez
+                stats["size_bytes"] = sum(size for _, size, _ in self._entries())
+            self._write_stats(stats)
+        self._touch(key)
+        if stats["size_bytes"] > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        """Lista (último acesso, tamanho, diretório) de cada documento em cache."""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+                    entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+                except OSError:
+                    continue
+        return entries
+
+    def _count_entries(self) -> int:
+        """Quantidade de documentos em cache (só lista os diretórios, sem medir)."""
+        count = 0
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if os.path.isdir(prefix_dir):
+                count += len(os.listdir(prefix_dir))
+        return count
+
+    def _evict(self) -> None:
+        with self._locked():
+            # Mede de verdade: corrige também o que o total acumulado tiver desviado
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * DOCUMENT_CACHE_EVICT_TARGET if total > self.max_bytes else self.max_bytes
+            evicted = 0
+            for _, size, entry_dir in sorted(entries):
+                if total <= target:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+                evicted += 1
+            stats = self._read_stats()
+            stats["size_bytes"] = total
+            stats["evictions"] = stats.get("evictions", 0) + evicted
+            self._write_stats(stats)
+        if evicted:
+            print(f"[document_cache] {evicted} documento(s) removido(s) do cache (LRU)", flush=True)
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush_stats()
+        stats = self._read_stats()
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "bytes_saved": stats.get("bytes_saved", 0),
+            "evictions": stats.get("evictions", 0),
+            "entries": self._count_entries(),
+            "size_bytes": stats.get("size_bytes", 0),
+            "max_bytes": self.max_bytes,
+        }
+
+
+# Instância compartilhada pelo processo
+document_cache = DocumentCache()
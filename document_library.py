@@ -0,0 +1,299 @@
+# document_library.py
+
+import os
+import re
+import time
+import fcntl
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# --- Configurações da biblioteca (ajustáveis por variáveis de ambiente) ---
+
+LIBRARY_DIR = os.getenv("LIBRARY_DIR", "library")
+
+# Vetores (float32, uma linha por trecho) e IDs dos trechos, na mesma ordem, só acrescentados
+VECTORS_FILE = "vectors.f32"
+IDS_FILE = "ids.i64"
+# Índice FAISS das versões anteriores, convertido na primeira utilização
+LEGACY_INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+# ID gravado no lugar dos trechos removidos
+TOMBSTONE = -1
+_LOCK_FILE = ".lock"
+
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sha256 TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_document ON chunks(document_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class LibraryError(ValueError):
+    """Erro de uso da biblioteca (coleção inválida, documento inexistente...)."""
+
+
+class Collection:
+    """
+    Uma coleção da biblioteca: os vetores dos trechos em disco e um banco
+    SQLite com os documentos e o texto dos trechos.
+
+    Os vetores ficam num arquivo float32 simples (uma linha por trecho) e os
+    IDs dos trechos em outro, na mesma ordem. As escritas, serializadas por
+    uma trava de arquivo, só acrescentam linhas ao final; remover um
+    documento troca os IDs dos seus trechos por TOMBSTONE, no lugar, sem
+    reescrever os arquivos. As leituras mapeiam os dois arquivos com
+    np.memmap (somente leitura), de modo que os workers do gunicorn
+    compartilham as mesmas páginas pelo cache do sistema operacional; o
+    mapeamento é refeito quando o arquivo de IDs cresce.
+    """
+
+    def __init__(self, name: str, root: str = LIBRARY_DIR):
+        if not _COLLECTION_NAME.match(name or ""):
+            raise LibraryError(f"Nome de coleção inválido: '{name}'")
+        self.name = name
+        self.path = os.path.join(root, name)
+        self._reader = None
+        self._reader_size = None
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, VECTORS_FILE)
+
+    @property
+    def ids_path(self) -> str:
+        return os.path.join(self.path, IDS_FILE)
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, CHUNKS_FILE))
+
+    @contextmanager
+    def _connect(self):
+        """Abre o banco da coleção numa transação, fechando a conexão no final."""
+        os.makedirs(self.path, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.path, CHUNKS_FILE), timeout=30)
+        try:
+            conn.executescript(_SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _locked(self):
+        os.makedirs(self.path, exist_ok=True)
+        lock = open(os.path.join(self.path, _LOCK_FILE), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    @staticmethod
+    def _dimension(conn) -> Optional[int]:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'dimension'").fetchone()
+        return row[0] if row else None
+
+    # --- Escrita incremental ---
+
+    def _append_vectors(self, conn, embeddings, chunk_ids: List[int]) -> None:
+        """
+        Acrescenta os vetores e depois os IDs. Um acréscimo interrompido deixa
+        linhas de vetores sem ID, que os leitores não enxergam e que são
+        descartadas no acréscimo seguinte.
+        """
+        import numpy as np
+
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        dimension = self._dimension(conn)
+        if dimension is None:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('dimension', ?)", (vectors.shape[1],))
+            dimension = vectors.shape[1]
+        elif vectors.shape[1] != dimension:
+            raise LibraryError(f"Vetores com dimensão {vectors.shape[1]}; a coleção '{self.name}' usa {dimension}")
+
+        count = os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(count * dimension * 4)
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.asarray(chunk_ids, dtype=np.int64).tobytes())
+
+    def _convert_legacy_index(self) -> None:
+        """Converte o índice FAISS das versões anteriores para os arquivos de vetores (com a trava tomada)."""
+        legacy_path = os.path.join(self.path, LEGACY_INDEX_FILE)
+        if not os.path.exists(legacy_path) or os.path.exists(self.ids_path):
+            return
+        import faiss
+
+        index = faiss.read_index(legacy_path)
+        ids = faiss.vector_to_array(index.id_map)
+        with self._connect() as conn:
+            if index.ntotal:
+                self._append_vectors(conn, index.index.reconstruct_n(0, index.ntotal), ids.tolist())
+        os.remove(legacy_path)
+        print(f"[document_library] Índice FAISS de '{self.name}' convertido ({index.ntotal} vetores)", flush=True)
+
+    def add_document(self, sha256: str, filename: str, chunks: List[str], embeddings) -> Dict:
+        """Adiciona um documento já dividido em trechos e codificado."""
+        with self._locked():
+            self._convert_legacy_index()
+            with self._connect() as conn:
+                existing = conn.execute("SELECT id, chunk_count FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+                if existing:
+                    return {"id": existing[0], "filename": filename, "chunks": existing[1], "already_indexed": True}
+
+                cursor = conn.execute(
+                    "INSERT INTO documents (sha256, filename, chunk_count, added_at) VALUES (?, ?, ?, ?)",
+                    (sha256, filename, len(chunks), time.time()),
+                )
+                document_id = cursor.lastrowid
+                chunk_ids = []
+                for position, text in enumerate(chunks):
+                    cursor = conn.execute(
+                        "INSERT INTO chunks (document_id, position, text) VALUES (?, ?, ?)",
+                        (document_id, position, text),
+                    )
+                    chunk_ids.append(cursor.lastrowid)
+
+                if chunk_ids:
+                    self._append_vectors(conn, embeddings, chunk_ids)
+
+        print(f"[document_library] '{filename}' indexado em '{self.name}' ({len(chunks)} trechos)", flush=True)
+        return {"id": document_id, "filename": filename, "chunks": len(chunks), "already_indexed": False}
+
+    def remove_document(self, document_id: int) -> None:
+        """Remove um documento marcando seus vetores com TOMBSTONE, sem reescrever os arquivos."""
+        import numpy as np
+
+        with self._locked():
+            self._convert_legacy_index()
+            with self._connect() as conn:
+                if not conn.execute("SELECT 1 FROM documents WHERE id = ?", (document_id,)).fetchone():
+                    raise LibraryError(f"Documento {document_id} não encontrado na coleção '{self.name}'")
+                chunk_ids = [row[0] for row in conn.execute("SELECT id FROM chunks WHERE document_id = ?", (document_id,))]
+                if chunk_ids and os.path.exists(self.ids_path) and os.path.getsize(self.ids_path):
+                    ids = np.memmap(self.ids_path, dtype=np.int64, mode="r+")
+                    ids[np.isin(ids, chunk_ids)] = TOMBSTONE
+                    ids.flush()
+                    del ids
+                conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+                conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    def list_documents(self) -> List[Dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, filename, chunk_count, added_at FROM documents ORDER BY id").fetchall()
+        return [{"id": r[0], "filename": r[1], "chunks": r[2], "added_at": r[3]} for r in rows]
+
+    # --- Leitura compartilhada ---
+
+    def _read_vectors(self):
+        """Mapeia (ou remapeia, se o arquivo de IDs cresceu) os IDs e os vetores, somente leitura."""
+        import numpy as np
+
+        if not os.path.exists(self.ids_path) and os.path.exists(os.path.join(self.path, LEGACY_INDEX_FILE)):
+            with self._locked():
+                self._convert_legacy_index()
+        try:
+            size = os.path.getsize(self.ids_path)
+        except OSError:
+            return None
+        if self._reader is None or size != self._reader_size:
+            count = size // 8
+            if count == 0:
+                self._reader = None
+            else:
+                with self._connect() as conn:
+                    dimension = self._dimension(conn)
+                ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(count,))
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, dimension))
+                self._reader = (ids, vectors)
+            self._reader_size = size
+        return self._reader
+
+    def search(self, query_embedding, top_k: int) -> List[Tuple[float, Tuple, str]]:
+        """
+        Devolve (pontuação, chave de ordenação, texto) dos `top_k` trechos mais
+        próximos (produto interno). A chave ordena os trechos por documento e
+        posição.
+        """
+        import numpy as np
+
+        reader = self._read_vectors()
+        if reader is None or top_k <= 0:
+            return []
+        ids, vectors = reader
+        scores = vectors @ np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        scores[ids == TOMBSTONE] = -np.inf
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        hits = {int(ids[i]): float(scores[i]) for i in best if np.isfinite(scores[i])}
+        if not hits:
+            return []
+        placeholders = ",".join("?" * len(hits))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, document_id, position, text FROM chunks WHERE id IN ({placeholders})",
+                list(hits),
+            ).fetchall()
+        return [(hits[r[0]], (self.name, r[1], r[2]), r[3]) for r in rows]
+
+
+# Coleções abertas neste processo (mantém os índices mapeados em memória)
+_collections: Dict[str, Collection] = {}
+
+
+def get_collection(name: str) -> Collection:
+    if name not in _collections:
+        _collections[name] = Collection(name)
+    return _collections[name]
+
+
+def list_collections() -> List[Dict]:
+    if not os.path.isdir(LIBRARY_DIR):
+        return []
+    result = []
+    for name in sorted(os.listdir(LIBRARY_DIR)):
+        if not _COLLECTION_NAME.match(name):
+            continue
+        collection = get_collection(name)
+        if collection.exists():
+            documents = collection.list_documents()
+            result.append({"name": name, "documents": len(documents), "chunks": sum(d["chunks"] for d in documents)})
+    return result
+
+
+def search_collections(names: List[str], query_embedding, top_k: int) -> List[Tuple[float, Tuple, str]]:
+    """Busca nas coleções indicadas; coleções inexistentes são ignoradas."""
+    hits = []
+    for name in names:
+        try:
+            collection = get_collection(name)
+        except LibraryError as e:
+            print(f"[document_library] {e}", flush=True)
+            continue
+        if collection.exists():
+            hits.extend(collection.search(query_embedding, top_k))
+    return hits
+
+
+def parse_collection_names(raw: Optional[str]) -> List[str]:
+    """Converte o campo do formulário ("a, b") em lista de nomes."""
+    if not raw:
+        return []
+    return [name.strip() for name in raw.split(",") if name.strip()]
@@ -0,0 +1,220 @@
+# embeddings.py
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from serving import run_blocking
+from sqlite_store import SQLiteStore
+
+# --- Configurações do serviço de embeddings (ajustáveis por variáveis de ambiente) ---
+
+EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+# Lotes limitados por quantidade e por total de caracteres (trechos longos formam lotes menores)
+EMBEDDING_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", 48000))
+# Usa apenas o modelo já baixado em HF_HOME, sem acessar a rede
+EMBEDDING_OFFLINE = os.getenv("EMBEDDING_OFFLINE", "0") == "1"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.getenv("HF_HOME", ".cache"), "embeddings.sqlite"))
+EMBEDDING_MEMORY_CACHE_SIZE = int(os.getenv("EMBEDDING_MEMORY_CACHE_SIZE", 20000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash));
+"""
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+    """
+    Serviço de embeddings compartilhado pelo processo: carrega o modelo uma
+    única vez, codifica em lotes ajustados ao tamanho dos trechos e guarda
+    cada vetor pelo hash do trecho (em memória e em SQLite), para que um
+    texto repetido nunca seja codificado duas vezes.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, cache_path: str = EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._memory: "OrderedDict[str, object]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._store_db = SQLiteStore(cache_path, _SCHEMA, "embeddings")
+        self._stats_lock = threading.Lock()
+        self.stats = {"encoded": 0, "memory_hits": 0, "disk_hits": 0, "load_seconds": 0.0}
+
+    # --- Modelo ---
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def get_model(self):
+        """Carrega o modelo na primeira utilização (com trava, uma vez por processo)."""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    if EMBEDDING_OFFLINE:
+                        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+                        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+                    from sentence_transformers import SentenceTransformer
+
+                    started = time.time()
+                    print(f"[embeddings] Carregando modelo '{self.model_name}' ({EMBEDDING_DEVICE}, offline={EMBEDDING_OFFLINE})...", flush=True)
+                    self._model = SentenceTransformer(
+                        self.model_name,
+                        device=EMBEDDING_DEVICE,
+                        cache_folder=os.getenv("HF_HOME"),
+                    )
+                    self.stats["load_seconds"] = round(time.time() - started, 2)
+                    print(f"[embeddings] Modelo carregado em {self.stats['load_seconds']}s", flush=True)
+        return self._model
+
+    def warmup(self) -> None:
+        """
+        Carrega o modelo e executa uma codificação para aquecer os kernels,
+        numa thread nativa nos workers gevent (ver serving.run_blocking).
+        """
+        try:
+            run_blocking(self._encode_batch, ["aquecimento do modelo de embeddings"])
+        except Exception as e:
+            print(f"[embeddings] Falha no aquecimento: {e}", flush=True)
+
+    # --- Cache por hash do trecho ---
+
+    def _count(self, name: str, value) -> None:
+        # Os pedidos chegam de várias threads (e greenlets) do worker
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _remember(self, key: str, vector) -> None:
+        with self._memory_lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > EMBEDDING_MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, object]:
+        import numpy as np
+
+        found: Dict[str, object] = {}
+        with self._memory_lock:
+            for key in hashes:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+        self._count("memory_hits", len(found))
+
+        missing = [key for key in hashes if key not in found]
+        if missing:
+            conn = self._store_db.connection()
+            disk_hits = 0
+            for start in range(0, len(missing), 500):
+                part = missing[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [self.model_name] + part,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+                    disk_hits += 1
+            self._count("disk_hits", disk_hits)
+        return found
+
+    def _store(self, vectors: Dict[str, object]) -> None:
+        conn = self._store_db.connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, key, vector.tobytes()) for key, vector in vectors.items()],
+            )
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+
+    # --- Codificação ---
+
+    def _encode_batch(self, texts: List[str]):
+        import numpy as np
+
+        return self.get_model().encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+    def _batches(self, texts: List[str]):
+        """Agrupa os textos (já ordenados por tamanho) em lotes de tamanho ajustado."""
+        batch: List[str] = []
+        batch_chars = 0
+        for text in texts:
+            if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_chars + len(text) > EMBEDDING_BATCH_MAX_CHARS):
+                yield batch
+                batch, batch_chars = [], 0
+            batch.append(text)
+            batch_chars += len(text)
+        if batch:
+            yield batch
+
+    def encode(self, texts: List[str], use_cache: bool = True):
+        """
+        Devolve a matriz (len(texts) x dimensão) de embeddings normalizados.
+        Trechos já vistos saem do cache; os demais são codificados em lotes
+        ordenados por tamanho, o que reduz o preenchimento (padding).
+        """
+        import numpy as np
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        hashes = [chunk_hash(text) for text in texts]
+        found = self._lookup(list(set(hashes))) if use_cache else {}
+
+        pending: Dict[str, str] = {}
+        for key, text in zip(hashes, texts):
+            if key not in found:
+                pending[key] = text
+        if pending:
+            ordered = sorted(pending.items(), key=lambda item: len(item[1]))
+            texts_by_length = [text for _, text in ordered]
+            self.get_model()
+            # Nos workers gevent a codificação roda numa thread nativa
+            vectors = [run_blocking(self._encode_batch, batch) for batch in self._batches(texts_by_length)]
+            encoded = dict(zip((key for key, _ in ordered), np.vstack(vectors)))
+            self._count("encoded", len(encoded))
+            if use_cache:
+                self._store(encoded)
+            found.update(encoded)
+
+        return np.vstack([found[key] for key in hashes]).astype(np.float32)
+
+    def status(self) -> Dict:
+        with self._stats_lock:
+            return {"model": self.model_name, "loaded": self.loaded, **self.stats}
+
+
+# Instância compartilhada pelo processo
+embedding_service = EmbeddingService()
+
+
+def start_warmup(background: bool = True) -> Optional[threading.Thread]:
+    """
+    Aquece o serviço de embeddings, por padrão numa thread em segundo plano.
+    Num worker gevent essa thread é um greenlet que só aguarda: o modelo é
+    carregado e executado na thread nativa de run_blocking (ver warmup).
+    """
+    if not background:
+        embedding_service.warmup()
+        return None
+    thread = threading.Thread(target=embedding_service.warmup, name="embeddings-warmup", daemon=True)
+    thread.start()
+    return thread
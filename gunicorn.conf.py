@@ -0,0 +1,62 @@
+# gunicorn.conf.py
+#
+# Configuração do servidor de produção. Por padrão usa workers gevent: cada
+# conexão SSE de /process e /merge é um greenlet que passa quase todo o tempo
+# esperando os provedores, então milhares de conexões ociosas custam apenas
+# memória em vez de prender um worker inteiro cada uma.
+# GUNICORN_WORKER_CLASS=sync volta ao modo anterior (um pedido por worker).
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:7860")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+# Conexões simultâneas por worker (apenas workers gevent)
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+# Nos workers gevent o tempo limite só dispara se o event loop travar;
+# nos síncronos ele limita a duração de cada pedido
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 1300))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 60))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 75))
+
+# Pré-carregamento (GUNICORN_PRELOAD=1): o app é importado no mestre e o modelo
+# de embeddings e os SDKs dos provedores são carregados antes do fork, então os
+# workers compartilham essa memória em vez de cada um ter a sua cópia. Veja a
+# economia em /memory (soma dos RSS x soma dos PSS).
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+if preload_app and worker_class == "gevent":
+    # O worker gevent só aplica o monkey patching depois do fork; com o app já
+    # importado no mestre, as travas e threads criadas na importação seriam as
+    # nativas e bloqueariam o event loop. Aplica o patch antes da importação.
+    from gevent import monkey
+
+    monkey.patch_all()
+
+
+def on_starting(server):
+    # Os workers herdam o pid do mestre, usado no relatório de memória
+    os.environ["GUNICORN_MASTER_PID"] = str(os.getpid())
+
+
+def when_ready(server):
+    # Executado no mestre, depois da importação do app e antes do primeiro fork
+    if preload_app:
+        from serving import log_memory, preload_assets
+
+        preload_assets()
+        log_memory("Mestre após o pré-carregamento")
+
+
+def post_fork(server, worker):
+    # Executado em cada worker: recria o que não é seguro herdar do mestre
+    if preload_app:
+        from serving import after_fork
+
+        after_fork()
+
+
+def post_worker_init(worker):
+    from serving import log_memory
+
+    log_memory("Worker iniciado")
@@ -0,0 +1,401 @@
+# jobs.py
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from sse import StreamedOutputs, event
+from sqlite_store import SQLiteStore
+
+# --- Configurações do registro de jobs (ajustáveis por variáveis de ambiente) ---
+
+# Banco compartilhado pelos workers do gunicorn: um pedido de cancelamento
+# pode chegar a um worker diferente do que executa o job
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.getenv("HF_HOME", ".cache"), "jobs.sqlite"))
+# Intervalo com que cada worker procura cancelamentos dos seus jobs (segundos)
+JOBS_CANCEL_POLL_INTERVAL = float(os.getenv("JOBS_CANCEL_POLL_INTERVAL", 0.5))
+# Tempo que um job encerrado (e seu log de eventos) continua consultável (segundos)
+JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS", 3600))
+# Jobs executados ao mesmo tempo por worker; os demais aguardam na fila
+JOBS_MAX_CONCURRENCY = int(os.getenv("JOBS_MAX_CONCURRENCY", 4))
+# Espera máxima entre consultas ao log de eventos de um job (segundos)
+JOBS_EVENT_POLL_INTERVAL = float(os.getenv("JOBS_EVENT_POLL_INTERVAL", 0.5))
+# Comentário SSE enviado após este silêncio para manter a conexão aberta em proxies
+JOBS_KEEPALIVE_SECONDS = float(os.getenv("JOBS_KEEPALIVE_SECONDS", 15))
+
+QUEUED, RUNNING, FINISHED = "queued", "running", "finished"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cancellations (job_id TEXT PRIMARY KEY, requested_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class CancellationToken:
+    """
+    Token de cancelamento de um job. As chamadas aos LLMs agendadas com o
+    token ficam associadas a ele; `cancel()` cancela todas, o que fecha as
+    requisições HTTP em andamento com os provedores.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._futures = set()
+        self._lock = threading.Lock()
+        # Chamado pelo agendador (quota, posição) enquanto uma chamada espera a cota do provedor
+        self.on_wait: Optional[Callable[[str, int], None]] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, future) -> None:
+        """Associa um Future do agendador ao token (cancelado na hora se o token já foi)."""
+        with self._lock:
+            if not self.cancelled:
+                self._futures.add(future)
+                future.add_done_callback(self._discard)
+                return
+        future.cancel()
+
+    def _discard(self, future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel(self) -> int:
+        """Marca o token e cancela as chamadas em andamento; devolve quantas foram canceladas."""
+        with self._lock:
+            self._event.set()
+            futures = list(self._futures)
+        return sum(1 for future in futures if future.cancel())
+
+
+class Job:
+    """Uma execução de /process ou /merge com seu próprio token de cancelamento."""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.token = CancellationToken()
+        # False quando o pedido pede para ignorar o cache de respostas dos LLMs
+        self.use_cache = True
+        # Texto já enviado em deltas, para os resultados finais mandarem só o que falta
+        self.streamed = StreamedOutputs()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "cancelled": self.cancelled,
+            "use_cache": self.use_cache,
+        }
+
+
+class JobRegistry:
+    """
+    Fila de jobs em segundo plano com log de eventos persistente.
+
+    Cada job roda numa thread própria, limitada a JOBS_MAX_CONCURRENCY por
+    worker; enquanto espera, publica sua posição na fila. Os eventos SSE
+    produzidos são gravados num log só de acréscimo (SQLite, compartilhado
+    pelos workers), com número de sequência; o cliente pode se reconectar
+    com Last-Event-ID e receber o que perdeu, mesmo em outro worker.
+    Cancelamentos de jobs de outros workers são gravados no mesmo banco e
+    consultados periodicamente pelo worker dono. Cada thread (a de cada job,
+    a dos leitores do log, a do vigia de cancelamentos) mantém uma única
+    conexão com o banco (ver sqlite_store).
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, max_concurrency: int = JOBS_MAX_CONCURRENCY):
+        self.db_path = db_path
+        self._store = SQLiteStore(db_path, _SCHEMA, "jobs")
+        self.max_concurrency = max_concurrency
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        # Fila de espera deste worker e aviso de novos eventos para os leitores locais
+        self._slots = threading.Condition()
+        self._waiting: List[str] = []
+        self._active = 0
+        self._new_events = threading.Condition()
+        self._next_seq: Dict[str, int] = {}
+        # Eventos podem vir da thread do job e da do agendador (espera pela cota)
+        self._append_lock = threading.Lock()
+
+    def _execute(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        conn = self._store.connection()
+        with conn:
+            return conn.execute(sql, tuple(params)).fetchall()
+
+    # --- Ciclo de vida ---
+
+    def create(self, kind: str) -> Job:
+        job = Job(kind)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._next_seq[job.id] = 1
+        job.token.on_wait = lambda quota, position: self._quota_wait(job, quota, position)
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, pid, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job.id, kind, QUEUED, os.getpid(), job.created_at),
+        )
+        self._ensure_watcher()
+        print(f"[jobs] Job {job.id} ({kind}) criado", flush=True)
+        return job
+
+    def start(self, job: Job, events: Iterator[str]) -> None:
+        """Executa o gerador de eventos SSE do job em segundo plano, gravando cada evento."""
+        with self._slots:
+            self._waiting.append(job.id)
+        threading.Thread(target=self._run, args=(job, events), name=f"job-{job.id[:8]}", daemon=True).start()
+
+    def _run(self, job: Job, events: Iterator[str]) -> None:
+        try:
+            if not self._acquire_slot(job):
+                self._publish(job, {"error": "Processamento cancelado pelo usuário."})
+                return
+            self._execute("UPDATE jobs SET status = ? WHERE id = ?", (RUNNING, job.id))
+            try:
+                for event in events:
+                    self._append(job, event)
+            except Exception as e:
+                print(f"[jobs] Job {job.id} falhou: {e}", flush=True)
+                self._publish(job, {"error": f"Ocorreu um erro inesperado na aplicação: {e}"})
+            finally:
+                self._release_slot()
+        finally:
+            self.finish(job)
+
+    def _acquire_slot(self, job: Job) -> bool:
+        """Aguarda uma vaga, publicando a posição na fila; False se o job foi cancelado antes."""
+        last_position = None
+        with self._slots:
+            while True:
+                position = self._waiting.index(job.id) + 1
+                if job.cancelled:
+                    self._waiting.remove(job.id)
+                    self._slots.notify_all()
+                    return False
+                if self._active < self.max_concurrency and position == 1:
+                    self._waiting.remove(job.id)
+                    self._active += 1
+                    self._slots.notify_all()
+                    return True
+                if position != last_position:
+                    last_position = position
+                    self._publish(job, {
+                        "progress": 0,
+                        "message": f"Aguardando na fila (posição {position})...",
+                        "queue_position": position,
+                    })
+                self._slots.wait(JOBS_EVENT_POLL_INTERVAL)
+
+    def _release_slot(self) -> None:
+        with self._slots:
+            self._active -= 1
+            self._slots.notify_all()
+
+    def finish(self, job: Job) -> None:
+        job.finished_at = time.time()
+        self._execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?", (FINISHED, job.finished_at, job.id))
+        with self._new_events:
+            self._new_events.notify_all()
+        print(f"[jobs] Job {job.id} encerrado", flush=True)
+
+    # --- Log de eventos ---
+
+    def _append(self, job: Job, event: str) -> None:
+        """Grava no log do job um evento SSE já formatado (bloco 'data: ...')."""
+        with self._append_lock:
+            seq = self._next_seq[job.id]
+            self._next_seq[job.id] = seq + 1
+            self._execute("INSERT INTO events (job_id, seq, data) VALUES (?, ?, ?)", (job.id, seq, event))
+        with self._new_events:
+            self._new_events.notify_all()
+
+    def _publish(self, job: Job, data: Dict) -> None:
+        self._append(job, event({'job_id': job.id, **data}))
+
+    def _quota_wait(self, job: Job, quota: str, position: int) -> None:
+        """Publica a posição do job na fila da cota de um provedor (0: a vaga saiu)."""
+        if job.finished_at is not None:
+            return
+        provider = quota.split(":", 1)[0]
+        if position:
+            message = f"Aguardando cota do provedor {provider} (posição {position})..."
+        else:
+            message = f"Cota do provedor {provider} liberada, processando..."
+        self._publish(job, {"message": message, "provider_queue": {"quota": quota, "position": position}})
+
+    def exists(self, job_id: str) -> bool:
+        return bool(self._execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)))
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        rows = self._execute("SELECT kind, status, pid, created_at, finished_at FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        kind, status, pid, created_at, finished_at = rows[0]
+        last_event = self._execute("SELECT MAX(seq) FROM events WHERE job_id = ?", (job_id,))[0][0] or 0
+        result = {"id": job_id, "kind": kind, "status": status, "created_at": created_at,
+                  "finished_at": finished_at, "last_event_id": last_event}
+        with self._slots:
+            if job_id in self._waiting:
+                result["queue_position"] = self._waiting.index(job_id) + 1
+        return result
+
+    def _owner_gone(self, pid: int) -> bool:
+        """Indica se o worker dono de um job não está mais vivo (reinício do gunicorn)."""
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def stream(self, job_id: str, last_event_id: int = 0) -> Iterator[str]:
+        """
+        Envia os eventos do job com número de sequência maior que
+        `last_event_id` (cada um com sua linha 'id:') e acompanha os novos
+        até o job terminar.
+        """
+        last_sent = time.time()
+        while True:
+            # O estado é lido antes dos eventos: um job encerrado não gera eventos depois disso
+            rows = self._execute("SELECT status, pid FROM jobs WHERE id = ?", (job_id,))
+            if not rows:
+                return
+            status, pid = rows[0]
+            events = self._execute(
+                "SELECT seq, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, last_event_id),
+            )
+            for seq, data in events:
+                yield f"id: {seq}\n{data}"
+                last_event_id = seq
+                last_sent = time.time()
+            if events:
+                continue
+            if status == FINISHED:
+                return
+            if self._owner_gone(pid):
+                yield event({'error': 'O processamento foi interrompido pela reinicialização do servidor.'})
+                return
+            if time.time() - last_sent >= JOBS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            with self._new_events:
+                self._new_events.wait(JOBS_EVENT_POLL_INTERVAL)
+
+    # --- Cancelamento e consulta ---
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancela o job. Se ele não pertence a este worker, registra o pedido
+        para o worker dono. Devolve False se o job não existe ou já terminou.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            if job.finished_at is not None:
+                return False
+            cancelled_calls = job.token.cancel()
+            with self._slots:
+                self._slots.notify_all()
+            print(f"[jobs] Job {job_id} cancelado ({cancelled_calls} chamadas interrompidas)", flush=True)
+            return True
+        # Só registra o pedido para um job que existe e ainda não terminou (na mesma instrução)
+        conn = self._store.connection()
+        with conn:
+            registered = conn.execute(
+                "INSERT OR REPLACE INTO cancellations (job_id, requested_at) SELECT id, ? FROM jobs WHERE id = ? AND status != ?",
+                (time.time(), job_id, FINISHED),
+            ).rowcount
+        if not registered:
+            return False
+        print(f"[jobs] Cancelamento do job {job_id} registrado para outro worker", flush=True)
+        return True
+
+    def running(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.finished_at is None)
+
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def _prune(self) -> None:
+        """Remove da memória e do log os jobs encerrados há mais de JOBS_RETENTION_SECONDS."""
+        limit = time.time() - JOBS_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < limit]:
+            del self._jobs[job_id]
+            self._next_seq.pop(job_id, None)
+        conn = self._store.connection()
+        with conn:
+            conn.execute("DELETE FROM events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (limit,))
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (limit,))
+            conn.execute("DELETE FROM cancellations WHERE requested_at < ?", (limit,))
+
+    # --- Cancelamentos vindos de outros workers ---
+
+    def _ensure_watcher(self) -> None:
+        if self._watcher is None or not self._watcher.is_alive():
+            with self._lock:
+                if self._watcher is None or not self._watcher.is_alive():
+                    self._watcher = threading.Thread(target=self._watch, name="jobs-cancel-watcher", daemon=True)
+                    self._watcher.start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(JOBS_CANCEL_POLL_INTERVAL)
+            running = [job_id for job_id, job in list(self._jobs.items()) if job.finished_at is None]
+            if not running:
+                continue
+            try:
+                conn = self._store.connection()
+                placeholders = ",".join("?" * len(running))
+                rows = conn.execute(f"SELECT job_id FROM cancellations WHERE job_id IN ({placeholders})", running).fetchall()
+                if rows:
+                    with conn:
+                        conn.execute(f"DELETE FROM cancellations WHERE job_id IN ({placeholders})", running)
+            except sqlite3.Error as e:
+                print(f"[jobs] Falha ao consultar cancelamentos: {e}", flush=True)
+                continue
+            for (job_id,) in rows:
+                job = self.get(job_id)
+                if job is not None:
+                    cancelled_calls = job.token.cancel()
+                    with self._slots:
+                        self._slots.notify_all()
+                    print(f"[jobs] Job {job_id} cancelado por outro worker ({cancelled_calls} chamadas interrompidas)", flush=True)
+
+
+# Registro compartilhado pelo processo
+jobs = JobRegistry()
@@ -0,0 +1,223 @@
+# latency.py
+
+import os
+import math
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+# --- Configurações de latência, prazos e hedging (ajustáveis por variáveis de ambiente) ---
+
+# Histogramas compartilhados pelos workers e mantidos entre reinícios
+LATENCY_DB_PATH = os.getenv("LATENCY_DB_PATH", os.path.join(os.getenv("HF_HOME", ".cache"), "latency.sqlite"))
+# Amostras necessárias num histograma antes de ele substituir o prazo padrão
+LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", 20))
+# Acima deste número de amostras as contagens são reduzidas à metade, para o
+# histograma acompanhar mudanças de desempenho do provedor
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", 500))
+# Prazo adaptativo = percentil LATENCY_DEADLINE_PERCENTILE x LATENCY_DEADLINE_FACTOR, entre o mínimo e o máximo
+LATENCY_DEADLINE_PERCENTILE = float(os.getenv("LATENCY_DEADLINE_PERCENTILE", 0.99))
+LATENCY_DEADLINE_FACTOR = float(os.getenv("LATENCY_DEADLINE_FACTOR", 1.5))
+LATENCY_MIN_DEADLINE = float(os.getenv("LATENCY_MIN_DEADLINE", 60))
+LATENCY_MAX_DEADLINE = float(os.getenv("LATENCY_MAX_DEADLINE", 900))
+# Intervalo de releitura dos histogramas gravados pelos outros workers (segundos)
+LATENCY_REFRESH_SECONDS = float(os.getenv("LATENCY_REFRESH_SECONDS", 30))
+
+# Hedging: se a chamada passar do percentil HEDGE_PERCENTILE, dispara uma
+# segunda chamada (ao mesmo modelo ou ao alternativo de HEDGE_ALTERNATES,
+# ex. "openai=sonnet,gemini=sonnet") e fica com a que terminar primeiro
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0.95))
+HEDGE_ALTERNATES = dict(
+    pair.split("=", 1) for pair in os.getenv("HEDGE_ALTERNATES", "").replace(" ", "").split(",") if "=" in pair
+)
+
+# Limites superiores das faixas de latência (segundos)
+LATENCY_BINS = (1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 3600)
+# Faixas de tamanho do prompt: <4k caracteres, 4k-8k, 8k-16k, ...
+SIZE_BUCKET_BASE_CHARS = 4000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS latency (
+    provider TEXT NOT NULL,
+    size_bucket INTEGER NOT NULL,
+    bin INTEGER NOT NULL,
+    count REAL NOT NULL,
+    PRIMARY KEY (provider, size_bucket, bin)
+);
+CREATE TABLE IF NOT EXISTS latency_censored (
+    provider TEXT NOT NULL,
+    size_bucket INTEGER NOT NULL,
+    bin INTEGER NOT NULL,
+    count REAL NOT NULL,
+    PRIMARY KEY (provider, size_bucket, bin)
+);
+"""
+# Tabela de cada tipo de amostra: duração observada ou censurada ("levaria pelo menos t")
+_TABLES = {False: "latency", True: "latency_censored"}
+
+
+def prompt_chars(inputs: Dict) -> int:
+    """Tamanho aproximado do prompt: soma das variáveis enviadas ao template."""
+    return sum(len(str(value)) for value in inputs.values())
+
+
+def size_bucket(chars: int) -> int:
+    if chars < SIZE_BUCKET_BASE_CHARS:
+        return 0
+    return int(math.log2(chars / SIZE_BUCKET_BASE_CHARS)) + 1
+
+
+def _bucket_label(bucket: int) -> str:
+    if bucket == 0:
+        return f"<{SIZE_BUCKET_BASE_CHARS // 1000}k"
+    low = SIZE_BUCKET_BASE_CHARS * 2 ** (bucket - 1) // 1000
+    return f"{low}k-{low * 2}k"
+
+
+def _bin_index(seconds: float) -> int:
+    for index, bound in enumerate(LATENCY_BINS):
+        if seconds <= bound:
+            return index
+    return len(LATENCY_BINS) - 1
+
+
+def _percentile(counts: List[float], q: float, censored: Optional[List[float]] = None) -> Optional[float]:
+    """
+    Percentil `q` do histograma pelo estimador de Kaplan-Meier: as chamadas
+    que estouraram o prazo, falharam ou foram canceladas (`censored`) só
+    dizem que a resposta levaria pelo menos aquele tempo, e saem da conta a
+    partir da sua faixa, em vez de serem ignoradas (o que puxaria p95/p99
+    para baixo). Se o percentil não é alcançado, devolve a última faixa.
+    """
+    censored = censored or [0.0] * len(counts)
+    at_risk = sum(counts) + sum(censored)
+    if not at_risk:
+        return None
+    survival = 1.0
+    for index, (events, lost) in enumerate(zip(counts, censored)):
+        if at_risk <= 0:
+            break
+        survival *= 1 - events / at_risk
+        if 1 - survival >= q - 1e-9:
+            return float(LATENCY_BINS[index])
+        at_risk -= events + lost
+    return float(LATENCY_BINS[-1])
+
+
+class LatencyTracker:
+    """
+    Histogramas de latência por provedor e faixa de tamanho do prompt, com
+    os percentis usados para os prazos adaptativos e para decidir quando
+    disparar uma chamada de reserva (hedging). Só registra chamadas que
+    foram de fato ao provedor (não as respostas do cache); as que não
+    terminaram com sucesso (prazo, erro, cancelamento) entram como amostras
+    censuradas, no tempo em que pararam.
+    """
+
+    def __init__(self, path: str = LATENCY_DB_PATH):
+        self.path = path
+        self._store = SQLiteStore(path, _SCHEMA, "latency")
+        self._lock = threading.Lock()
+        self._histograms: Dict[tuple, List[float]] = {}
+        self._loaded_at = 0.0
+
+    def _write(self, provider: str, bucket: int, index: int, censored: bool) -> None:
+        conn = self._store.connection()
+        with conn:
+            conn.execute(
+                f"INSERT INTO {_TABLES[censored]} (provider, size_bucket, bin, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(provider, size_bucket, bin) DO UPDATE SET count = count + 1",
+                (provider, bucket, index),
+            )
+            total = sum(
+                conn.execute(
+                    f"SELECT COALESCE(SUM(count), 0) FROM {table} WHERE provider = ? AND size_bucket = ?", (provider, bucket)
+                ).fetchone()[0]
+                for table in _TABLES.values()
+            )
+            if total > LATENCY_WINDOW:
+                for table in _TABLES.values():
+                    conn.execute(
+                        f"UPDATE {table} SET count = count / 2 WHERE provider = ? AND size_bucket = ?", (provider, bucket)
+                    )
+
+    def record(self, provider: str, chars: int, seconds: float, censored: bool = False) -> None:
+        """
+        Registra uma amostra (`censored`: a chamada parou sem resposta após
+        `seconds`). Chamado do event loop do agendador: a gravação no banco
+        vai para a thread do banco (ver sqlite_store), sem esperar.
+        """
+        bucket = size_bucket(chars)
+        self._store.submit(self._write, provider, bucket, _bin_index(seconds), censored)
+        with self._lock:
+            # A própria amostra entra na hora; as dos outros workers, na próxima releitura
+            histogram = self._histograms.setdefault((provider, bucket), ([0.0] * len(LATENCY_BINS), [0.0] * len(LATENCY_BINS)))
+            histogram[censored][_bin_index(seconds)] += 1
+        suffix = " (sem resposta)" if censored else ""
+        print(f"[latency] {provider} ({_bucket_label(bucket)} chars): {seconds:.1f}s{suffix}", flush=True)
+
+    def _load(self) -> Dict[tuple, Tuple[List[float], List[float]]]:
+        with self._lock:
+            if time.time() - self._loaded_at < LATENCY_REFRESH_SECONDS:
+                return self._histograms
+        conn = self._store.connection()
+        histograms: Dict[tuple, Tuple[List[float], List[float]]] = {}
+        for censored, table in _TABLES.items():
+            for provider, bucket, index, count in conn.execute(f"SELECT provider, size_bucket, bin, count FROM {table}").fetchall():
+                histogram = histograms.setdefault((provider, bucket), ([0.0] * len(LATENCY_BINS), [0.0] * len(LATENCY_BINS)))
+                histogram[censored][index] = count
+        with self._lock:
+            self._histograms = histograms
+            self._loaded_at = time.time()
+        return histograms
+
+    def _counts(self, provider: str, chars: int) -> Optional[Tuple[List[float], List[float]]]:
+        """Histograma da faixa do prompt; se tiver poucas amostras, junta as faixas vizinhas."""
+        histograms = self._load()
+        bucket = size_bucket(chars)
+        for spread in (0, 1):
+            merged = ([0.0] * len(LATENCY_BINS), [0.0] * len(LATENCY_BINS))
+            for neighbour in range(bucket - spread, bucket + spread + 1):
+                for kind, counts in enumerate(histograms.get((provider, neighbour), ())):
+                    for index, count in enumerate(counts):
+                        merged[kind][index] += count
+            if sum(merged[0]) + sum(merged[1]) >= LATENCY_MIN_SAMPLES:
+                return merged
+        return None
+
+    def percentile(self, provider: str, chars: int, q: float) -> Optional[float]:
+        counts = self._counts(provider, chars)
+        return _percentile(counts[0], q, counts[1]) if counts else None
+
+    def deadline(self, provider: str, chars: int, default: float) -> float:
+        """Prazo da chamada: derivado do histograma, ou `default` enquanto houver poucas amostras."""
+        p = self.percentile(provider, chars, LATENCY_DEADLINE_PERCENTILE)
+        if p is None:
+            return default
+        return min(LATENCY_MAX_DEADLINE, max(LATENCY_MIN_DEADLINE, p * LATENCY_DEADLINE_FACTOR))
+
+    def hedge_delay(self, provider: str, chars: int) -> Optional[float]:
+        """Tempo após o qual vale disparar a chamada de reserva (None: sem dados ou hedging desligado)."""
+        if not HEDGE_ENABLED:
+            return None
+        return self.percentile(provider, chars, HEDGE_PERCENTILE)
+
+    def status(self) -> Dict:
+        histograms = self._load()
+        providers: Dict[str, Dict] = {}
+        for (provider, bucket), (counts, censored) in sorted(histograms.items()):
+            providers.setdefault(provider, {})[_bucket_label(bucket)] = {
+                "samples": round(sum(counts)),
+                "censored": round(sum(censored)),
+                "p50": _percentile(counts, 0.5, censored),
+                "p95": _percentile(counts, 0.95, censored),
+                "p99": _percentile(counts, 0.99, censored),
+            }
+        return {"hedge_enabled": HEDGE_ENABLED, "hedge_alternates": HEDGE_ALTERNATES, "providers": providers}
+
+
+# Instância compartilhada pelo processo
+latency_tracker = LatencyTracker()
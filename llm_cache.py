@@ -0,0 +1,300 @@
+# llm_cache.py
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from rate_limit import pid_alive
+from sqlite_store import SQLiteStore
+
+# --- Configurações do cache de respostas (ajustáveis por variáveis de ambiente) ---
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.getenv("HF_HOME", ".cache"), "llm_cache.sqlite"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Um worker que encontra a mesma chamada em andamento em outro worker espera
+# por ela até este limite (segundos) antes de chamar o provedor por conta própria
+LLM_CACHE_LEASE_SECONDS = int(os.getenv("LLM_CACHE_LEASE_SECONDS", 900))
+LLM_CACHE_POLL_INTERVAL = float(os.getenv("LLM_CACHE_POLL_INTERVAL", 1.0))
+# A remoção por idade e tamanho roda a cada N respostas gravadas (não a cada uma)
+LLM_CACHE_EVICT_EVERY = int(os.getenv("LLM_CACHE_EVICT_EVERY", 50))
+
+# Atributos do modelo que mudam a resposta e entram na chave
+_MODEL_ATTRIBUTES = ("model", "model_name", "assistant_id", "temperature", "top_p", "top_k", "max_tokens", "max_output_tokens")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def _describe_step(step) -> Dict[str, Any]:
+    """
+    Identifica um passo da chain: classe, parâmetros vinculados (bind),
+    atributos do modelo e o provedor dos invólucros que o informam (ex.
+    HealthGuarded), que somem ao desembrulhar o passo.
+    """
+    bound: Dict[str, Any] = {}
+    provider = None
+    while hasattr(step, "bound") and hasattr(step, "kwargs"):
+        bound.update(step.kwargs)
+        if isinstance(getattr(step, "provider", None), str):
+            provider = provider or step.provider
+        step = step.bound
+    description: Dict[str, Any] = {"class": type(step).__name__}
+    if provider:
+        description["provider"] = provider
+    if hasattr(step, "steps"):
+        # Modelo composto (ex. o assistente da OpenAI, entre conversões de formato)
+        description["steps"] = [_describe_step(inner) for inner in step.steps]
+    for attribute in _MODEL_ATTRIBUTES:
+        value = getattr(step, attribute, None)
+        if isinstance(value, (str, int, float, bool)):
+            description[attribute] = value
+    if bound:
+        description["bound"] = bound
+    return description
+
+
+def cache_key(chain, inputs: Dict[str, Any], provider: Optional[str] = None) -> Optional[str]:
+    """
+    Chave exata de uma chamada `prompt | llm | parser`: provedor, modelo,
+    parâmetros vinculados (ex. max_tokens) e hash do prompt já renderizado.
+    O nome do `provider` entra explicitamente: dois provedores com a mesma
+    classe de cliente e o mesmo prompt não podem dividir a resposta.
+    Devolve None se a chain não tiver esse formato (a chamada não é cacheada).
+    """
+    steps = getattr(chain, "steps", None)
+    if not steps or len(steps) < 2 or not hasattr(steps[0], "format"):
+        return None
+    try:
+        rendered = steps[0].format(**inputs)
+    except Exception:
+        return None
+    fingerprint = {
+        "provider": provider,
+        "steps": [_describe_step(step) for step in steps[1:]],
+        "prompt": hashlib.sha256(rendered.encode("utf-8")).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """Uma chamada em andamento, compartilhada por todos os pedidos idênticos."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.subscribers: List[Callable[[str], None]] = []
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, piece: str) -> None:
+        self.parts.append(piece)
+        for subscriber in list(self.subscribers):
+            subscriber(piece)
+
+
+class LLMResponseCache:
+    """
+    Cache exato das respostas dos LLMs, em SQLite (compartilhado pelos
+    workers), com expiração por idade e remoção LRU acima do limite de
+    tamanho (verificada a cada LLM_CACHE_EVICT_EVERY gravações).
+
+    Chamadas idênticas simultâneas são agrupadas (single-flight): no mesmo
+    processo, todas aguardam a mesma tarefa e recebem os mesmos deltas; entre
+    workers, uma reserva (lease) no banco faz os demais esperarem a resposta
+    gravada. A chamada compartilhada só é cancelada quando todos os pedidos
+    que a aguardam desistem. Deve ser usado a partir do event loop do
+    agendador de LLMs; o acesso ao banco roda fora do loop, na thread do
+    banco (ver sqlite_store).
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH):
+        self.path = path
+        self._store = SQLiteStore(path, _SCHEMA, "llm_cache")
+        self._flights: Dict[str, _Flight] = {}
+        self._puts_since_evict = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+
+    # --- Armazenamento (na thread do banco) ---
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._store.connection()
+        with conn:
+            row = conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                (key, time.time() - LLM_CACHE_TTL_SECONDS),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        conn = self._store.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, bytes, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+        self.stats["stores"] += 1
+        self._puts_since_evict += 1
+        if self._puts_since_evict >= LLM_CACHE_EVICT_EVERY:
+            self._puts_since_evict = 0
+            self._evict()
+
+    def _evict(self) -> None:
+        conn = self._store.connection()
+        with conn:
+            removed = conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - LLM_CACHE_TTL_SECONDS,)
+            ).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+            if total > LLM_CACHE_MAX_BYTES:
+                # Percorre o índice por acesso só até liberar o excesso
+                for key, size in conn.execute("SELECT key, bytes FROM responses ORDER BY accessed_at"):
+                    if total <= LLM_CACHE_MAX_BYTES:
+                        break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+        self.stats["evictions"] += removed
+
+    # --- Reserva entre workers (na thread do banco) ---
+
+    def _acquire_lease(self, key: str) -> bool:
+        now = time.time()
+        conn = self._store.connection()
+        with conn:
+            row = conn.execute("SELECT pid, expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+            if row is not None and (row[1] < now or not pid_alive(row[0])):
+                # Reserva vencida ou de um worker que morreu sem liberá-la
+                conn.execute("DELETE FROM leases WHERE key = ? AND pid = ?", (key, row[0]))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO leases (key, pid, expires_at) VALUES (?, ?, ?)",
+                (key, os.getpid(), now + LLM_CACHE_LEASE_SECONDS),
+            )
+            return cursor.rowcount == 1
+
+    def _release_lease(self, key: str) -> None:
+        conn = self._store.connection()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND pid = ?", (key, os.getpid()))
+
+    # --- Execução com cache e single-flight ---
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[Callable[[str], None]], Awaitable[str]],
+        on_piece: Optional[Callable[[str], None]] = None,
+        use_cache: bool = True,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Devolve a resposta de `key`: do cache, de uma chamada idêntica em
+        andamento ou executando `compute(publish)`. `on_piece` recebe os
+        deltas (de uma só vez, se a resposta vier do cache). Com
+        `use_cache=False` o cache é ignorado na leitura, mas a nova resposta
+        é gravada. `timeout` (o prazo da chamada) limita a espera pela
+        chamada idêntica de outro pedido ou de outro worker; esgotado, sai
+        com asyncio.TimeoutError.
+        """
+        if not use_cache:
+            self.stats["bypassed"] += 1
+            result = await compute(on_piece or (lambda piece: None))
+            if isinstance(result, str) and result.strip():
+                await self._store.call(self.put, key, result)
+            return result
+
+        cached = await self._store.call(self.get, key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            print(f"[llm_cache] Resposta em cache ({len(cached)} chars, chave {key[:12]})", flush=True)
+            if on_piece:
+                on_piece(cached)
+            return cached
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.stats["misses"] += 1
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(self._lead(key, flight, compute, timeout))
+            leader = True
+        else:
+            leader = False
+            self.stats["coalesced"] += 1
+            print(f"[llm_cache] Chamada idêntica em andamento, aguardando a mesma resposta (chave {key[:12]})", flush=True)
+            if on_piece and flight.parts:
+                on_piece("".join(flight.parts))
+
+        if on_piece:
+            flight.subscribers.append(on_piece)
+        flight.waiters += 1
+        try:
+            if leader:
+                # O prazo do líder já vale dentro de _lead (espera pela reserva) e de compute
+                return await asyncio.shield(flight.task)
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        finally:
+            flight.waiters -= 1
+            if on_piece in flight.subscribers:
+                flight.subscribers.remove(on_piece)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def _lead(self, key: str, flight: _Flight, compute, timeout: Optional[float]) -> str:
+        try:
+            # Outro worker já está fazendo a mesma chamada: espera a resposta dele, dentro do prazo
+            started = time.monotonic()
+            while not await self._store.call(self._acquire_lease, key):
+                if timeout is not None and time.monotonic() - started >= timeout:
+                    raise asyncio.TimeoutError(f"chamada idêntica em outro worker não terminou em {timeout:g}s")
+                await asyncio.sleep(LLM_CACHE_POLL_INTERVAL)
+                cached = await self._store.call(self.get, key)
+                if cached is not None:
+                    self.stats["coalesced"] += 1
+                    flight.publish(cached)
+                    return cached
+            try:
+                result = await compute(flight.publish)
+                if isinstance(result, str) and result.strip():
+                    await self._store.call(self.put, key, result)
+                return result
+            finally:
+                # Sem aguardar: o finally também roda no cancelamento
+                self._store.submit(self._release_lease, key)
+        finally:
+            self._flights.pop(key, None)
+
+    def status(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        entries, size = self._store.connection().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "entries": entries,
+            "size_bytes": size,
+            "in_flight": len(self._flights),
+            "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 3) if lookups else 0.0,
+            **self.stats,
+        }
+
+
+# Instância compartilhada pelo processo
+llm_cache = LLMResponseCache()
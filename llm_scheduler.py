@@ -0,0 +1,284 @@
+# llm_scheduler.py
+
+import os
+import time
+import queue
+import asyncio
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+from llm_cache import LLM_CACHE_ENABLED, cache_key, llm_cache
+from latency import latency_tracker, prompt_chars
+from provider_health import health_tracker
+from rate_limit import quota_key, rate_limiter
+from serving import NativeThreadPoolExecutor, start_native_thread
+
+# --- Configurações do agendador (ajustáveis por variáveis de ambiente) ---
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_DEFAULT_TIMEOUT", 900))
+
+_STREAM_DONE = object()
+
+
+class LLMScheduler:
+    """
+    Agendador único do processo para as chamadas aos LLMs.
+
+    Todas as chamadas rodam como tarefas de um event loop asyncio mantido
+    numa thread própria (do sistema operacional, também nos workers
+    gevent), usando `ainvoke`/`astream` das chains. Um semáforo
+    limita as chamadas simultâneas; as demais aguardam na fila. O tempo
+    limite e o cancelamento cancelam a tarefa, o que fecha a requisição HTTP
+    em andamento em vez de deixar uma thread presa a ela.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._start_lock = threading.Lock()
+        self._counters = {"waiting": 0, "in_flight": 0, "completed": 0, "failed": 0, "timeouts": 0, "cancelled": 0, "hedges": 0, "hedge_wins": 0}
+
+    # --- Event loop ---
+
+    def reset_after_fork(self) -> None:
+        """No processo filho a thread do event loop não existe mais: recria tudo na próxima chamada."""
+        self._loop = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+        self._counters = {name: 0 for name in self._counters}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    started: "queue.Queue[asyncio.AbstractEventLoop]" = queue.Queue()
+
+                    def run():
+                        # Criado na própria thread: num worker gevent o seletor fica no hub dela
+                        loop = asyncio.new_event_loop()
+                        # Executor padrão do loop (getaddrinfo dos clientes HTTP) também em threads nativas
+                        loop.set_default_executor(NativeThreadPoolExecutor(thread_name_prefix="llm-scheduler-io"))
+                        asyncio.set_event_loop(loop)
+                        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                        loop.call_soon(started.put, loop)
+                        loop.run_forever()
+
+                    start_native_thread(run, "llm-scheduler")
+                    self._loop = started.get()
+        return self._loop
+
+    async def _run(self, coro_factory: Callable[[], Awaitable[Any]], timeout: Optional[float], provider: Optional[str] = None,
+                   quota: Optional[str] = None, on_wait: Optional[Callable[[str, int], None]] = None, chars: Optional[int] = None) -> Any:
+        self._counters["waiting"] += 1
+        acquired = False
+        running = False
+        lease = None
+        try:
+            await self._semaphore.acquire()
+            acquired = True
+            # Cota do provedor, compartilhada pelos workers (ver rate_limit), tomada só com a
+            # vaga local em mãos: ninguém segura cota enquanto espera o semáforo. A espera não conta no prazo
+            if quota is not None:
+                lease = await rate_limiter.acquire(quota, on_wait)
+            self._counters["waiting"] -= 1
+            self._counters["in_flight"] += 1
+            running = True
+            # Com `chars`, a duração entra no histograma de latência do provedor; as chamadas
+            # sem resposta (prazo, erro, cancelamento) entram como censuradas, no tempo em que pararam
+            started = time.monotonic()
+            answered = False
+            try:
+                result = await asyncio.wait_for(coro_factory(), timeout or LLM_DEFAULT_TIMEOUT)
+                answered = True
+                self._counters["completed"] += 1
+                return result
+            except asyncio.TimeoutError:
+                self._counters["timeouts"] += 1
+                if provider is not None:
+                    # Estourar o prazo conta como falha para o disjuntor do provedor
+                    health_tracker.record_failure(provider, TimeoutError(f"prazo de {timeout or LLM_DEFAULT_TIMEOUT:.0f}s excedido"))
+                raise
+            except asyncio.CancelledError:
+                self._counters["cancelled"] += 1
+                raise
+            except Exception:
+                self._counters["failed"] += 1
+                raise
+            finally:
+                self._counters["in_flight"] -= 1
+                if provider is not None and chars is not None:
+                    latency_tracker.record(provider, chars, time.monotonic() - started, censored=not answered)
+        finally:
+            if not running:
+                # Cancelado (ou sem cota) ainda na fila
+                self._counters["waiting"] -= 1
+            if acquired:
+                self._semaphore.release()
+            rate_limiter.release(lease)
+
+    def _cached(self, chain, inputs: Dict[str, Any], compute, on_piece, timeout: Optional[float], use_cache: bool,
+                provider: Optional[str] = None, on_wait: Optional[Callable[[str, int], None]] = None) -> Awaitable[Any]:
+        """
+        Corrotina da chamada `compute(publish)` passando pelo cache de respostas
+        (ver llm_cache). Pedidos idênticos simultâneos esperam fora do semáforo,
+        sem ocupar vaga de chamada.
+        """
+        key = cache_key(chain, inputs, provider) if LLM_CACHE_ENABLED else None
+        quota = quota_key(provider, chain) if provider is not None else None
+        # Só as chamadas que vão de fato ao provedor (não as respostas do cache) entram no histograma
+        chars = prompt_chars(inputs) if provider is not None else None
+        if key is None:
+            return self._run(lambda: compute(on_piece or (lambda piece: None)), timeout, provider, quota, on_wait, chars)
+        return llm_cache.run(key, lambda publish: self._run(lambda: compute(publish), timeout, provider, quota, on_wait, chars), on_piece, use_cache,
+                             timeout or LLM_DEFAULT_TIMEOUT)
+
+    @staticmethod
+    def _invoke_compute(chain, inputs: Dict[str, Any]):
+        async def compute(publish):
+            result = await chain.ainvoke(inputs)
+            # Pedidos em streaming agrupados a esta chamada recebem o texto de uma vez
+            if isinstance(result, str) and result:
+                publish(result)
+            return result
+        return compute
+
+    @staticmethod
+    def _stream_compute(chain, inputs: Dict[str, Any]):
+        async def compute(publish):
+            parts = []
+            async for piece in chain.astream(inputs):
+                if piece:
+                    parts.append(piece)
+                    publish(piece)
+            return "".join(parts)
+        return compute
+
+    def _call(self, chain, inputs, on_piece, timeout, use_cache, provider, on_wait=None) -> Awaitable[Any]:
+        compute = self._stream_compute(chain, inputs) if on_piece else self._invoke_compute(chain, inputs)
+        return self._cached(chain, inputs, compute, on_piece, timeout, use_cache, provider, on_wait)
+
+    @staticmethod
+    def _on_wait(token) -> Optional[Callable[[str, int], None]]:
+        """Aviso de espera pela cota do provedor, publicado pelo job dono do token."""
+        return getattr(token, "on_wait", None)
+
+    async def _hedged(self, primary, backup, hedge_after: float, on_piece, use_cache: bool, on_wait=None) -> Any:
+        """
+        Executa a chamada principal; se ela passar de `hedge_after` segundos,
+        dispara a reserva e devolve a primeira resposta não vazia. A perdedora
+        é cancelada. Só os deltas da principal são repassados; se a reserva
+        vencer, o texto dela chega como resultado final.
+        """
+        chain, inputs, provider, timeout = primary
+        first = asyncio.ensure_future(self._call(chain, inputs, on_piece, timeout, use_cache, provider, on_wait))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                backup_chain, backup_inputs, backup_provider, backup_timeout = backup
+                self._counters["hedges"] += 1
+                print(f"[llm_scheduler] {provider} passou de {hedge_after:.0f}s; disparando chamada de reserva ({backup_provider})", flush=True)
+                # A reserva não entra no single-flight do cache (seria a mesma chamada lenta)
+                tasks.add(asyncio.ensure_future(self._call(backup_chain, backup_inputs, None, backup_timeout, False, backup_provider, on_wait)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    result = task.result()
+                    if isinstance(result, str) and not result.strip() and tasks:
+                        continue
+                    if task is not first:
+                        self._counters["hedge_wins"] += 1
+                        print(f"[llm_scheduler] A chamada de reserva ({backup_provider}) respondeu primeiro", flush=True)
+                    return result
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # --- API síncrona usada pelas rotas ---
+
+    def _schedule(self, coro: Awaitable[Any], token=None) -> concurrent.futures.Future:
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        if token is not None:
+            token.attach(future)
+        return future
+
+    def submit(self, coro_factory: Callable[[], Awaitable[Any]], timeout: Optional[float] = None, token=None) -> concurrent.futures.Future:
+        """
+        Agenda uma corrotina e devolve um Future. `future.cancel()` cancela a
+        tarefa no loop (e, com ela, a requisição ao provedor). Com `token`
+        (ver jobs.CancellationToken), o Future é cancelado junto com o job.
+        """
+        return self._schedule(self._run(coro_factory, timeout), token)
+
+    def submit_invoke(self, chain, inputs: Dict[str, Any], timeout: Optional[float] = None, token=None, use_cache: bool = True, provider: Optional[str] = None) -> concurrent.futures.Future:
+        """
+        Agenda `chain.ainvoke(inputs)` passando pelo cache de respostas.
+        Com `use_cache=False` a resposta é gerada de novo (e regravada no cache).
+        Com `provider`, a duração entra no histograma de latência dele.
+        """
+        return self._schedule(self._call(chain, inputs, None, timeout, use_cache, provider, self._on_wait(token)), token)
+
+    def invoke(self, chain, inputs: Dict[str, Any], timeout: Optional[float] = None, token=None, use_cache: bool = True, provider: Optional[str] = None) -> Any:
+        future = self.submit_invoke(chain, inputs, timeout, token, use_cache, provider)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def submit_stream(self, chain, inputs: Dict[str, Any], on_piece: Callable[[Any], None], timeout: Optional[float] = None, token=None, use_cache: bool = True, provider: Optional[str] = None) -> concurrent.futures.Future:
+        """
+        Agenda `chain.astream(inputs)`, chamando `on_piece` (na thread do loop)
+        a cada pedaço recebido. O Future resolve com o texto completo. Uma
+        resposta vinda do cache chega num único pedaço.
+        """
+        return self._schedule(self._call(chain, inputs, on_piece, timeout, use_cache, provider, self._on_wait(token)), token)
+
+    def submit_hedged(self, primary, backup, hedge_after: Optional[float], on_piece: Optional[Callable[[Any], None]] = None, token=None, use_cache: bool = True) -> concurrent.futures.Future:
+        """
+        Como submit_stream/submit_invoke (conforme `on_piece`), com chamada de
+        reserva. `primary` e `backup` são tuplas (chain, inputs, provedor,
+        prazo); sem `backup` ou `hedge_after` é uma chamada comum.
+        """
+        if backup is None or hedge_after is None:
+            chain, inputs, provider, timeout = primary
+            return self._schedule(self._call(chain, inputs, on_piece, timeout, use_cache, provider, self._on_wait(token)), token)
+        return self._schedule(self._hedged(primary, backup, hedge_after, on_piece, use_cache, self._on_wait(token)), token)
+
+    def stream(self, chain, inputs: Dict[str, Any], timeout: Optional[float] = None, token=None, use_cache: bool = True, provider: Optional[str] = None) -> Iterator[Any]:
+        """
+        Iterador síncrono sobre `chain.astream(inputs)`. Se o consumidor parar
+        de iterar, a tarefa é cancelada e a conexão com o provedor fechada.
+        """
+        pieces: "queue.Queue[Any]" = queue.Queue()
+        future = self.submit_stream(chain, inputs, pieces.put, timeout, token, use_cache, provider)
+        future.add_done_callback(lambda _: pieces.put(_STREAM_DONE))
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is _STREAM_DONE:
+                    future.result()
+                    return
+                yield piece
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Medidores: chamadas na fila (queue depth), em andamento e totais."""
+        return {"max_concurrency": self.max_concurrency, **self._counters}
+
+
+# Instância compartilhada pelo processo
+llm_scheduler = LLMScheduler()
@@ -1,19 +1,30 @@
 # llms.py
 
 import os
+import time
+import importlib
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from dotenv import load_dotenv
-# from langchain_openai import ChatOpenAI
-from custom_grok import GrokChatModel
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
-from langchain_experimental.openai_assistant import OpenAIAssistantRunnable
 from langchain_core.agents import AgentFinish
 from langchain_core.runnables import RunnableLambda
+from prompt_cache import usage_by_provider
+from provider_health import with_health
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
 
+# Tempo limite dos clientes HTTP (segundos). É só o teto: o agendador de LLMs
+# encerra antes as chamadas que passam do prazo adaptativo de cada provedor.
+LLM_CLIENT_TIMEOUT = float(os.getenv("LLM_CLIENT_TIMEOUT", 900))
+# Os clientes dos provedores são criados na primeira utilização. Provedores
+# listados aqui ("claude,gemini" ou "all") são criados já na importação.
+LLM_EAGER_PROVIDERS = os.getenv("LLM_EAGER_PROVIDERS", "")
+# Importa os SDKs dos provedores na importação deste módulo, sem criar os
+# clientes. Com o --preload do gunicorn isso acontece uma vez no processo
+# mestre e os workers herdam os módulos já carregados (copy-on-write).
+LLM_PRELOAD_SDKS = os.getenv("LLM_PRELOAD_SDKS", "0") == "1"
+
 # --- Funções Auxiliares para o OpenAI Assistant ---
 
 def format_assistant_input(prompt_value):
@@ -41,39 +52,186 @@ def parse_assistant_output(assistant_finish_object):
     # Retorna uma string vazia se o formato for inesperado
     return ""
 
-# --- Inicialização dos LLMs ---
+# --- Construção dos LLMs (uma função por provedor) ---
 
-# OpenAI
-assistant_runnable = OpenAIAssistantRunnable(
-    assistant_id=os.getenv("OPENAI_ASSISTANT_ID"), 
-    as_agent=True,
-    timeout=900
-)
+def _build_openai():
+    from langchain_experimental.openai_assistant import OpenAIAssistantRunnable
 
-openai_llm = (
-    RunnableLambda(format_assistant_input) # Recebe PromptValue, retorna dict
-    | assistant_runnable                   # Executa o assistente
-    | RunnableLambda(parse_assistant_output) # Recebe lista de mensagens, retorna string
-)
+    assistant_runnable = OpenAIAssistantRunnable(
+        assistant_id=os.getenv("OPENAI_ASSISTANT_ID"), 
+        as_agent=True,
+        timeout=LLM_CLIENT_TIMEOUT
+    )
+    return (
+        RunnableLambda(format_assistant_input) # Recebe PromptValue, retorna dict
+        | assistant_runnable                   # Executa o assistente
+        | RunnableLambda(parse_assistant_output) # Recebe lista de mensagens, retorna string
+    )
 
 # GROK da xAI
-grok_llm = GrokChatModel(
-   api_key=os.getenv("X_API_KEY"),
-   model=os.getenv("GROK_MODEL_ID"),
-   base_url=os.getenv("X_API_BASE_URL"),
-   timeout=900
-)
+def _build_grok():
+    from custom_grok import GrokChatModel
+
+    return GrokChatModel(
+       api_key=os.getenv("X_API_KEY"),
+       model=os.getenv("GROK_MODEL_ID"),
+       base_url=os.getenv("X_API_BASE_URL"),
+       timeout=LLM_CLIENT_TIMEOUT,
+       callbacks=[usage_by_provider["grok"]]
+    )
 
 # Claude Sonnet
-claude_llm = ChatAnthropic(
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    model_name=os.getenv("CLAUDE_MODEL_ID"),
-    timeout=900
-)
+def _build_claude():
+    from langchain_anthropic import ChatAnthropic
+
+    return ChatAnthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        model_name=os.getenv("CLAUDE_MODEL_ID"),
+        timeout=LLM_CLIENT_TIMEOUT,
+        # Tokens de entrada lidos/gravados no cache de prompt, a cada chamada
+        callbacks=[usage_by_provider["claude"]]
+    )
 
 # Gemini
-gemini_llm = ChatGoogleGenerativeAI(
-    google_api_key=os.getenv("GOOGLE_API_KEY"),
-    model=os.getenv("GEMINI_MODEL_ID"),
-    timeout=900
-)
+def _build_gemini():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        model=os.getenv("GEMINI_MODEL_ID"),
+        timeout=LLM_CLIENT_TIMEOUT,
+        callbacks=[usage_by_provider["gemini"]]
+    )
+
+# Provedor: (função que cria o LLM, variáveis de ambiente obrigatórias, módulos do SDK)
+PROVIDERS: Dict[str, Tuple[Callable[[], Any], Tuple[str, ...], Tuple[str, ...]]] = {
+    "openai": (_build_openai, ("OPENAI_API_KEY", "OPENAI_ASSISTANT_ID"), ("langchain_experimental.openai_assistant",)),
+    "grok": (_build_grok, ("X_API_KEY", "GROK_MODEL_ID", "X_API_BASE_URL"), ("custom_grok",)),
+    "claude": (_build_claude, ("ANTHROPIC_API_KEY", "CLAUDE_MODEL_ID"), ("langchain_anthropic",)),
+    "gemini": (_build_gemini, ("GOOGLE_API_KEY", "GEMINI_MODEL_ID"), ("langchain_google_genai",)),
+}
+
+
+class ProviderNotConfigured(Exception):
+    """O LLM do provedor não pôde ser criado (variável de ambiente ausente, SDK não instalado...)."""
+
+
+class ProviderRegistry:
+    """
+    Cria o LLM de cada provedor na primeira utilização (uma vez por processo)
+    e o envolve com o disjuntor do provedor (provider_health.py): com o
+    circuito aberto, a chamada falha na hora em vez de esperar o timeout.
+    Um provedor sem configuração não impede o servidor de subir; o erro
+    aparece só quando ele é usado, e em status().
+    """
+
+    def __init__(self, providers=PROVIDERS):
+        self.providers = providers
+        self._models: Dict[str, Any] = {}
+        self._locks = {name: threading.Lock() for name in providers}
+        self._errors: Dict[str, str] = {}
+        self._seconds: Dict[str, float] = {}
+
+    def missing_env(self, name: str) -> List[str]:
+        return [var for var in self.providers[name][1] if not os.getenv(var)]
+
+    def configured(self, name: str) -> bool:
+        """Se o provedor tem as variáveis de ambiente necessárias (sem criar o cliente)."""
+        return name in self.providers and not self.missing_env(name)
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self.providers:
+            raise ProviderNotConfigured(f"Provedor desconhecido: {name}")
+        with self._locks[name]:
+            if name not in self._models:
+                missing = self.missing_env(name)
+                if missing:
+                    self._errors[name] = f"variáveis de ambiente ausentes: {', '.join(missing)}"
+                    raise ProviderNotConfigured(f"{name} não está configurado ({self._errors[name]}).")
+                started = time.time()
+                try:
+                    self._models[name] = with_health(self.providers[name][0](), name)
+                except Exception as e:
+                    self._errors[name] = f"{type(e).__name__}: {e}"[:300]
+                    print(f"[llms] Falha ao criar o LLM de {name}: {self._errors[name]}", flush=True)
+                    raise ProviderNotConfigured(f"{name} não pôde ser inicializado ({self._errors[name]}).") from e
+                self._errors.pop(name, None)
+                self._seconds[name] = round(time.time() - started, 3)
+                print(f"[llms] LLM de {name} criado em {self._seconds[name]}s", flush=True)
+            return self._models[name]
+
+    def reset_after_fork(self) -> None:
+        """Descarta os clientes criados antes do fork (pools de conexões HTTP não são compartilháveis)."""
+        self._models = {}
+        self._locks = {name: threading.Lock() for name in self.providers}
+
+    def _names(self, names: Optional[Iterable[str]]) -> List[str]:
+        if names is None:
+            return list(self.providers)
+        return [name for name in names if name in self.providers]
+
+    def import_sdks(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """Só importa os SDKs (seguro antes do fork dos workers); devolve o tempo de cada um."""
+        timings = {}
+        for name in self._names(names):
+            started = time.time()
+            try:
+                for module in self.providers[name][2]:
+                    importlib.import_module(module)
+            except ImportError as e:
+                print(f"[llms] SDK de {name} não disponível: {e}", flush=True)
+                continue
+            timings[name] = round(time.time() - started, 3)
+        return timings
+
+    def warmup(self, names: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Cria os LLMs dos provedores configurados; um provedor com erro não afeta os demais."""
+        result = {}
+        for name in self._names(names):
+            if not self.configured(name):
+                result[name] = {"ok": False, "error": f"variáveis de ambiente ausentes: {', '.join(self.missing_env(name))}"}
+                continue
+            try:
+                self.get(name)
+                result[name] = {"ok": True, "seconds": self._seconds.get(name)}
+            except ProviderNotConfigured as e:
+                result[name] = {"ok": False, "error": str(e)}
+        return result
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        status = {}
+        for name in self.providers:
+            missing = self.missing_env(name)
+            if name in self._models:
+                state = "ready"
+            elif missing:
+                state = "missing_env"
+            elif name in self._errors:
+                state = "error"
+            else:
+                state = "not_built"
+            status[name] = {"state": state, "missing_env": missing, "build_seconds": self._seconds.get(name), "error": self._errors.get(name)}
+        return status
+
+
+# Instância compartilhada pelo processo
+llm_registry = ProviderRegistry()
+
+# Nomes antigos (`from llms import claude_llm`): criam o LLM na primeira utilização
+_LEGACY_NAMES = {"openai_llm": "openai", "grok_llm": "grok", "claude_llm": "claude", "gemini_llm": "gemini"}
+
+
+def __getattr__(name: str):
+    if name in _LEGACY_NAMES:
+        return llm_registry.get(_LEGACY_NAMES[name])
+    raise AttributeError(f"module 'llms' has no attribute '{name}'")
+
+
+if LLM_PRELOAD_SDKS:
+    print(f"[llms] SDKs importados: {llm_registry.import_sdks()}", flush=True)
+if LLM_EAGER_PROVIDERS:
+    eager = None if LLM_EAGER_PROVIDERS.strip() == "all" else [name.strip() for name in LLM_EAGER_PROVIDERS.split(",")]
+    print(f"[llms] Criação antecipada dos LLMs: {llm_registry.warmup(eager)}", flush=True)
@@ -0,0 +1,195 @@
+# markdown_render.py
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from html import escape, unescape
+from typing import Dict, List, Optional, Tuple
+
+# --- Configurações da conversão para Markdown (ajustáveis por variáveis de ambiente) ---
+
+# Tamanho máximo do cache de blocos já convertidos (caracteres de HTML, por worker)
+MARKDOWN_CACHE_MAX_CHARS = int(os.getenv("MARKDOWN_CACHE_MAX_CHARS", 16_000_000))
+# Quantidade máxima de saídas convertidas por pedido em /convert-batch
+MARKDOWN_BATCH_MAX_ITEMS = int(os.getenv("MARKDOWN_BATCH_MAX_ITEMS", 8))
+
+# Abertura/fechamento de bloco de código cercado (``` ou ~~~)
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# Início de item de lista (-, *, + ou 1. / 1))
+_LIST_ITEM = re.compile(r"^ {0,3}(?:[-*+]|\d{1,9}[.)])(?:[ \t]|$)")
+# Construções que valem para o documento inteiro (definições de links por
+# referência) ou que atravessam linhas em branco (HTML bruto de várias
+# linhas): com elas o texto é convertido de uma vez, como um único bloco
+_UNSPLITTABLE = re.compile(r"^ {0,3}(?:\[[^\]]+\]:|<(?:script|pre|style|textarea|!--))", re.MULTILINE | re.IGNORECASE)
+# Trechos de texto entre tags, para a verificação de HTML vazio
+_TEXT_SEGMENT = re.compile(r"(?:^|>)([^<]+)")
+
+_markdown_renderers = None
+
+
+def markdown_renderers():
+    """Conversores de Markdown, importados na primeira conversão."""
+    global _markdown_renderers
+    if _markdown_renderers is None:
+        from markdown_it import MarkdownIt
+        from markdown2 import markdown as markdown2_render
+        _markdown_renderers = (MarkdownIt(), markdown2_render)
+    return _markdown_renderers
+
+
+def is_html_empty(html: str) -> bool:
+    """
+    Verifica se uma string HTML não contém texto visível, lidando com
+    entidades HTML e espaços de qualquer tipo. Para no primeiro trecho com
+    texto, em vez de remover as tags e decodificar o HTML inteiro.
+    """
+    if not html:
+        return True
+    for match in _TEXT_SEGMENT.finditer(html):
+        segment = match.group(1)
+        if "&" in segment:
+            # Decodifica só este trecho (ex: &nbsp; vira espaço)
+            segment = unescape(segment)
+        if segment.strip():
+            return False
+    return True
+
+
+def split_blocks(text: str) -> List[str]:
+    """
+    Divide o texto em blocos de primeiro nível, separados por linhas em
+    branco, que podem ser convertidos de forma independente: blocos de código
+    cercados ficam inteiros (mesmo com linhas em branco dentro) e os itens de
+    uma mesma lista, ou linhas recuadas que continuam o bloco anterior, ficam
+    no mesmo bloco. Juntar demais só reduz o reaproveitamento; separar demais
+    mudaria o HTML, por isso na dúvida os blocos são unidos.
+    """
+    if _UNSPLITTABLE.search(text):
+        return [text] if text.strip() else []
+    blocks: List[List[str]] = []
+    current: List[str] = []
+    blank: List[str] = []
+    fence: Optional[Tuple[str, int]] = None
+    for line in text.splitlines(keepends=True):
+        if fence is not None:
+            current.append(line)
+            match = _FENCE.match(line)
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= fence[1] and not line[match.end():].strip():
+                fence = None
+            continue
+        if not line.strip():
+            if current:
+                blocks.append(current)
+                current = []
+            blank.append(line)
+            continue
+        if not current and blocks and _continues(blocks[-1], line):
+            # Continuação do bloco anterior (lista frouxa, conteúdo recuado)
+            current = blocks.pop() + blank
+        blank = []
+        match = _FENCE.match(line)
+        if match:
+            fence = (match.group(1)[0], len(match.group(1)))
+        current.append(line)
+    if current:
+        blocks.append(current)
+    return ["".join(block) for block in blocks]
+
+
+def _continues(previous: List[str], line: str) -> bool:
+    if line.startswith(("    ", "\t")):
+        return True
+    # Em uma lista, uma linha recuada (mesmo menos de 4 espaços) pode continuar o item
+    return bool(_LIST_ITEM.match(previous[0]) and (line[0] in " \t" or _LIST_ITEM.match(line)))
+
+
+class MarkdownRenderer:
+    """
+    Conversão de Markdown para HTML bloco a bloco, com cache por hash do
+    conteúdo de cada bloco (LRU, por worker). Converter de novo o mesmo texto,
+    ou um texto que só cresceu no fim (saída em streaming), converte apenas os
+    blocos novos ou alterados. Para cada bloco guarda-se também se ele tem
+    texto visível, de modo que a verificação de HTML vazio não percorre o
+    documento inteiro. A cascata continua a mesma: MarkdownIt, depois
+    markdown2 e, por fim, o texto puro em <pre>.
+    """
+
+    def __init__(self, max_chars: int = MARKDOWN_CACHE_MAX_CHARS):
+        self.max_chars = max_chars
+        self._blocks: "OrderedDict[bytes, Tuple[str, bool]]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.stats = {"documents": 0, "blocks_rendered": 0, "blocks_cached": 0, "fallbacks": 0, "evictions": 0}
+
+    def _cached(self, key: bytes) -> Optional[Tuple[str, bool]]:
+        with self._lock:
+            entry = self._blocks.get(key)
+            if entry is not None:
+                self._blocks.move_to_end(key)
+            return entry
+
+    def _store(self, key: bytes, entry: Tuple[str, bool]) -> None:
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = entry
+            self._chars += len(entry[0])
+            while self._chars > self.max_chars and self._blocks:
+                _, (html, _) = self._blocks.popitem(last=False)
+                self._chars -= len(html)
+                self.stats["evictions"] += 1
+
+    def _render_blocks(self, text: str) -> Tuple[str, bool]:
+        """HTML do MarkdownIt, montado a partir dos blocos, e se há texto visível."""
+        md, _ = markdown_renderers()
+        parts = []
+        visible = False
+        for block in split_blocks(text):
+            key = hashlib.sha1(block.encode("utf-8", "surrogatepass")).digest()
+            entry = self._cached(key)
+            if entry is None:
+                html = md.render(block)
+                entry = (html, not is_html_empty(html))
+                self._store(key, entry)
+                self.stats["blocks_rendered"] += 1
+            else:
+                self.stats["blocks_cached"] += 1
+            parts.append(entry[0])
+            visible = visible or entry[1]
+        return "".join(parts), visible
+
+    def render(self, text: str) -> str:
+        self.stats["documents"] += 1
+        if not text or not text.strip():
+            return f"<pre>{escape(text or '')}</pre>"
+        try:
+            html, visible = self._render_blocks(text)
+            if visible:
+                return html
+        except Exception as e:
+            print(f"[markdown_render] MarkdownIt falhou: {e}", flush=True)
+
+        self.stats["fallbacks"] += 1
+        _, markdown2_render = markdown_renderers()
+        try:
+            html = markdown2_render(text, extras=["fenced-code-blocks", "tables"])
+            if not is_html_empty(html):
+                return html
+        except Exception as e:
+            print(f"[markdown_render] markdown2 falhou: {e}", flush=True)
+
+        return f"<pre>{escape(text)}</pre>"
+
+    def render_many(self, texts: Dict[str, str]) -> Dict[str, str]:
+        """Converte várias saídas de uma vez; blocos repetidos entre elas são convertidos uma só vez."""
+        return {output_id: self.render(text) for output_id, text in texts.items()}
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "cached_blocks": len(self._blocks), "cached_chars": self._chars, "max_chars": self.max_chars}
+
+
+# Instância compartilhada pelo processo
+markdown_renderer = MarkdownRenderer()
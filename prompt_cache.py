@@ -0,0 +1,122 @@
+# prompt_cache.py
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langchain_core.prompt_values import ChatPromptValue, StringPromptValue
+from langchain_core.runnables import RunnableLambda
+
+# Marca, nos prompts de config.py, o fim do prefixo estável (papel, documentos,
+# textos de entrada). Tudo o que vem antes dela é igual entre chamadas
+# repetidas ou entre as seções de um mesmo texto e pode ser reaproveitado pelo
+# cache de prompt dos provedores; o que vem depois (tamanho pedido, seção atual)
+# muda a cada chamada.
+CACHE_BREAK = "CACHE_BREAK_PLACEHOLDER"
+
+
+def split_prompt(text: str) -> Tuple[str, str]:
+    """Separa o prompt renderizado em (prefixo estável, restante)."""
+    prefix, found, suffix = text.partition(CACHE_BREAK)
+    if not found:
+        return "", text
+    return prefix.rstrip() + "\n", suffix.lstrip("\n")
+
+
+def _anthropic_messages(prompt_value) -> ChatPromptValue:
+    """
+    Prompt em dois blocos de conteúdo, com `cache_control` no prefixo: a
+    Anthropic guarda o prefixo por alguns minutos e cobra as leituras seguintes
+    com desconto.
+    """
+    prefix, suffix = split_prompt(prompt_value.to_string())
+    blocks = []
+    if prefix.strip():
+        blocks.append({"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}})
+    if suffix.strip():
+        blocks.append({"type": "text", "text": suffix})
+    return ChatPromptValue(messages=[HumanMessage(content=blocks)])
+
+
+def _plain_prompt(prompt_value) -> StringPromptValue:
+    # OpenAI, Gemini e Grok reaproveitam prefixos repetidos automaticamente;
+    # basta remover a marca e manter a ordem do prompt
+    prefix, suffix = split_prompt(prompt_value.to_string())
+    return StringPromptValue(text=prefix + suffix)
+
+
+def _model_class(llm) -> str:
+    while hasattr(llm, "bound") and hasattr(llm, "kwargs"):
+        llm = llm.bound
+    return type(llm).__name__
+
+
+def prefix_cached(llm):
+    """
+    Passo a colocar entre o prompt e o modelo (`prompt | prefix_cached(llm) | parser`):
+    converte a marca CACHE_BREAK no mecanismo de cache de prompt do provedor.
+    """
+    if _model_class(llm) == "ChatAnthropic":
+        return RunnableLambda(_anthropic_messages) | llm
+    return RunnableLambda(_plain_prompt) | llm
+
+
+class PromptCacheUsage(BaseCallbackHandler):
+    """
+    Registra, a cada chamada de um provedor, os tokens de entrada lidos do
+    cache, gravados no cache e sem cache (conforme o `usage_metadata` que o
+    provedor devolve), e acumula os totais para a rota /status.
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self.totals = {"calls": 0, "input_tokens": 0, "cache_read": 0, "cache_creation": 0, "uncached": 0, "output_tokens": 0}
+
+    @staticmethod
+    def _usage(response) -> Optional[Dict[str, Any]]:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    return usage
+        return None
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        usage = self._usage(response)
+        if not usage:
+            print(f"[prompt_cache] {self.provider}: uso de tokens não informado pelo provedor", flush=True)
+            return
+        details = usage.get("input_token_details") or {}
+        input_tokens = usage.get("input_tokens") or 0
+        cache_read = details.get("cache_read") or 0
+        cache_creation = details.get("cache_creation") or 0
+        uncached = max(0, input_tokens - cache_read - cache_creation)
+        output_tokens = usage.get("output_tokens") or 0
+        with self._lock:
+            self.totals["calls"] += 1
+            self.totals["input_tokens"] += input_tokens
+            self.totals["cache_read"] += cache_read
+            self.totals["cache_creation"] += cache_creation
+            self.totals["uncached"] += uncached
+            self.totals["output_tokens"] += output_tokens
+        print(
+            f"[prompt_cache] {self.provider}: entrada={input_tokens} tokens "
+            f"(cache lido={cache_read}, gravado={cache_creation}, sem cache={uncached}), saída={output_tokens}",
+            flush=True,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self.totals)
+        totals["cache_read_ratio"] = round(totals["cache_read"] / totals["input_tokens"], 3) if totals["input_tokens"] else 0.0
+        return totals
+
+
+# Um medidor por provedor, ligado aos modelos em llms.py
+usage_by_provider = {name: PromptCacheUsage(name) for name in ("claude", "gemini", "grok")}
+
+
+def usage_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: usage.stats() for name, usage in usage_by_provider.items()}
@@ -0,0 +1,283 @@
+# provider_health.py
+
+import os
+import time
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import httpx
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableSerializable
+from pydantic import ConfigDict
+
+# --- Configurações dos disjuntores (ajustáveis por variáveis de ambiente) ---
+
+# Peso da chamada mais recente nas médias móveis exponenciais (EWMA)
+BREAKER_EWMA_ALPHA = float(os.getenv("BREAKER_EWMA_ALPHA", 0.2))
+# O circuito abre quando a taxa de erro (EWMA) passa deste valor...
+BREAKER_ERROR_THRESHOLD = float(os.getenv("BREAKER_ERROR_THRESHOLD", 0.5))
+# ...depois de pelo menos este número de chamadas, ou após N falhas seguidas
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+BREAKER_CONSECUTIVE_FAILURES = int(os.getenv("BREAKER_CONSECUTIVE_FAILURES", 3))
+# Tempo com o circuito aberto antes de deixar passar uma chamada de teste (segundos);
+# dobra a cada teste que falha, até o máximo
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 60))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", 900))
+# Chamadas de teste simultâneas no estado meio-aberto
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 1))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Respostas HTTP que indicam problema do provedor (e não do pedido)
+PROVIDER_FAILURE_STATUSES = {408, 429}
+
+
+class ProviderUnavailable(Exception):
+    """O circuito do provedor está aberto: a chamada falha na hora, sem ir à rede."""
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """Status HTTP de um erro dos SDKs (anthropic/openai: status_code; httpx: response; google: code)."""
+    for value in (
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+        getattr(error, "code", None),
+    ):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """
+    Se o erro indica que o provedor está com problema: prazo excedido, falha
+    de conexão, 429 ou 5xx. Erros do pedido (demais 4xx, como contexto longo
+    demais, validação dos parâmetros) não dizem nada sobre a saúde do
+    provedor. Percorre a cadeia de causas, porque os SDKs e o cliente da Grok
+    embrulham o erro original.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+            return True
+        status = _status_code(error)
+        if status is not None:
+            return status in PROVIDER_FAILURE_STATUSES or status >= 500
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class _ProviderState:
+    def __init__(self):
+        self.state = CLOSED
+        self.error_ewma = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.rejected = 0
+        self.opened_at = 0.0
+        self.open_seconds = BREAKER_OPEN_SECONDS
+        self.probes = 0
+        self.last_error: Optional[str] = None
+
+
+class HealthTracker:
+    """
+    Saúde de cada provedor (taxa de erro e latência em EWMA) com um disjuntor
+    de três estados: fechado (normal), aberto (falha na hora) e meio-aberto
+    (deixa passar uma chamada de teste; se ela der certo o circuito fecha).
+    O estado é de cada processo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, _ProviderState] = {}
+
+    def _get(self, provider: str) -> _ProviderState:
+        return self._states.setdefault(provider, _ProviderState())
+
+    def _retry_in(self, state: _ProviderState) -> float:
+        return max(0.0, state.opened_at + state.open_seconds - time.time())
+
+    def available(self, provider: str) -> bool:
+        """Se uma chamada agora seria aceita (sem reservar a chamada de teste)."""
+        with self._lock:
+            state = self._get(provider)
+            if state.state == CLOSED:
+                return True
+            if state.state == OPEN:
+                return self._retry_in(state) == 0
+            return state.probes < BREAKER_HALF_OPEN_PROBES
+
+    def describe(self, provider: str) -> str:
+        with self._lock:
+            state = self._get(provider)
+            retry_in = self._retry_in(state)
+            error = f" Último erro: {state.last_error}" if state.last_error else ""
+        return f"{provider} está indisponível (circuito aberto, nova tentativa em {retry_in:.0f}s).{error}"
+
+    def before_call(self, provider: str) -> None:
+        """Reserva a chamada ou levanta ProviderUnavailable se o circuito estiver aberto."""
+        with self._lock:
+            state = self._get(provider)
+            if state.state == OPEN and self._retry_in(state) == 0:
+                state.state = HALF_OPEN
+                state.probes = 0
+                print(f"[provider_health] {provider}: circuito meio-aberto, enviando chamada de teste", flush=True)
+            if state.state == CLOSED:
+                return
+            if state.state == HALF_OPEN and state.probes < BREAKER_HALF_OPEN_PROBES:
+                state.probes += 1
+                return
+            state.rejected += 1
+        raise ProviderUnavailable(self.describe(provider))
+
+    def _update(self, state: _ProviderState, failed: bool, seconds: Optional[float]) -> None:
+        state.calls += 1
+        state.error_ewma = BREAKER_EWMA_ALPHA * (1.0 if failed else 0.0) + (1 - BREAKER_EWMA_ALPHA) * state.error_ewma
+        if seconds is not None:
+            state.latency_ewma = seconds if state.latency_ewma is None else (
+                BREAKER_EWMA_ALPHA * seconds + (1 - BREAKER_EWMA_ALPHA) * state.latency_ewma
+            )
+
+    def record_success(self, provider: str, seconds: float) -> None:
+        with self._lock:
+            state = self._get(provider)
+            self._update(state, False, seconds)
+            state.consecutive_failures = 0
+            if state.state != CLOSED:
+                print(f"[provider_health] {provider}: chamada de teste bem sucedida, circuito fechado", flush=True)
+                state.state = CLOSED
+                state.error_ewma = 0.0
+                state.open_seconds = BREAKER_OPEN_SECONDS
+                state.probes = 0
+
+    def record_failure(self, provider: str, error: BaseException) -> None:
+        with self._lock:
+            state = self._get(provider)
+            self._update(state, True, None)
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = f"{type(error).__name__}: {error}"[:300]
+            if state.state == HALF_OPEN:
+                # Teste falhou: volta a abrir, por mais tempo
+                state.open_seconds = min(BREAKER_MAX_OPEN_SECONDS, state.open_seconds * 2)
+                self._open(provider, state)
+            elif state.state == CLOSED and (
+                state.consecutive_failures >= BREAKER_CONSECUTIVE_FAILURES
+                or (state.calls >= BREAKER_MIN_CALLS and state.error_ewma >= BREAKER_ERROR_THRESHOLD)
+            ):
+                self._open(provider, state)
+
+    def record_cancelled(self, provider: str) -> None:
+        """Chamada cancelada ou recusada por erro do pedido: não conta como sucesso nem falha, mas libera a vaga de teste."""
+        with self._lock:
+            state = self._get(provider)
+            if state.state == HALF_OPEN and state.probes > 0:
+                state.probes -= 1
+
+    def _open(self, provider: str, state: _ProviderState) -> None:
+        state.state = OPEN
+        state.opened_at = time.time()
+        state.probes = 0
+        print(
+            f"[provider_health] {provider}: circuito aberto por {state.open_seconds:.0f}s "
+            f"(erro EWMA {state.error_ewma:.2f}, {state.consecutive_failures} falhas seguidas)",
+            flush=True,
+        )
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                provider: {
+                    "state": state.state,
+                    "error_rate_ewma": round(state.error_ewma, 3),
+                    "latency_ewma_seconds": round(state.latency_ewma, 2) if state.latency_ewma is not None else None,
+                    "calls": state.calls,
+                    "failures": state.failures,
+                    "consecutive_failures": state.consecutive_failures,
+                    "rejected": state.rejected,
+                    "retry_in_seconds": round(self._retry_in(state), 1) if state.state == OPEN else 0,
+                    "last_error": state.last_error,
+                }
+                for provider, state in self._states.items()
+            }
+
+
+# Instância compartilhada pelo processo
+health_tracker = HealthTracker()
+
+
+class HealthGuarded(RunnableSerializable):
+    """
+    Envolve um modelo (ou chain de modelo) com o disjuntor do provedor:
+    com o circuito aberto a chamada falha na hora com ProviderUnavailable;
+    caso contrário o resultado (sucesso, erro, duração) alimenta o
+    HealthTracker. Só contam como falha os erros do provedor (ver
+    is_provider_failure); cancelamentos (usuário ou prazo) e erros do pedido
+    são repassados sem afetar o disjuntor.
+    Expõe `bound`/`kwargs` como um RunnableBinding, para quem precisa
+    identificar o modelo envolvido (cache de respostas e de prompt).
+    """
+
+    bound: Runnable
+    provider: str
+    kwargs: Dict[str, Any] = {}
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _done(self, started: float, error: Optional[BaseException]) -> None:
+        if error is None:
+            health_tracker.record_success(self.provider, time.monotonic() - started)
+        elif isinstance(error, Exception) and is_provider_failure(error):
+            health_tracker.record_failure(self.provider, error)
+        else:
+            health_tracker.record_cancelled(self.provider)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        health_tracker.before_call(self.provider)
+        started = time.monotonic()
+        try:
+            result = self.bound.invoke(input, config, **kwargs)
+        except BaseException as e:
+            self._done(started, e)
+            raise
+        self._done(started, None)
+        return result
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        health_tracker.before_call(self.provider)
+        started = time.monotonic()
+        try:
+            result = await self.bound.ainvoke(input, config, **kwargs)
+        except BaseException as e:
+            self._done(started, e)
+            raise
+        self._done(started, None)
+        return result
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        health_tracker.before_call(self.provider)
+        started = time.monotonic()
+        try:
+            yield from self.bound.stream(input, config, **kwargs)
+        except BaseException as e:
+            self._done(started, e)
+            raise
+        self._done(started, None)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        health_tracker.before_call(self.provider)
+        started = time.monotonic()
+        try:
+            async for piece in self.bound.astream(input, config, **kwargs):
+                yield piece
+        except BaseException as e:
+            self._done(started, e)
+            raise
+        self._done(started, None)
+
+
+def with_health(runnable: Runnable, provider: str) -> HealthGuarded:
+    return HealthGuarded(bound=runnable, provider=provider)
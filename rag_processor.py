@@ -1,47 +1,608 @@
 # rag_processor.py
 
 import os
-from typing import List
+import itertools
+import multiprocessing
+import concurrent.futures
+from collections import deque
+from contextlib import closing
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from document_cache import document_cache, hash_file
+from document_library import get_collection, search_collections
+from embeddings import embedding_service
 
-def get_relevant_context(file_paths: List[str], user_query: str = None) -> str:
+# --- Configurações da recuperação (ajustáveis por variáveis de ambiente) ---
+
+# "retrieval" seleciona apenas os trechos mais relevantes; "full" envia o texto completo
+RAG_MODE = os.getenv("RAG_MODE", "retrieval")
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", 1500))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", 200))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 20))
+# Trechos codificados por lote enquanto o documento é lido página a página
+RAG_EMBED_BATCH_CHUNKS = int(os.getenv("RAG_EMBED_BATCH_CHUNKS", 256))
+# Orçamento máximo de caracteres do contexto enviado aos modelos
+RAG_MAX_CONTEXT_CHARS = int(os.getenv("RAG_MAX_CONTEXT_CHARS", 40000))
+# Orçamento do modo "full": a leitura dos arquivos para quando ele é preenchido
+RAG_FULL_TEXT_MAX_CHARS = int(os.getenv("RAG_FULL_TEXT_MAX_CHARS", 400000))
+# Limite opcional em tokens (0 = desativado), convertido pela média de caracteres por token
+RAG_FULL_TEXT_MAX_TOKENS = int(os.getenv("RAG_FULL_TEXT_MAX_TOKENS", 0))
+CHARS_PER_TOKEN = 4
+# Processos usados na extração (0 = extração sequencial no próprio processo)
+RAG_EXTRACTION_WORKERS = int(os.getenv("RAG_EXTRACTION_WORKERS", min(4, os.cpu_count() or 1)))
+# PDFs maiores que isso são divididos em faixas de páginas extraídas em paralelo
+RAG_PDF_PAGES_PER_TASK = int(os.getenv("RAG_PDF_PAGES_PER_TASK", 40))
+# Tarefas de extração adiantadas em relação à leitura (limita as páginas extraídas à espera do consumidor)
+RAG_EXTRACTION_LOOKAHEAD = int(os.getenv("RAG_EXTRACTION_LOOKAHEAD", 2 * max(1, RAG_EXTRACTION_WORKERS)))
+
+NO_DOCUMENTS_MESSAGE = "Nenhum documento de referência foi fornecido ou os formatos não são suportados."
+CHUNK_SEPARATOR = "\n\n[...]\n\n"
+
+# Pool de processos da extração, criado na primeira utilização
+_extraction_pool = None
+
+# Recebe (arquivos concluídos, total de arquivos, nome do arquivo)
+ProgressCallback = Callable[[int, int, str], None]
+
+
+def _get_loader(file_path: str):
+    """Escolhe o loader adequado pela extensão do arquivo (None se não suportado)."""
+    filename = os.path.basename(file_path).lower()
+    if filename.endswith(".pdf"):
+        return PyPDFLoader(file_path)
+    if filename.endswith(".docx"):
+        return Docx2txtLoader(file_path)
+    if filename.endswith(".txt"):
+        return TextLoader(file_path, encoding='utf-8')
+    return None
+
+
+def split_into_chunks(text: str, chunk_size: int = RAG_CHUNK_SIZE, chunk_overlap: int = RAG_CHUNK_OVERLAP) -> List[str]:
+    """Divide o texto de um documento em trechos sobrepostos, na ordem original."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+    return [chunk for chunk in splitter.split_text(text) if chunk.strip()]
+
+
+def iter_chunks(pages: Iterable[str], chunk_size: int = RAG_CHUNK_SIZE, chunk_overlap: int = RAG_CHUNK_OVERLAP) -> Iterator[str]:
     """
-    Extrai o texto completo de todos os arquivos anexados e retorna como uma única string.
+    Divide em trechos o texto de um documento à medida que as páginas chegam:
+    o texto é acumulado até algumas dezenas de trechos e dividido; o último
+    trecho (que pode ter sido cortado na emenda) volta para o acúmulo e é
+    dividido de novo com as páginas seguintes. A memória fica limitada a essa
+    janela, não ao tamanho do documento.
     """
-    all_contents: List[str] = []
+    window = chunk_size * 32
+    buffer = ""
+    for page in pages:
+        buffer = f"{buffer}\n\n{page}" if buffer else page
+        if len(buffer) >= window:
+            chunks = split_into_chunks(buffer, chunk_size, chunk_overlap)
+            yield from chunks[:-1]
+            buffer = chunks[-1] if chunks else ""
+    if buffer:
+        yield from split_into_chunks(buffer, chunk_size, chunk_overlap)
 
-    for file_path in file_paths:
-        filename = os.path.basename(file_path)
+
+def _encode(texts: List[str]):
+    return embedding_service.encode(texts)
+
+
+def _chunks_and_embeddings(key: str, pages: Iterable[str]):
+    """
+    Devolve os trechos e embeddings de um documento, reaproveitando o cache
+    em disco. Os nomes dos artefatos incluem os parâmetros que os produziram.
+    Sem cache, as páginas são lidas, divididas e codificadas em lotes de
+    RAG_EMBED_BATCH_CHUNKS trechos, sem montar o texto inteiro; com os
+    trechos em cache as páginas nem são lidas.
+    """
+    import numpy as np
+
+    chunk_tag = f"{RAG_CHUNK_SIZE}-{RAG_CHUNK_OVERLAP}"
+    chunks_name = f"chunks-{chunk_tag}.json"
+    embeddings_name = f"embeddings-{embedding_service.model_name.replace('/', '_')}-{chunk_tag}.npy"
+
+    chunks = document_cache.get_json(key, chunks_name)
+    if chunks is not None:
+        embeddings = document_cache.get_array(key, embeddings_name)
+        if embeddings is None or len(embeddings) != len(chunks):
+            embeddings = _encode(chunks)
+            document_cache.put_array(key, embeddings_name, embeddings)
+        return chunks, embeddings
+
+    chunks = []
+    parts = []
+    batches = iter_chunks(pages)
+    while True:
+        batch = list(itertools.islice(batches, max(1, RAG_EMBED_BATCH_CHUNKS)))
+        if not batch:
+            break
+        chunks.extend(batch)
+        parts.append(_encode(batch))
+    embeddings = np.vstack(parts) if parts else _encode(chunks)
+    document_cache.put_json(key, chunks_name, chunks)
+    document_cache.put_array(key, embeddings_name, embeddings)
+    return chunks, embeddings
+
+
+class DocumentReadError(Exception):
+    """Falha ao ler as páginas de um arquivo: o arquivo é ignorado, não a recuperação inteira."""
+
+    def __init__(self, filename: str, reason: str):
+        super().__init__(f"Erro ao carregar '{filename}': {reason}")
+        self.filename = filename
+        self.reason = reason
+
+
+def _read_pages(pages: Iterable[str], filename: str) -> Iterator[str]:
+    try:
+        yield from pages
+    except Exception as e:
+        raise DocumentReadError(filename, str(e)) from e
+
+
+def retrieve_chunks(documents: Iterable[Tuple[str, Iterable[str]]], user_query: str, top_k: int = RAG_TOP_K, max_chars: int = RAG_MAX_CONTEXT_CHARS, collections: Sequence[str] = ()) -> List[str]:
+    """
+    Monta um índice FAISS em memória com os trechos dos documentos enviados
+    (pares chave/páginas, consumidos um a um), consulta também as coleções
+    da biblioteca indicadas e devolve os trechos mais relevantes para a
+    consulta, respeitando o orçamento de caracteres. Os trechos vêm na ordem
+    em que aparecem nos documentos (primeiro os enviados, depois os da
+    biblioteca). Um documento que não pode ser lido é ignorado.
+    """
+    import faiss
+    import numpy as np
+
+    query_embedding = _encode([user_query])
+    # (pontuação, chave de ordenação, texto)
+    candidates: List[Tuple[float, Tuple, str]] = []
+
+    chunks: List[str] = []
+    all_embeddings = []
+    for key, pages in documents:
         try:
-            # Escolhe o loader adequado
-            if filename.lower().endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-            elif filename.lower().endswith(".docx"):
-                loader = Docx2txtLoader(file_path)
-            elif filename.lower().endswith(".txt"):
-                loader = TextLoader(file_path, encoding='utf-8')
-            else:
-                # ignora formatos não suportados
-                continue
+            doc_chunks, doc_embeddings = _chunks_and_embeddings(key, pages)
+        except DocumentReadError as e:
+            print(f"[rag_processor] {e}", flush=True)
+            continue
+        if doc_chunks:
+            chunks.extend(doc_chunks)
+            all_embeddings.append(doc_embeddings)
+    if chunks:
+        embeddings = np.vstack(all_embeddings)
+        # Produto interno com vetores normalizados equivale à similaridade de cosseno
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+        scores, ids = index.search(query_embedding, min(top_k, len(chunks)))
+        candidates.extend(
+            (float(score), (0, "", int(chunk_id)), chunks[chunk_id])
+            for score, chunk_id in zip(scores[0], ids[0]) if chunk_id >= 0
+        )
+
+    library_hits = search_collections(list(collections), query_embedding, top_k)
+    candidates.extend((score, (1,) + order, text) for score, order, text in library_hits)
+
+    selected: List[Tuple[Tuple, str]] = []
+    used_chars = 0
+    for score, order, text in sorted(candidates, key=lambda item: item[0], reverse=True):
+        if len(selected) >= top_k or used_chars + len(text) > max_chars:
+            continue
+        selected.append((order, text))
+        used_chars += len(text)
+
+    selected.sort(key=lambda item: item[0])
+    print(f"[rag_processor] Recuperação: {len(selected)} trechos selecionados de {len(chunks)} enviados "
+          f"e {len(library_hits)} candidatos da biblioteca", flush=True)
+    return [text for _, text in selected]
+
+
+def index_into_library(collection_name: str, file_path: str, filename: str) -> Dict:
+    """Extrai, divide e codifica um arquivo e o adiciona a uma coleção da biblioteca."""
+    collection = get_collection(collection_name)
+    extracted, errors = _extract_documents([file_path])
+    if not extracted:
+        reason = next(iter(errors.values()), None)
+        raise ValueError(f"Não foi possível extrair texto de '{filename}'" + (f": {reason}" if reason else "."))
+    key, pages = extracted[0]
+    chunks, embeddings = _chunks_and_embeddings(key, pages)
+    return collection.add_document(key, filename, chunks, embeddings)
+
+
+def _extract_with_loader(file_path: str) -> List[str]:
+    """Extrai todas as páginas de um arquivo com o loader do LangChain."""
+    return [doc.page_content for doc in _get_loader(file_path).load()]
+
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extrai as páginas [start, end) de um PDF (executada nos processos do pool)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _get_extraction_pool():
+    """
+    Cria o pool de processos na primeira utilização. Usa "spawn" para não
+    herdar threads e conexões do worker do gunicorn.
+    """
+    global _extraction_pool
+    if _extraction_pool is None:
+        _extraction_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=RAG_EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _extraction_pool
+
+
+def _reset_extraction_pool() -> None:
+    """Descarta um pool quebrado (ex.: processo filho morto) para recriá-lo depois."""
+    global _extraction_pool
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+
+
+def _extraction_tasks(file_path: str) -> List[Tuple[Callable, tuple]]:
+    """Divide a extração de um arquivo em tarefas, em ordem de página."""
+    if not file_path.lower().endswith(".pdf"):
+        return [(_extract_with_loader, (file_path,))]
+
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(file_path).pages)
+    step = max(1, RAG_PDF_PAGES_PER_TASK)
+    return [
+        (_extract_pdf_range, (file_path, start, min(start + step, page_count)))
+        for start in range(0, page_count, step)
+    ]
+
+
+def _extract_documents(file_paths: List[str], progress_callback: Optional[ProgressCallback] = None) -> Tuple[List[Tuple[str, List[str]]], Dict[str, str]]:
+    """
+    Extrai as páginas de todos os arquivos (ver _iter_documents) e devolve
+    pares (chave, páginas) na ordem original, mais o erro de cada arquivo
+    que não pôde ser extraído (por nome).
+    """
+    results: List[Tuple[str, List[str]]] = []
+    errors: Dict[str, str] = {}
+    for key, pages in _iter_documents(file_paths, progress_callback, errors):
+        try:
+            results.append((key, list(pages)))
+        except DocumentReadError as e:
+            print(f"[rag_processor] {e}", flush=True)
+            errors[e.filename] = e.reason
+    return results, errors
+
+
+class _FilePlan:
+    """Como ler um arquivo: do cache (tasks None) ou pelas tarefas de extração, com os futures já submetidos."""
+
+    def __init__(self, key: Optional[str] = None, tasks: Optional[List[Tuple[Callable, tuple]]] = None, error: Optional[str] = None):
+        self.key = key
+        self.tasks = tasks
+        self.error = error
+        self.futures: List[Optional[concurrent.futures.Future]] = [None] * len(tasks or ())
 
-            # Carrega todos os documentos e concatena o conteúdo
-            docs = loader.load()
-            for doc in docs:
-                all_contents.append(doc.page_content)
 
+class _PooledExtraction:
+    """
+    Extração de uma lista de arquivos no pool de processos. As tarefas (por
+    arquivo e por faixa de páginas) são submetidas na ordem dos arquivos,
+    com no máximo RAG_EXTRACTION_LOOKAHEAD em andamento, e os resultados são
+    entregues na mesma ordem; assim o primeiro documento já pode ser lido
+    enquanto os seguintes são extraídos, sem acumular páginas de todos eles.
+    Sem pool (RAG_EXTRACTION_WORKERS = 0 ou pool quebrado) as tarefas rodam
+    neste processo, quando chega a vez delas.
+    """
+
+    def __init__(self, file_paths: List[str]):
+        self.file_paths = file_paths
+        self.plans: List[Optional[_FilePlan]] = []
+        # (arquivo, faixa) ainda não submetidos, na ordem de leitura
+        self.queue: Deque[Tuple[int, int]] = deque()
+        self.outstanding = 0
+        self.use_pool = RAG_EXTRACTION_WORKERS > 0
+
+    def _plan_file(self, file_path: str) -> Optional[_FilePlan]:
+        if _get_loader(file_path) is None:
+            # ignora formatos não suportados
+            return None
+        try:
+            key = hash_file(file_path)
+            if document_cache.has_pages(key):
+                return _FilePlan(key)
+            return _FilePlan(key, _extraction_tasks(file_path))
         except Exception as e:
-            # Log simples de erro de leitura, para você ver no console
-            print(f"[rag_processor] Erro ao carregar '{filename}': {e}", flush=True)
+            return _FilePlan(error=str(e))
+
+    def plan(self, index: int) -> Optional[_FilePlan]:
+        """Planeja os arquivos até `index` (os anteriores já podem ter sido planejados pela antecipação)."""
+        while len(self.plans) <= index:
+            position = len(self.plans)
+            plan = self._plan_file(self.file_paths[position])
+            self.plans.append(plan)
+            if plan is not None and plan.tasks and self.use_pool:
+                self.queue.extend((position, part) for part in range(len(plan.tasks)))
+        return self.plans[index]
+
+    def _fill(self) -> None:
+        """Submete tarefas da fila até o limite da antecipação, planejando os arquivos seguintes se preciso."""
+        while self.use_pool and self.outstanding < max(1, RAG_EXTRACTION_LOOKAHEAD):
+            if not self.queue:
+                if len(self.plans) >= len(self.file_paths):
+                    return
+                self.plan(len(self.plans))
+                continue
+            index, part = self.queue[0]
+            plan = self.plans[index]
+            func, args = plan.tasks[part]
+            try:
+                plan.futures[part] = _get_extraction_pool().submit(func, *args)
+            except concurrent.futures.process.BrokenProcessPool as e:
+                self._broken(e)
+                return
+            self.queue.popleft()
+            self.outstanding += 1
+
+    def _broken(self, error: Exception) -> None:
+        if self.use_pool:
+            print(f"[rag_processor] Pool de extração quebrou; o restante é extraído neste processo: {error}", flush=True)
+            _reset_extraction_pool()
+        self.use_pool = False
+        self.queue.clear()
+
+    def _parts(self, index: int) -> Iterator[str]:
+        plan = self.plans[index]
+        for part, (func, args) in enumerate(plan.tasks):
+            self._fill()
+            future = plan.futures[part]
+            pages = None
+            if future is not None:
+                plan.futures[part] = None
+                self.outstanding -= 1
+                try:
+                    pages = future.result()
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    self._broken(e)
+            if pages is None:
+                pages = func(*args)
+            yield from pages
+
+    def pages(self, index: int) -> Iterator[str]:
+        """Páginas do arquivo `index`, do cache ou das tarefas de extração (gravadas no cache à medida que são lidas)."""
+        plan = self.plans[index]
+        file_path = self.file_paths[index]
+        self._fill()
+        if plan.tasks is None:
+            cached = document_cache.open_pages(plan.key, os.path.getsize(file_path))
+            if cached is not None:
+                yield from cached
+                return
+            # removido do cache depois do planejamento: extrai aqui mesmo
+            plan.tasks = _extraction_tasks(file_path)
+            plan.futures = [None] * len(plan.tasks)
+        yield from document_cache.stream_pages_into_cache(plan.key, self._parts(index))
+
+    def discard(self, index: int) -> None:
+        """Cancela as tarefas que sobraram do arquivo (leitura interrompida ou com erro)."""
+        plan = self.plans[index]
+        if plan is None or not plan.tasks:
+            return
+        for part, future in enumerate(plan.futures):
+            if future is not None:
+                future.cancel()
+                plan.futures[part] = None
+                self.outstanding -= 1
+        if any(queued == index for queued, _ in self.queue):
+            self.queue = deque(item for item in self.queue if item[0] != index)
+
+    def close(self) -> None:
+        for index in range(len(self.plans)):
+            self.discard(index)
+        self.queue.clear()
+
+
+def full_text_budget() -> int:
+    """Orçamento efetivo de caracteres do modo "full"."""
+    budget = RAG_FULL_TEXT_MAX_CHARS
+    if RAG_FULL_TEXT_MAX_TOKENS > 0:
+        budget = min(budget, RAG_FULL_TEXT_MAX_TOKENS * CHARS_PER_TOKEN)
+    return budget
+
+
+def stream_full_text(file_paths: List[str], budget: int, progress_callback: Optional[ProgressCallback] = None) -> str:
+    """
+    Concatena o texto dos arquivos lendo página a página e para de ler assim
+    que o orçamento de caracteres é preenchido, de modo que a memória usada
+    fica limitada ao orçamento e não ao tamanho dos documentos.
+    """
+    parts: List[str] = []
+    used = 0
+    total = len(file_paths)
+    reported = 0
+
+    def report(done: int, total: int, filename: str) -> None:
+        nonlocal reported
+        reported = done
+        if progress_callback:
+            progress_callback(done, total, filename)
 
-    # Remove os arquivos temporários após a extração
+    errors: Dict[str, str] = {}
+    documents = _iter_documents(file_paths, report, errors)
+    try:
+        for _, pages in documents:
+            if used >= budget:
+                break
+            try:
+                for page in pages:
+                    remaining = budget - used
+                    if len(page) >= remaining:
+                        parts.append(page[:remaining])
+                        used = budget
+                        print(f"[rag_processor] Orçamento de {budget} caracteres atingido, leitura interrompida", flush=True)
+                        break
+                    parts.append(page)
+                    used += len(page)
+            except DocumentReadError as e:
+                print(f"[rag_processor] {e}", flush=True)
+    finally:
+        documents.close()
+
+    # Arquivos que não chegaram a ser lidos (orçamento preenchido) também contam como concluídos
+    for index in range(reported, total):
+        report(index + 1, total, os.path.basename(file_paths[index]))
+    return "\n\n".join(parts)
+
+
+def _iter_documents(file_paths: List[str], progress_callback: Optional[ProgressCallback] = None, errors: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, Iterator[str]]]:
+    """
+    Produz (chave, páginas) de cada arquivo suportado, na ordem original.
+    Documentos já vistos são lidos do cache; os demais são extraídos no pool
+    de processos (ver _PooledExtraction) enquanto os anteriores são lidos.
+    Uma falha de extração chega ao consumidor como DocumentReadError ao
+    percorrer as páginas; arquivos que nem puderam ser abertos vão para
+    `errors` (nome -> mensagem). O progresso é informado quando o consumidor
+    passa para o arquivo seguinte; fechar o gerador cancela as tarefas
+    adiantadas.
+    """
+    extraction = _PooledExtraction(file_paths)
+    total = len(file_paths)
+    try:
+        for index, file_path in enumerate(file_paths):
+            filename = os.path.basename(file_path)
+            plan = extraction.plan(index)
+            if plan is not None and plan.error is not None:
+                print(f"[rag_processor] Erro ao carregar '{filename}': {plan.error}", flush=True)
+                if errors is not None:
+                    errors[filename] = plan.error
+            elif plan is not None:
+                try:
+                    with closing(extraction.pages(index)) as pages:
+                        yield plan.key, _read_pages(pages, filename)
+                finally:
+                    extraction.discard(index)
+            if progress_callback:
+                progress_callback(index + 1, total, filename)
+    finally:
+        extraction.close()
+
+
+def slice_context(context: str, query: str, max_chars: int) -> str:
+    """
+    Recorta de um contexto já montado os trechos mais relevantes para
+    `query` (ex.: o título e o resumo de uma seção), dentro de `max_chars` e
+    na ordem original. Os embeddings dos trechos saem do cache do serviço,
+    então recortar o mesmo contexto para várias consultas é barato.
+    """
+    if len(context) <= max_chars:
+        return context
+    import numpy as np
+
+    chunks = context.split(CHUNK_SEPARATOR)
+    if len(chunks) == 1:
+        chunks = split_into_chunks(context)
+    try:
+        scores = _encode(chunks) @ _encode([query])[0]
+        ranking = np.argsort(-scores)
+    except Exception as e:
+        print(f"[rag_processor] Falha ao recortar o contexto, usando o início: {e}", flush=True)
+        ranking = range(len(chunks))
+
+    selected: List[int] = []
+    used = 0
+    for position in ranking:
+        if used + len(chunks[position]) <= max_chars:
+            selected.append(int(position))
+            used += len(chunks[position])
+    return CHUNK_SEPARATOR.join(chunks[position] for position in sorted(selected))
+
+
+def _remove_files(file_paths: List[str]) -> None:
+    """Remove os arquivos temporários após a extração."""
     for file_path in file_paths:
         try:
             os.remove(file_path)
         except OSError as e:
             print(f"[rag_processor] Erro ao deletar '{file_path}': {e}", flush=True)
 
-    if not all_contents:
-        return "Nenhum documento de referência foi fornecido ou os formatos não são suportados."
 
-    # Retorna todo o texto concatenado, separado por duas quebras de linha
-    return "\n\n".join(all_contents)
+def get_relevant_context(file_paths: List[str], user_query: str = None, mode: Optional[str] = None, progress_callback: Optional[ProgressCallback] = None, collections: Sequence[str] = ()) -> str:
+    """
+    Extrai o texto dos arquivos anexados e retorna o contexto para os prompts.
+
+    No modo "retrieval" (padrão), o texto é dividido em trechos sobrepostos e
+    apenas os mais relevantes para `user_query` são devolvidos, dentro de
+    RAG_MAX_CONTEXT_CHARS. No modo "full", ou se a recuperação falhar,
+    devolve o texto completo concatenado, limitado a `full_text_budget()`;
+    no modo "full" a leitura é feita página a página e para assim que esse
+    orçamento é preenchido.
+
+    `collections` lista coleções da biblioteca persistente que também são
+    consultadas no modo "retrieval".
+
+    `progress_callback`, se fornecido, é chamado a cada arquivo extraído.
+    """
+    mode = mode or RAG_MODE
+    if mode != "retrieval" or not user_query:
+        try:
+            full_text = stream_full_text(file_paths, full_text_budget(), progress_callback)
+        finally:
+            _remove_files(file_paths)
+        return full_text or NO_DOCUMENTS_MESSAGE
+
+    try:
+        return _retrieve_context(file_paths, user_query, progress_callback, collections)
+    finally:
+        _remove_files(file_paths)
+
+
+def _retrieve_context(file_paths: List[str], user_query: str, progress_callback: Optional[ProgressCallback], collections: Sequence[str]) -> str:
+    """
+    Modo "retrieval" de `get_relevant_context`. Os documentos são lidos
+    página a página; enquanto o texto lido couber em RAG_MAX_CONTEXT_CHARS
+    as páginas ficam guardadas (e, se tudo couber, são devolvidas sem
+    recuperação). Ao passar do limite, os documentos seguem, ainda página a
+    página, para a divisão em trechos e a codificação.
+    """
+    documents = _iter_documents(file_paths, progress_callback)
+    # Documentos lidos por inteiro enquanto o texto ainda cabe no orçamento
+    read: List[Tuple[str, List[str]]] = []
+    remaining = None if collections else RAG_MAX_CONTEXT_CHARS
+    try:
+        if remaining is not None:
+            for key, pages in documents:
+                doc_pages: List[str] = []
+                try:
+                    for page in pages:
+                        doc_pages.append(page)
+                        remaining -= len(page) + 2
+                        if remaining < -2:
+                            break
+                except DocumentReadError as e:
+                    print(f"[rag_processor] {e}", flush=True)
+                    continue
+                if remaining < -2:
+                    # Passou do orçamento: este documento continua de onde parou
+                    read.append((key, itertools.chain(doc_pages, pages)))
+                    break
+                read.append((key, doc_pages))
+            else:
+                if not read:
+                    return NO_DOCUMENTS_MESSAGE
+                # Textos que já cabem no orçamento não precisam de recuperação
+                return "\n\n".join("\n\n".join(pages) for _, pages in read)
+
+        selected = retrieve_chunks(itertools.chain(read, documents), user_query, collections=collections)
+        if selected:
+            return CHUNK_SEPARATOR.join(selected)
+        print("[rag_processor] Nenhum trecho recuperado, usando texto completo", flush=True)
+    except Exception as e:
+        print(f"[rag_processor] Falha na recuperação vetorial, usando texto completo: {e}", flush=True)
+    finally:
+        documents.close()
+    return stream_full_text(file_paths, full_text_budget()) or NO_DOCUMENTS_MESSAGE
@@ -0,0 +1,239 @@
+# rate_limit.py
+
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+# --- Configurações das cotas por provedor (ajustáveis por variáveis de ambiente) ---
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# Banco compartilhado pelos workers do host: a cota vale para todos os processos
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", os.path.join(os.getenv("HF_HOME", ".cache"), "rate_limit.sqlite"))
+# Chamadas por minuto e chamadas simultâneas, por provedor e modelo. Os
+# valores padrão podem ser trocados por provedor ou por "provedor:modelo",
+# ex. RATE_LIMIT_RPM="claude=50,gemini:gemini-2.5-pro=30"
+RATE_LIMIT_DEFAULT_RPM = float(os.getenv("RATE_LIMIT_DEFAULT_RPM", 60))
+RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT = int(os.getenv("RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT", 8))
+RATE_LIMIT_RPM = {
+    name: float(value) for name, value in (
+        pair.split("=", 1) for pair in os.getenv("RATE_LIMIT_RPM", "").replace(" ", "").split(",") if "=" in pair
+    )
+}
+RATE_LIMIT_MAX_IN_FLIGHT = {
+    name: int(value) for name, value in (
+        pair.split("=", 1) for pair in os.getenv("RATE_LIMIT_MAX_IN_FLIGHT", "").replace(" ", "").split(",") if "=" in pair
+    )
+}
+# Rajada permitida: o balde acumula no máximo este tempo de cota (segundos)
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", 10))
+# Intervalo entre as tentativas de quem está na fila (segundos)
+RATE_LIMIT_POLL_INTERVAL = float(os.getenv("RATE_LIMIT_POLL_INTERVAL", 0.25))
+# Espera máxima na fila antes de desistir da chamada (segundos)
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 600))
+# Vaga de chamada esquecida (processo que morreu sem liberá-la) expira após este tempo
+RATE_LIMIT_LEASE_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_SECONDS", 1800))
+
+# Atributos que identificam o modelo dentro de uma chain
+_MODEL_ATTRIBUTES = ("model_name", "model", "assistant_id")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    acquired_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waiters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    seen_at REAL NOT NULL
+);
+"""
+
+
+class RateLimitWaitTimeout(TimeoutError):
+    """A chamada esperou mais que RATE_LIMIT_MAX_WAIT pela cota do provedor."""
+
+
+def _model_of(step) -> Optional[str]:
+    while hasattr(step, "bound") and hasattr(step, "kwargs"):
+        step = step.bound
+    for attribute in _MODEL_ATTRIBUTES:
+        value = getattr(step, attribute, None)
+        if isinstance(value, str) and value:
+            return value
+    for inner in getattr(step, "steps", ()):
+        model = _model_of(inner)
+        if model:
+            return model
+    return None
+
+
+def quota_key(provider: str, chain) -> str:
+    """Chave da cota de uma chamada: "provedor:modelo" (o modelo é lido da chain)."""
+    return f"{provider}:{_model_of(chain) or 'default'}"
+
+
+def _limits(key: str) -> Tuple[float, int]:
+    provider = key.split(":", 1)[0]
+    rpm = RATE_LIMIT_RPM.get(key, RATE_LIMIT_RPM.get(provider, RATE_LIMIT_DEFAULT_RPM))
+    max_in_flight = RATE_LIMIT_MAX_IN_FLIGHT.get(key, RATE_LIMIT_MAX_IN_FLIGHT.get(provider, RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT))
+    return rpm, max_in_flight
+
+
+def pid_alive(pid: int) -> bool:
+    """Se o processo `pid` (deste host) ainda existe."""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class RateLimiter:
+    """
+    Cota por provedor e modelo, compartilhada pelos workers do host via
+    SQLite: um balde de fichas (chamadas por minuto, com rajada de
+    RATE_LIMIT_BURST_SECONDS) e um limite de chamadas simultâneas. Quem não
+    consegue vaga entra numa fila por ordem de chegada e informa a sua
+    posição a `on_wait`, em vez de ir ao provedor e receber um 429. As
+    transações rodam na thread do banco (ver sqlite_store), fora do event
+    loop.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._store = SQLiteStore(path, _SCHEMA, "rate_limit", isolation_level=None)
+
+    def _cleanup(self, conn: sqlite3.Connection, now: float) -> None:
+        """Remove vagas e lugares na fila de processos que morreram ou os esqueceram."""
+        conn.execute("DELETE FROM leases WHERE acquired_at < ?", (now - RATE_LIMIT_LEASE_SECONDS,))
+        conn.execute("DELETE FROM waiters WHERE seen_at < ?", (now - max(10.0, RATE_LIMIT_POLL_INTERVAL * 20),))
+        for (pid,) in conn.execute("SELECT DISTINCT pid FROM leases").fetchall():
+            if not pid_alive(pid):
+                conn.execute("DELETE FROM leases WHERE pid = ?", (pid,))
+                conn.execute("DELETE FROM waiters WHERE pid = ?", (pid,))
+
+    def _enqueue(self, key: str) -> int:
+        return self._store.connection().execute(
+            "INSERT INTO waiters (key, pid, seen_at) VALUES (?, ?, ?)", (key, os.getpid(), time.time())
+        ).lastrowid
+
+    def _try_acquire(self, key: str, waiter_id: int) -> Tuple[Optional[str], int]:
+        """Uma tentativa: (id da vaga, 0) se conseguiu, ou (None, posição na fila)."""
+        conn = self._store.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = self._attempt(conn, key, waiter_id)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _attempt(self, conn: sqlite3.Connection, key: str, waiter_id: int) -> Tuple[Optional[str], int]:
+        rpm, max_in_flight = _limits(key)
+        capacity = max(1.0, rpm * RATE_LIMIT_BURST_SECONDS / 60)
+        now = time.time()
+        conn.execute("UPDATE waiters SET seen_at = ? WHERE id = ?", (now, waiter_id))
+        self._cleanup(conn, now)
+        position = conn.execute(
+            "SELECT COUNT(*) FROM waiters WHERE key = ? AND id < ?", (key, waiter_id)
+        ).fetchone()[0] + 1
+        if position > 1:
+            return None, position
+        in_flight = conn.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (key,)).fetchone()[0]
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rpm / 60)
+        if in_flight >= max_in_flight or tokens < 1:
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+            return None, position
+        lease_id = uuid.uuid4().hex
+        conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens - 1, now))
+        conn.execute("INSERT INTO leases (id, key, pid, acquired_at) VALUES (?, ?, ?, ?)", (lease_id, key, os.getpid(), now))
+        conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+        return lease_id, 0
+
+    def _leave(self, waiter_id: int) -> None:
+        self._store.connection().execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def _release(self, lease_id: str) -> None:
+        self._store.connection().execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    async def acquire(self, key: str, on_wait: Optional[Callable[[str, int], None]] = None) -> Optional[str]:
+        """
+        Aguarda uma vaga na cota `key` e devolve o id dela (para `release`).
+        Enquanto espera, chama `on_wait(key, posição)` a cada mudança de
+        posição e `on_wait(key, 0)` quando a vaga sai.
+        """
+        if not RATE_LIMIT_ENABLED:
+            return None
+        waiter_id = await self._store.call(self._enqueue, key)
+        started = time.monotonic()
+        last_position = None
+        try:
+            while True:
+                lease_id, position = await self._store.call(self._try_acquire, key, waiter_id)
+                if lease_id is not None:
+                    if last_position is not None:
+                        print(f"[rate_limit] {key}: vaga obtida após {time.monotonic() - started:.1f}s na fila", flush=True)
+                        if on_wait:
+                            on_wait(key, 0)
+                    return lease_id
+                if position != last_position:
+                    last_position = position
+                    print(f"[rate_limit] {key}: aguardando cota (posição {position})", flush=True)
+                    if on_wait:
+                        on_wait(key, position)
+                if time.monotonic() - started > RATE_LIMIT_MAX_WAIT:
+                    raise RateLimitWaitTimeout(f"Cota de {key} indisponível após {RATE_LIMIT_MAX_WAIT:.0f}s na fila.")
+                await asyncio.sleep(RATE_LIMIT_POLL_INTERVAL)
+        except BaseException:
+            # Sem aguardar: este caminho também roda no cancelamento
+            self._store.submit(self._leave, waiter_id)
+            raise
+
+    def release(self, lease_id: Optional[str]) -> None:
+        """Libera a vaga na thread do banco, sem bloquear quem chama (pode ser o event loop)."""
+        if lease_id is None:
+            return
+        self._store.submit(self._release, lease_id)
+
+    def status(self) -> Dict[str, Any]:
+        conn = self._store.connection()
+        in_flight = dict(conn.execute("SELECT key, COUNT(*) FROM leases GROUP BY key").fetchall())
+        waiting = dict(conn.execute("SELECT key, COUNT(*) FROM waiters GROUP BY key").fetchall())
+        buckets = {key: (tokens, updated_at) for key, tokens, updated_at in conn.execute("SELECT key, tokens, updated_at FROM buckets")}
+        now = time.time()
+        quotas = {}
+        for key in sorted(set(in_flight) | set(waiting) | set(buckets)):
+            rpm, max_in_flight = _limits(key)
+            capacity = max(1.0, rpm * RATE_LIMIT_BURST_SECONDS / 60)
+            tokens, updated_at = buckets.get(key, (capacity, now))
+            quotas[key] = {
+                "rpm": rpm,
+                "max_in_flight": max_in_flight,
+                "in_flight": in_flight.get(key, 0),
+                "waiting": waiting.get(key, 0),
+                "tokens": round(min(capacity, tokens + (now - updated_at) * rpm / 60), 2),
+            }
+        return {"enabled": RATE_LIMIT_ENABLED, "quotas": quotas}
+
+
+# Instância compartilhada pelo processo
+rate_limiter = RateLimiter()
@@ -0,0 +1,138 @@
+# result_store.py
+
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+# --- Configurações do armazenamento de resultados (ajustáveis por variáveis de ambiente) ---
+
+# Banco compartilhado pelos workers do gunicorn, ao lado dos demais caches
+RESULTS_DB_PATH = os.getenv("RESULTS_DB_PATH", os.path.join(os.getenv("HF_HOME", ".cache"), "results.sqlite"))
+# Resultados mais antigos que isso são descartados (segundos)
+RESULTS_TTL_SECONDS = int(os.getenv("RESULTS_TTL_SECONDS", 24 * 3600))
+# Tamanho máximo total; acima dele os resultados menos acessados saem primeiro
+RESULTS_MAX_BYTES = int(os.getenv("RESULTS_MAX_BYTES", 512 * 1024 * 1024))
+# A remoção por idade e tamanho roda a cada N resultados gravados (não a cada um)
+RESULTS_EVICT_EVERY = int(os.getenv("RESULTS_EVICT_EVERY", 20))
+# O último acesso (para o LRU) só é regravado se tiver mais que isso (segundos):
+# as leituras em partes de um mesmo resultado não escrevem no banco a cada parte
+RESULTS_TOUCH_INTERVAL = float(os.getenv("RESULTS_TOUCH_INTERVAL", 60))
+# Tamanho padrão de cada leitura parcial (caracteres)
+RESULTS_READ_CHUNK_CHARS = int(os.getenv("RESULTS_READ_CHUNK_CHARS", 1_000_000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    job_id TEXT NOT NULL,
+    output_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (job_id, output_id)
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed_at);
+"""
+
+
+class ResultStore:
+    """
+    Saídas parciais e finais de cada job (por id do job e id da caixa de
+    saída, ex. 'sonnet-output', 'final-output'), guardadas em SQLite para
+    que qualquer worker as encontre. Expiram por idade (TTL) e, acima do
+    limite de tamanho, pelo último acesso (LRU), verificados a cada
+    RESULTS_EVICT_EVERY gravações. As leituras podem ser parciais
+    (offset/length em caracteres), sem carregar o texto inteiro, e só
+    regravam o último acesso quando ele tem mais de RESULTS_TOUCH_INTERVAL.
+    """
+
+    def __init__(self, db_path: str = RESULTS_DB_PATH):
+        self.db_path = db_path
+        self._store = SQLiteStore(db_path, _SCHEMA, "results")
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self.stats = {"writes": 0, "reads": 0, "misses": 0, "evictions": 0}
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += value
+
+    def put(self, job_id: str, output_id: str, content: str) -> None:
+        now = time.time()
+        conn = self._store.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (job_id, output_id, content, chars, bytes, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, output_id, content, len(content), len(content.encode("utf-8")), now, now),
+            )
+        with self._lock:
+            self.stats["writes"] += 1
+            self._puts_since_evict += 1
+            evict = self._puts_since_evict >= RESULTS_EVICT_EVERY
+            if evict:
+                self._puts_since_evict = 0
+        if evict:
+            self._evict()
+
+    def get(self, job_id: str, output_id: str, offset: int = 0, length: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """
+        Devolve (trecho, total de caracteres) a partir de `offset`, com até
+        `length` caracteres (padrão RESULTS_READ_CHUNK_CHARS), ou None.
+        """
+        length = length or RESULTS_READ_CHUNK_CHARS
+        conn = self._store.connection()
+        row = conn.execute(
+            "SELECT substr(content, ?, ?), chars, accessed_at FROM results WHERE job_id = ? AND output_id = ?",
+            (max(0, offset) + 1, length, job_id, output_id),
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        now = time.time()
+        if now - row[2] >= RESULTS_TOUCH_INTERVAL:
+            with conn:
+                conn.execute(
+                    "UPDATE results SET accessed_at = ? WHERE job_id = ? AND output_id = ?", (now, job_id, output_id)
+                )
+        self._count("reads")
+        return row[0], row[1]
+
+    def list_outputs(self, job_id: str) -> List[Dict]:
+        rows = self._store.connection().execute(
+            "SELECT output_id, chars, created_at FROM results WHERE job_id = ? ORDER BY created_at", (job_id,)
+        ).fetchall()
+        return [{"id": r[0], "chars": r[1], "created_at": r[2]} for r in rows]
+
+    def _evict(self) -> None:
+        """Remove os resultados expirados e, se preciso, os menos acessados até caber no limite."""
+        conn = self._store.connection()
+        with conn:
+            removed = conn.execute(
+                "DELETE FROM results WHERE created_at < ?", (time.time() - RESULTS_TTL_SECONDS,)
+            ).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+            if total > RESULTS_MAX_BYTES:
+                # Percorre o índice por acesso só até liberar o excesso
+                for job_id, output_id, size in conn.execute(
+                    "SELECT job_id, output_id, bytes FROM results ORDER BY accessed_at"
+                ).fetchall():
+                    if total <= RESULTS_MAX_BYTES:
+                        break
+                    conn.execute("DELETE FROM results WHERE job_id = ? AND output_id = ?", (job_id, output_id))
+                    total -= size
+                    removed += 1
+        if removed:
+            self._count("evictions", removed)
+            print(f"[result_store] {removed} resultados removidos (TTL/limite de tamanho)", flush=True)
+
+    def status(self) -> Dict:
+        count, size = self._store.connection().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+        return {"entries": count, "size_bytes": size, "max_bytes": RESULTS_MAX_BYTES, **self.stats}
+
+
+# Instância compartilhada pelo processo
+result_store = ResultStore()
@@ -0,0 +1,160 @@
+# sectioned.py
+
+import os
+import re
+import json
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# --- Configurações do modo por seções (ajustáveis por variáveis de ambiente) ---
+
+SECTIONED_MIN_SECTIONS = int(os.getenv("SECTIONED_MIN_SECTIONS", 3))
+SECTIONED_MAX_SECTIONS = int(os.getenv("SECTIONED_MAX_SECTIONS", 6))
+# Orçamento de contexto dos documentos enviado a cada seção (caracteres)
+SECTIONED_CONTEXT_CHARS = int(os.getenv("SECTIONED_CONTEXT_CHARS", 12000))
+# Tempo limite de cada chamada (esboço ou seção), em segundos
+SECTIONED_TIMEOUT = float(os.getenv("SECTIONED_TIMEOUT", 300))
+
+
+@dataclass
+class Section:
+    """Uma seção do esboço, com sua parte do orçamento de caracteres."""
+    title: str
+    summary: str
+    weight: float = 1.0
+    min_chars: int = 0
+    max_chars: int = 0
+
+    @property
+    def heading(self) -> str:
+        # Seção única sem título (esboço não aproveitável): texto corrido
+        return f"## {self.title}\n\n" if self.title else ""
+
+
+def _clean_weight(value) -> float:
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        return 1.0
+    return weight if weight > 0 else 1.0
+
+
+def parse_outline(text: str, max_sections: int = SECTIONED_MAX_SECTIONS) -> List[Section]:
+    """
+    Lê o esboço devolvido pelo modelo. O formato pedido é uma lista JSON;
+    se o modelo a cercar de texto ou de ``` a lista é extraída, e se não
+    houver JSON válido usa as linhas numeradas/títulos Markdown. Devolve uma
+    lista vazia se nada puder ser aproveitado.
+    """
+    sections: List[Section] = []
+    match = re.search(r"\[.*\]", text or "", re.DOTALL)
+    if match:
+        try:
+            items = json.loads(match.group(0))
+        except ValueError:
+            items = []
+        for item in items if isinstance(items, list) else []:
+            if isinstance(item, dict) and str(item.get("titulo", "")).strip():
+                sections.append(Section(
+                    title=str(item["titulo"]).strip(),
+                    summary=str(item.get("resumo", "")).strip(),
+                    weight=_clean_weight(item.get("peso")),
+                ))
+
+    if not sections:
+        for line in (text or "").splitlines():
+            heading = re.match(r"^\s*(?:#{1,3}\s+|\d+[.)]\s+)(.+)$", line)
+            if heading:
+                title, _, summary = heading.group(1).partition(":")
+                sections.append(Section(title=title.strip(" *"), summary=summary.strip()))
+
+    return sections[:max_sections]
+
+
+def allocate_chars(sections: List[Section], min_chars: int, max_chars: int) -> List[Section]:
+    """Distribui o intervalo de tamanho do texto entre as seções, proporcional ao peso."""
+    total_weight = sum(section.weight for section in sections) or 1.0
+    for section in sections:
+        share = section.weight / total_weight
+        section.min_chars = math.floor(min_chars * share)
+        section.max_chars = math.ceil(max_chars * share)
+    return sections
+
+
+def describe_outline(sections: List[Section]) -> str:
+    """Esboço em texto, incluído no prompt de cada seção para evitar repetições."""
+    return "\n".join(
+        f"{index}. {section.title}: {section.summary}" for index, section in enumerate(sections, start=1)
+    )
+
+
+def stitch(sections: List[Section], contents: List[str]) -> str:
+    """Junta as seções na ordem do esboço, cada uma com seu título."""
+    return "\n\n".join(section.heading + content.strip() for section, content in zip(sections, contents)).strip()
+
+
+class OrderedSectionStream:
+    """
+    Reordena os deltas de seções geradas ao mesmo tempo: os da seção atual
+    são repassados na hora (precedidos do título); os das seguintes ficam
+    guardados até que as anteriores terminem. Os espaços no início e no fim
+    de cada seção são descartados como em `stitch`, para que o texto enviado
+    em deltas seja igual ao texto final.
+    """
+
+    def __init__(self, sections: List[Section]):
+        self.sections = sections
+        self.current = 0
+        self._buffers: Dict[int, List[str]] = {index: [] for index in range(len(sections))}
+        self._finished = set()
+        self._started = set()
+        # Seções que já receberam texto e espaços finais retidos de cada uma
+        self._text_started = set()
+        self._held: Dict[int, str] = {}
+
+    def _open(self, index: int) -> str:
+        if index in self._started:
+            return ""
+        self._started.add(index)
+        return ("\n\n" if index else "") + self.sections[index].heading
+
+    def _trim(self, index: int, frame: str) -> str:
+        """Descarta os espaços iniciais da seção e retém os finais até chegar mais texto."""
+        if index not in self._text_started:
+            frame = frame.lstrip()
+            if not frame:
+                return ""
+            self._text_started.add(index)
+        stripped = frame.rstrip()
+        if not stripped:
+            self._held[index] = self._held.get(index, "") + frame
+            return ""
+        held = frame[len(stripped):]
+        text = self._held.pop(index, "") + stripped
+        if held:
+            self._held[index] = held
+        return text
+
+    def add(self, index: int, frame: str) -> Optional[str]:
+        """Recebe um delta da seção `index`; devolve o texto que pode ser enviado agora."""
+        frame = self._trim(index, frame)
+        if index != self.current:
+            self._buffers.setdefault(index, []).append(frame)
+            return None
+        return self._open(index) + frame
+
+    def _release(self, index: int) -> str:
+        return self._open(index) + "".join(self._buffers.pop(index, []))
+
+    def finish(self, index: int) -> Optional[str]:
+        """Marca a seção como concluída; devolve o texto liberado das seções seguintes."""
+        self._finished.add(index)
+        released = []
+        while self.current < len(self.sections) and self.current in self._finished:
+            released.append(self._release(self.current))
+            self.current += 1
+        if released and self.current < len(self.sections):
+            # A nova seção atual passa a ser enviada na hora
+            released.append(self._release(self.current))
+        return "".join(released) or None
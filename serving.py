@@ -0,0 +1,247 @@
+# serving.py
+
+import os
+import gc
+import time
+import weakref
+import threading
+import concurrent.futures
+import concurrent.futures.thread
+from typing import Any, Callable, Dict, List, Optional
+
+# Modo de pré-carregamento (GUNICORN_PRELOAD=1, ver gunicorn.conf.py): o app é
+# importado no processo mestre e os recursos somente leitura (modelo de
+# embeddings, SDKs dos provedores) são carregados antes do fork, para que
+# os workers compartilhem essas páginas de memória (copy-on-write)
+PRELOAD_ENABLED = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+# Definido pelo gunicorn.conf.py no mestre; os workers herdam (relatório de memória)
+MASTER_PID_ENV = "GUNICORN_MASTER_PID"
+
+
+def gevent_active() -> bool:
+    """Indica se o processo roda num worker gevent (threading substituído por greenlets)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Executa código que ocupa a CPU (codificação de embeddings, busca FAISS)
+    numa thread nativa quando o worker é gevent, para não travar o event
+    loop que atende as demais conexões SSE. Nos workers síncronos chama a
+    função diretamente.
+    """
+    if not gevent_active():
+        return fn(*args, **kwargs)
+    import gevent
+
+    return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+
+def start_native_thread(target: Callable[..., Any], name: str, *args: Any) -> None:
+    """
+    Inicia `target(*args)` numa thread do sistema operacional. Num worker
+    gevent threading.Thread cria um greenlet, que dividiria o hub com as
+    conexões SSE; o que roda sem parar (como o event loop asyncio do
+    agendador de LLMs) precisa de uma thread de verdade, com o seu próprio hub.
+    """
+    if not gevent_active():
+        threading.Thread(target=target, args=args, name=name, daemon=True).start()
+        return
+    from gevent import monkey
+
+    monkey.get_original("_thread", "start_new_thread")(target, args)
+
+
+class _IdleCounter:
+    """Contador de threads ociosas do executor com trava nativa (só é consultado sem esperar)."""
+
+    def __init__(self):
+        from gevent import monkey
+
+        self._lock = monkey.get_original("_thread", "allocate_lock")()
+        self._value = 0
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._value:
+                self._value -= 1
+                return True
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            self._value += 1
+
+
+class NativeThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor cujas threads são do sistema operacional também nos
+    workers gevent. Lá o original criaria greenlets presos ao hub da thread
+    que os iniciou: se for a do event loop do agendador, o trabalho
+    "em segundo plano" (SQLite, getaddrinfo) travaria o próprio loop, e a
+    saída do interpretador esperaria para sempre por eles. Fora do gevent é
+    o ThreadPoolExecutor comum. As threads nativas não entram na espera da
+    saída do interpretador: o que estiver na fila quando o worker encerra é
+    descartado.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, thread_name_prefix: str = ""):
+        super().__init__(max_workers, thread_name_prefix)
+        self._native = gevent_active()
+        if self._native:
+            from gevent import monkey
+
+            # A fila do gevent não acordaria uma thread sem outros eventos no hub
+            self._work_queue = monkey.get_original("queue", "SimpleQueue")()
+            self._idle_semaphore = _IdleCounter()
+            self._native_threads = 0
+
+    def _adjust_thread_count(self) -> None:
+        if not self._native:
+            super()._adjust_thread_count()
+            return
+        if self._idle_semaphore.acquire(timeout=0):
+            return
+
+        def wake_workers(_, work_queue=self._work_queue):
+            work_queue.put(None)
+
+        if self._native_threads < self._max_workers:
+            name = f"{self._thread_name_prefix or 'executor'}_{self._native_threads}"
+            start_native_thread(concurrent.futures.thread._worker, name, weakref.ref(self, wake_workers),
+                                self._work_queue, self._initializer, self._initargs)
+            self._native_threads += 1
+
+
+# --- Pré-carregamento no mestre e recriação do que não sobrevive ao fork ---
+
+def preload_assets() -> Dict[str, float]:
+    """
+    Carrega no processo mestre, antes do fork, o que é somente leitura e
+    pesado: o modelo de embeddings (sem rodar inferência, para não iniciar
+    os pools de threads do torch antes do fork) e os SDKs dos provedores (só
+    os módulos; os clientes HTTP são criados em cada worker). No fim congela
+    o coletor de lixo, para ele não tocar (e copiar) os objetos herdados.
+    """
+    from embeddings import embedding_service
+    from llms import llm_registry
+
+    timings = {}
+    # Os tokenizers rápidos desativam o paralelismo (com aviso) se ele foi usado antes do fork
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    if os.getenv("EMBEDDING_WARMUP", "1") == "1":
+        started = time.time()
+        try:
+            embedding_service.get_model()
+            timings["embeddings"] = round(time.time() - started, 3)
+        except Exception as e:
+            # Sem o modelo no mestre, cada worker o carrega na primeira consulta
+            print(f"[serving] Falha ao pré-carregar o modelo de embeddings: {e}", flush=True)
+    timings.update({f"sdk_{name}": seconds for name, seconds in llm_registry.import_sdks().items()})
+    gc.collect()
+    gc.freeze()
+    print(f"[serving] Pré-carregado no mestre (pid {os.getpid()}): {timings}", flush=True)
+    return timings
+
+
+def after_fork() -> None:
+    """
+    Executado em cada worker logo após o fork: descarta o que não pode ser
+    compartilhado entre processos (threads, event loops, pools de conexões
+    HTTP e de processos) para ser recriado sob demanda no worker. Os
+    recursos somente leitura pré-carregados continuam compartilhados.
+    """
+    from llm_scheduler import llm_scheduler
+    from llms import llm_registry
+    import rag_processor
+
+    llm_scheduler.reset_after_fork()
+    llm_registry.reset_after_fork()
+    # O pool de extração (se o mestre criou um) pertence ao mestre
+    rag_processor._extraction_pool = None
+    if os.getenv("EMBEDDING_WARMUP", "1") == "1":
+        # A inferência de aquecimento roda no worker, já com o modelo herdado
+        from embeddings import start_warmup
+
+        start_warmup()
+
+
+# --- Relatório de memória (RSS x memória compartilhada) ---
+
+def _smaps_rollup(pid: int) -> Optional[Dict[str, float]]:
+    """Memória do processo em MB, a partir de /proc/<pid>/smaps_rollup (Linux)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            for line in smaps:
+                parts = line.split()
+                if len(parts) >= 3 and parts[1].isdigit():
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss_mb": round(fields.get("Rss", 0), 1),
+        "pss_mb": round(fields.get("Pss", 0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0), 1),
+        "swap_mb": round(fields.get("Swap", 0), 1),
+    }
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # O nome do processo (entre parênteses) pode conter espaços
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def memory_usage(pid: Optional[int] = None) -> Optional[Dict[str, float]]:
+    return _smaps_rollup(pid or os.getpid())
+
+
+def memory_report() -> Dict[str, Any]:
+    """
+    Memória do mestre do gunicorn e de cada worker. RSS conta as páginas
+    compartilhadas em todos os processos; PSS as divide entre eles. A soma
+    dos RSS menos a soma dos PSS é a memória poupada pelo compartilhamento.
+    Fora do gunicorn, só o processo atual.
+    """
+    master = int(os.getenv(MASTER_PID_ENV, "0") or 0)
+    pids = [master] + _children(master) if master else [os.getpid()]
+    processes = {}
+    for pid in pids:
+        usage = _smaps_rollup(pid)
+        if usage is not None:
+            processes[str(pid)] = {"role": "master" if pid == master else "worker", "current": pid == os.getpid(), **usage}
+    total_rss = sum(p["rss_mb"] for p in processes.values())
+    total_pss = sum(p["pss_mb"] for p in processes.values())
+    return {
+        "preload": PRELOAD_ENABLED,
+        "processes": processes,
+        "total_rss_mb": round(total_rss, 1),
+        "total_pss_mb": round(total_pss, 1),
+        "shared_savings_mb": round(total_rss - total_pss, 1),
+    }
+
+
+def log_memory(label: str) -> None:
+    usage = memory_usage()
+    if usage:
+        print(
+            f"[serving] {label} (pid {os.getpid()}): RSS {usage['rss_mb']} MB, "
+            f"compartilhada {usage['shared_mb']} MB, privada {usage['private_mb']} MB, PSS {usage['pss_mb']} MB",
+            flush=True,
+        )
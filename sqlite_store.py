@@ -0,0 +1,74 @@
+# sqlite_store.py
+
+import os
+import asyncio
+import sqlite3
+import threading
+import concurrent.futures
+from typing import Any, Callable, Optional
+
+from serving import NativeThreadPoolExecutor
+
+
+class SQLiteStore:
+    """
+    Acesso a um banco SQLite compartilhado pelos workers: uma conexão por
+    thread, reaproveitada entre as operações, com o esquema criado uma única
+    vez por processo (e não a cada operação). Depois de um fork as conexões e
+    a thread herdadas do processo pai são descartadas e recriadas sob demanda.
+
+    Código que roda no event loop não deve tocar no banco diretamente: usa
+    `call` (aguarda o resultado) ou `submit` (não aguarda), que executam a
+    operação numa thread própria do banco (nativa também nos workers
+    gevent), fora do loop.
+    """
+
+    def __init__(self, path: str, schema: str, name: str, **connect_kwargs: Any):
+        self.path = path
+        self.schema = schema
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        """Estado do processo; no filho após o fork nada do pai vale (conexões, thread do banco, travas)."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, **self.connect_kwargs)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with self._lock:
+                if not self._schema_ready:
+                    conn.executescript(self.schema)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = NativeThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.name}-db")
+        return self._executor
+
+    async def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Executa `fn(*args)` na thread do banco e aguarda o resultado, sem bloquear o event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> concurrent.futures.Future:
+        """Agenda `fn(*args)` na thread do banco sem esperar; falhas vão para o log."""
+        future = self._get_executor().submit(fn, *args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _log_failure(self, future: concurrent.futures.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            print(f"[sqlite_store] {self.name}: falha numa operação em segundo plano: {future.exception()}", flush=True)
@@ -0,0 +1,149 @@
+# sse.py
+
+import os
+import json
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List
+
+# --- Configurações da codificação dos eventos SSE (ajustáveis por variáveis de ambiente) ---
+
+# Comprime a resposta text/event-stream com gzip quando o cliente aceita
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "1") == "1"
+SSE_COMPRESSION_LEVEL = int(os.getenv("SSE_COMPRESSION_LEVEL", 6))
+# Registra no log o tamanho de cada evento (o resumo por stream é sempre registrado)
+SSE_LOG_EVENTS = os.getenv("SSE_LOG_EVENTS", "0") == "1"
+# Resultados maiores que isso (caracteres) são enviados em eventos 'chunk' numerados
+SSE_CHUNK_CHARS = int(os.getenv("SSE_CHUNK_CHARS", 1_000_000))
+
+# Serializador único: sem escapar acentos e sem espaços entre os separadores
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+# Chaves que identificam o tipo do evento, na ordem em que são procuradas
+_EVENT_KINDS = ("delta", "chunk", "partial_result", "final_result", "notice", "provider_queue", "error", "done", "progress", "job_id")
+# Os tipos aparecem antes do conteúdo: basta olhar o começo do evento
+_KIND_SCAN_CHARS = 512
+_KIND_MARKERS = tuple((kind, f'"{kind}":') for kind in _EVENT_KINDS)
+
+
+def encode_json(data: Any) -> str:
+    """JSON de um evento, serializado numa única passada."""
+    return _encoder.encode(data)
+
+
+def event(data: Any) -> str:
+    """Bloco SSE ('data: {json}' seguido de linha em branco)."""
+    return f"data: {_encoder.encode(data)}\n\n"
+
+
+def event_kind(block: str) -> str:
+    """Tipo de um bloco SSE (pela primeira chave conhecida), sem copiar o conteúdo."""
+    if block.startswith(":"):
+        return "keepalive"
+    # Blocos reenviados do log do job começam com a linha 'id:'
+    start = block.find("data:", 0, 64) if block.startswith("id:") else 0
+    head = block[start:start + _KIND_SCAN_CHARS]
+    for kind, marker in _KIND_MARKERS:
+        if marker in head:
+            return kind
+    return "other"
+
+
+class StreamedOutputs:
+    """
+    Texto já enviado ao cliente em eventos 'delta', por caixa de saída. O
+    resultado final de uma caixa que veio em streaming leva só o que falta
+    ('append', vazio se o texto já está completo) em vez do texto inteiro;
+    se o texto final não continua o que foi enviado (ex. a chamada de
+    reserva venceu), vai o texto completo ('content').
+    """
+
+    def __init__(self):
+        self._parts: Dict[str, List[str]] = {}
+
+    def delta(self, output_id: str, content: str) -> Dict[str, Any]:
+        self._parts.setdefault(output_id, []).append(content)
+        return {"delta": {"id": output_id, "content": content}}
+
+    def result(self, output_id: str, text: str) -> Dict[str, Any]:
+        parts = self._parts.pop(output_id, None)
+        if parts:
+            streamed = "".join(parts)
+            if text.startswith(streamed):
+                return {"id": output_id, "append": text[len(streamed):]}
+        return {"id": output_id, "content": text}
+
+
+class ResultChunks:
+    """
+    Divide o texto de um resultado (ver StreamedOutputs.result) maior que
+    SSE_CHUNK_CHARS em eventos 'chunk' numerados, gerados um a um, em vez de
+    um único evento gigante. Depois da iteração, `result` é o resultado a
+    enviar no evento final: sem o texto e com 'chunked' (quantidade de
+    partes, caracteres, CRC32 do texto em UTF-8 e se as partes completam o
+    texto já recebido, 'append'), para o cliente conferir a remontagem.
+    Resultados pequenos passam inalterados, sem partes.
+    """
+
+    def __init__(self, result: Dict[str, Any], chunk_chars: int = SSE_CHUNK_CHARS):
+        self.result = result
+        self.chunk_chars = chunk_chars
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        field = "content" if "content" in self.result else "append"
+        text = self.result[field]
+        if len(text) <= self.chunk_chars:
+            return
+        crc = 0
+        count = 0
+        for start in range(0, len(text), self.chunk_chars):
+            piece = text[start:start + self.chunk_chars]
+            crc = zlib.crc32(piece.encode("utf-8"), crc)
+            yield {"chunk": {"id": self.result["id"], "index": count, "content": piece}}
+            count += 1
+        self.result = {key: value for key, value in self.result.items() if key != field}
+        self.result["chunked"] = {"count": count, "chars": len(text), "crc32": f"{crc:08x}", "append": field == "append"}
+
+
+def encode_stream(events: Iterable[str], label: str, compress: bool = False) -> Iterator[bytes]:
+    """
+    Codifica os blocos SSE para envio: cada evento é convertido para UTF-8
+    uma única vez (o que de qualquer forma iria para o socket) e, com
+    `compress`, passa por um gzip com flush a cada evento, para que o
+    cliente o receba na hora. Contabiliza os bytes por tipo de evento e
+    registra o resumo no log ao final do stream.
+    """
+    compressor = zlib.compressobj(SSE_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    started = time.time()
+    totals = {"events": 0, "bytes": 0, "sent": 0}
+    by_kind: Dict[str, List[int]] = {}
+    try:
+        for block in events:
+            payload = block.encode("utf-8")
+            if compressor is not None:
+                out = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                out = payload
+            kind = event_kind(block)
+            counts = by_kind.setdefault(kind, [0, 0])
+            counts[0] += 1
+            counts[1] += len(payload)
+            totals["events"] += 1
+            totals["bytes"] += len(payload)
+            totals["sent"] += len(out)
+            if SSE_LOG_EVENTS:
+                print(f"[sse] {label}: evento {kind} com {len(payload)} bytes ({len(out)} enviados)", flush=True)
+            yield out
+        if compressor is not None:
+            tail = compressor.flush()
+            totals["sent"] += len(tail)
+            yield tail
+    finally:
+        kinds = ", ".join(f"{kind}={count}/{size}B" for kind, (count, size) in sorted(by_kind.items()))
+        sent = f" ({totals['sent']} com gzip)" if compressor is not None else ""
+        print(f"[sse] {label}: {totals['events']} eventos, {totals['bytes']} bytes{sent} em {time.time() - started:.1f}s [{kinds}]", flush=True)
+
+
+def accepts_gzip(accept_encodings) -> bool:
+    """Se o cabeçalho Accept-Encoding do cliente (request.accept_encodings) aceita gzip."""
+    return SSE_COMPRESSION and accept_encodings["gzip"] > 0
@@ -0,0 +1,13 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# Os módulos do projeto ficam na raiz do repositório
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+# Caches e bancos criados na importação dos módulos vão para um diretório temporário, não para o repositório
+os.environ.setdefault("HF_HOME", tempfile.mkdtemp(prefix="sistema-ia-tests-"))
@@ -0,0 +1,118 @@
+# tests/test_custom_grok.py
+#
+# Testes do cliente da xAI contra o servidor local (tools/stub_llm_server.py):
+# novas tentativas em 429/5xx respeitando o Retry-After, streaming SSE
+# síncrono e assíncrono e eventos SSE malformados.
+
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import custom_grok
+from custom_grok import GrokChatModel
+from stub_llm_server import REPLY_TEXT, StubState, make_handler
+
+EXPECTED_TEXT = REPLY_TEXT * 3
+# O servidor envia o texto palavra a palavra, cada uma seguida de espaço
+STREAMED_TEXT = "".join(piece + " " for piece in EXPECTED_TEXT.split(" "))
+
+
+@pytest.fixture
+def stub(tmp_path):
+    """Sobe o servidor local numa porta livre; devolve uma função que o configura."""
+    servers = []
+
+    def start(**options):
+        state = StubState(str(tmp_path / "requests.jsonl"), **options)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return state, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _model(url: str) -> GrokChatModel:
+    return GrokChatModel(model="grok-stub", api_key="stub", base_url=url, timeout=10, max_retries=3)
+
+
+def _requests(state: StubState):
+    with open(state.log_path, encoding="utf-8") as log:
+        return [json.loads(line) for line in log]
+
+
+def test_invoke_retries_429_honoring_retry_after(stub):
+    state, url = stub(fail_first=2, fail_status=429, retry_after="0.3")
+    started = time.monotonic()
+    result = _model(url).invoke("olá")
+    assert result.content == EXPECTED_TEXT
+    assert len(_requests(state)) == 3
+    # Duas esperas de 0.3s pedidas pelo servidor
+    assert time.monotonic() - started >= 0.6
+    assert result.usage_metadata["output_tokens"] > 0
+
+
+def test_invoke_gives_up_after_max_retries(stub):
+    state, url = stub(fail_first=10, fail_status=503, retry_after="0")
+    with pytest.raises(ValueError, match="HTTP 503"):
+        _model(url).invoke("olá")
+    assert len(_requests(state)) == 4
+
+
+def test_stream_retries_5xx_and_yields_text(stub):
+    state, url = stub(fail_first=1, fail_status=502, retry_after="0")
+    chunks = list(_model(url).stream("olá"))
+    assert "".join(chunk.content for chunk in chunks) == STREAMED_TEXT
+    assert len(chunks) > 1
+    assert _requests(state)[-1]["body"]["stream"] is True
+    # O uso de tokens chega no último evento (stream_options.include_usage)
+    assert any(chunk.usage_metadata for chunk in chunks)
+
+
+def test_stream_skips_malformed_sse_frame(stub, capsys):
+    _, url = stub(malformed_sse=True)
+    chunks = list(_model(url).stream("olá"))
+    assert "".join(chunk.content for chunk in chunks) == STREAMED_TEXT
+    assert "Evento SSE inválido ignorado" in capsys.readouterr().out
+
+
+def test_async_invoke_and_stream(stub):
+    state, url = stub(fail_first=1, fail_status=429, retry_after="0")
+    model = _model(url)
+
+    async def run():
+        result = await model.ainvoke("olá")
+        pieces = [chunk.content async for chunk in model.astream("olá")]
+        return result, pieces
+
+    result, pieces = asyncio.run(run())
+    assert result.content == EXPECTED_TEXT
+    assert "".join(pieces) == STREAMED_TEXT
+    assert len(_requests(state)) == 3
+
+
+def test_async_stream_skips_malformed_sse_frame(stub):
+    _, url = stub(malformed_sse=True)
+
+    async def run():
+        return [chunk.content async for chunk in _model(url).astream("olá")]
+
+    assert "".join(asyncio.run(run())) == STREAMED_TEXT
+
+
+@pytest.mark.parametrize("line", ['data: {"choices": [{"delta"', "data: nao-e-json", "data: 42"])
+def test_stream_chunk_ignores_invalid_data(line):
+    assert GrokChatModel._stream_chunk(line) is None
+
+
+def test_retry_delay_caps_retry_after(monkeypatch):
+    monkeypatch.setattr(custom_grok, "GROK_RETRY_MAX_DELAY", 5.0)
+    response = custom_grok.httpx.Response(429, headers={"retry-after": "120"})
+    assert custom_grok._retry_delay(0, response) == 5.0
@@ -0,0 +1,57 @@
+# tests/test_document_cache.py
+#
+# Cache de documentos: o tamanho total fica nas estatísticas e a árvore só é
+# percorrida quando o limite é ultrapassado; os contadores de hit/miss são
+# gravados em lotes e somados entre instâncias (workers).
+
+import time
+
+import document_cache
+from document_cache import DocumentCache
+
+
+def _key(i):
+    return f"{i:064x}"
+
+
+def test_size_is_tracked_and_tree_is_walked_only_over_the_limit(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path), max_bytes=10_000)
+    walks = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: walks.append(1) or entries())
+
+    for i in range(5):
+        cache.put_bytes(_key(i), "a.bin", b"x" * 1000)
+    # Só a medição inicial (estatísticas ainda sem o total)
+    assert len(walks) == 1
+    cache.put_bytes(_key(0), "a.bin", b"x" * 500)
+    assert cache.stats()["size_bytes"] == 4500
+
+    for i in range(5, 12):
+        time.sleep(0.01)  # mtimes distintos para a ordem LRU
+        cache.put_bytes(_key(i), "a.bin", b"x" * 1000)
+    stats = cache.stats()
+    assert stats["size_bytes"] <= 10_000
+    assert stats["evictions"] > 0
+    # As entradas mais antigas saíram; a última gravada ficou
+    assert cache.get_bytes(_key(1), "a.bin") is None
+    assert cache.get_bytes(_key(11), "a.bin") is not None
+    assert len(walks) < 1 + 7
+
+
+def test_hit_and_miss_counters_are_flushed_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_cache, "DOCUMENT_CACHE_STATS_FLUSH_EVERY", 5)
+    monkeypatch.setattr(document_cache, "DOCUMENT_CACHE_STATS_FLUSH_SECONDS", 3600)
+    worker_a = DocumentCache(str(tmp_path))
+    worker_b = DocumentCache(str(tmp_path))
+    worker_a.put_pages(_key(1), ["página"])
+
+    for _ in range(4):
+        worker_a.has_pages(_key(2))
+    assert "misses" not in worker_a._read_stats()
+    worker_a.has_pages(_key(2))
+    assert worker_a._read_stats()["misses"] == 5
+
+    assert worker_b.get_pages(_key(1), source_size=100) == ["página"]
+    stats = worker_b.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_saved"]) == (1, 5, 100)
@@ -0,0 +1,62 @@
+# tests/test_document_library.py
+#
+# Vetores da biblioteca em arquivos só acrescentados e lidos com np.memmap:
+# acréscimos e remoções (TOMBSTONE) aparecem para um leitor já aberto, e o
+# índice FAISS das versões anteriores é convertido na primeira leitura.
+
+import os
+
+import numpy as np
+
+import document_library
+from document_library import Collection
+
+UNIT = np.eye(4, dtype=np.float32)
+
+
+def _texts(hits):
+    return [text for _, _, text in sorted(hits, key=lambda hit: -hit[0])]
+
+
+def test_append_and_tombstone_are_seen_by_an_open_reader(tmp_path):
+    writer = Collection("docs", str(tmp_path))
+    writer.add_document("a" * 64, "a.txt", ["a0", "a1"], UNIT[:2])
+    reader = Collection("docs", str(tmp_path))
+    assert _texts(reader.search(UNIT[:1], 1)) == ["a0"]
+
+    writer.add_document("b" * 64, "b.txt", ["b0"], UNIT[2:3])
+    assert _texts(reader.search(UNIT[2:3], 1)) == ["b0"]
+    vectors_size = os.path.getsize(writer.vectors_path)
+
+    writer.remove_document(1)
+    assert _texts(reader.search(UNIT[:1], 5)) == ["b0"]
+    # A remoção não reescreve nem encolhe os arquivos
+    assert os.path.getsize(writer.vectors_path) == vectors_size
+
+
+def test_interrupted_append_is_discarded(tmp_path):
+    collection = Collection("docs", str(tmp_path))
+    collection.add_document("a" * 64, "a.txt", ["a0"], UNIT[:1])
+    # Vetores gravados sem os IDs correspondentes (escrita interrompida)
+    with open(collection.vectors_path, "ab") as f:
+        f.write(UNIT[3:4].tobytes())
+
+    collection.add_document("b" * 64, "b.txt", ["b0"], UNIT[1:2])
+
+    assert os.path.getsize(collection.vectors_path) == 2 * UNIT.shape[1] * 4
+    assert _texts(collection.search(UNIT[1:2], 1)) == ["b0"]
+
+
+def test_legacy_faiss_index_is_converted(tmp_path):
+    import faiss
+
+    collection = Collection("docs", str(tmp_path))
+    with collection._connect() as conn:
+        conn.execute("INSERT INTO documents (sha256, filename, chunk_count, added_at) VALUES ('x', 'x.txt', 2, 0)")
+        conn.executemany("INSERT INTO chunks (document_id, position, text) VALUES (1, ?, ?)", [(0, "x0"), (1, "x1")])
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(4))
+    index.add_with_ids(UNIT[:2], np.array([1, 2], dtype=np.int64))
+    faiss.write_index(index, os.path.join(collection.path, document_library.LEGACY_INDEX_FILE))
+
+    assert _texts(collection.search(UNIT[1:2], 1)) == ["x1"]
+    assert not os.path.exists(os.path.join(collection.path, document_library.LEGACY_INDEX_FILE))
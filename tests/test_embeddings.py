@@ -0,0 +1,66 @@
+# tests/test_embeddings.py
+#
+# Cache de embeddings por hash do trecho: o vetor codificado por um worker
+# sai do SQLite no outro, sem nova codificação, e os contadores batem mesmo
+# com pedidos simultâneos de várias threads. O modelo é trocado por um
+# codificador falso.
+
+import threading
+
+import numpy as np
+import pytest
+
+from embeddings import EmbeddingService, chunk_hash
+
+
+def _fake_encoder(service, calls):
+    def encode_batch(texts):
+        calls.extend(texts)
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts], dtype=np.float32)
+    service._encode_batch = encode_batch
+    service.get_model = lambda: None
+
+
+@pytest.fixture
+def workers(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    return EmbeddingService("modelo-falso", path), EmbeddingService("modelo-falso", path)
+
+
+def test_vectors_encoded_by_one_worker_are_read_by_another(workers):
+    first, second = workers
+    first_calls, second_calls = [], []
+    _fake_encoder(first, first_calls)
+    _fake_encoder(second, second_calls)
+
+    vectors = first.encode(["banana", "abacaxi", "banana"])
+    assert first_calls == ["banana", "abacaxi"]
+    assert np.array_equal(vectors[0], vectors[2])
+
+    again = second.encode(["abacaxi", "banana", "uva"])
+    assert second_calls == ["uva"]
+    assert np.array_equal(again[:2], vectors[[1, 0]])
+    assert second.status()["disk_hits"] == 2
+
+    second.encode(["uva"])
+    assert second.status()["memory_hits"] == 1
+
+
+def test_counters_are_consistent_across_threads(workers):
+    service, _ = workers
+    _fake_encoder(service, [])
+    texts = [f"trecho {i}" for i in range(20)]
+    service.encode(texts)
+
+    def lookups():
+        for _ in range(50):
+            service._lookup([chunk_hash(text) for text in texts])
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert service.status()["memory_hits"] == 8 * 50 * len(texts)
+    assert service.status()["encoded"] == len(texts)
@@ -0,0 +1,133 @@
+# tests/test_gevent_smoke.py
+#
+# Teste de fumaça do servidor de produção: sobe o app no gunicorn com a
+# configuração do repositório (workers gevent) e faz uma chamada em
+# streaming ao servidor local (tools/stub_llm_server.py) pelo /process, no
+# modo atômico. Garante que o event loop do agendador de LLMs roda numa
+# thread de verdade e entrega os deltas às conexões SSE do worker.
+
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import threading
+import http.cookiejar
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from stub_llm_server import REPLY_TEXT, StubState, make_handler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_TIMEOUT = 60
+STREAM_TIMEOUT = 60
+
+
+def _gevent_stack_unavailable():
+    """Motivo para pular o teste se o gunicorn/gevent (ou o cliente HTTP sob gevent) não funciona neste ambiente."""
+    check = "from gevent import monkey; monkey.patch_all(); import gunicorn, httpx, httpcore, langchain_anthropic"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        return (result.stderr.strip().splitlines() or ["falha desconhecida"])[-1]
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stub(tmp_path):
+    state = StubState(str(tmp_path / "requests.jsonl"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gunicorn_app(tmp_path, stub):
+    reason = _gevent_stack_unavailable()
+    if reason:
+        pytest.skip(f"gevent indisponível neste ambiente: {reason}")
+
+    port = _free_port()
+    env = {
+        **os.environ,
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_WORKER_CLASS": "gevent",
+        "GUNICORN_WORKERS": "1",
+        "GUNICORN_PRELOAD": "0",
+        "SECRET_KEY": "teste",
+        "APP_USER": "usuario",
+        "APP_PASSWORD": "senha",
+        "ANTHROPIC_API_KEY": "stub",
+        "ANTHROPIC_API_URL": stub,
+        "CLAUDE_MODEL_ID": "claude-stub",
+        "EMBEDDING_WARMUP": "0",
+        "HF_HOME": str(tmp_path / "cache"),
+        "LIBRARY_DIR": str(tmp_path / "library"),
+    }
+    log_path = tmp_path / "gunicorn.log"
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "app:app"],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            try:
+                urllib.request.urlopen(f"{base_url}/login", timeout=5).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    pytest.fail(f"gunicorn não subiu:\n{log_path.read_text(errors='replace')[-4000:]}")
+                time.sleep(0.5)
+        yield base_url, log_path
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _sse_events(response):
+    """Eventos JSON (linhas 'data:') de uma resposta text/event-stream, até ela terminar."""
+    for raw in response:
+        line = raw.decode("utf-8").strip()
+        if line.startswith("data:"):
+            yield json.loads(line[len("data:"):].strip())
+
+
+def test_streaming_call_under_gevent_worker(gunicorn_app):
+    base_url, log_path = gunicorn_app
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    opener.open(f"{base_url}/login", urllib.parse.urlencode({"username": "usuario", "password": "senha"}).encode(), timeout=10).close()
+
+    form = {
+        "solicitacao": "Escreva um parágrafo de teste.",
+        "mode": "real",
+        "processing_mode": "atomic",
+        "modelo-sonnet": "on",
+        "streaming": "on",
+        "cache": "off",
+    }
+    with opener.open(f"{base_url}/process", urllib.parse.urlencode(form).encode(), timeout=STREAM_TIMEOUT) as response:
+        events = list(_sse_events(response))
+
+    errors = [e["error"] for e in events if "error" in e]
+    assert not errors, f"{errors}\n{log_path.read_text(errors='replace')[-4000:]}"
+    streamed = json.dumps(events, ensure_ascii=False)
+    # Os deltas do provedor chegaram pela conexão SSE do worker gevent
+    assert REPLY_TEXT.split(" ")[0] in streamed
+    assert any(e.get("done") for e in events)
@@ -0,0 +1,96 @@
+# tests/test_jobs.py
+#
+# Registro de jobs sobre um banco em tmp_path; dois JobRegistry com o mesmo
+# banco fazem o papel de dois workers do gunicorn.
+
+import json
+import threading
+
+import pytest
+
+import jobs
+from jobs import FINISHED, JobRegistry
+from sse import event
+
+
+@pytest.fixture
+def workers(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite")
+    return JobRegistry(db_path), JobRegistry(db_path)
+
+
+def test_cancel_unknown_job_returns_false(workers):
+    owner, other = workers
+    assert other.cancel("nao-existe") is False
+    assert other._execute("SELECT job_id FROM cancellations") == []
+
+
+def test_cancel_job_of_another_worker_is_registered(workers):
+    owner, other = workers
+    job = owner.create("process")
+
+    assert other.cancel(job.id) is True
+    assert other._execute("SELECT job_id FROM cancellations") == [(job.id,)]
+
+
+def test_cancel_finished_job_returns_false(workers):
+    owner, other = workers
+    job = owner.create("process")
+    owner.finish(job)
+
+    assert owner.cancel(job.id) is False
+    assert other.cancel(job.id) is False
+    assert other._execute("SELECT status FROM jobs WHERE id = ?", (job.id,)) == [(FINISHED,)]
+    assert other._execute("SELECT job_id FROM cancellations") == []
+
+
+def _parse(block):
+    """(id, dados) de um evento SSE enviado por JobRegistry.stream."""
+    lines = block.strip().split("\n")
+    assert lines[0].startswith("id: ")
+    return int(lines[0][len("id: "):]), json.loads(lines[1][len("data: "):])
+
+
+def test_reconnect_with_last_event_id_resumes_in_another_worker(workers, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_EVENT_POLL_INTERVAL", 0.01)
+    owner, other = workers
+    job = owner.create("process")
+    release = threading.Event()
+
+    def produce():
+        for step in range(5):
+            if step == 2:
+                # Metade dos eventos sai antes da "queda" da conexão
+                release.wait(5)
+            yield event({"step": step})
+
+    owner.start(job, produce())
+
+    # Primeira conexão (no worker dono) lê os dois primeiros eventos e cai
+    received = []
+    for block in owner.stream(job.id):
+        received.append(_parse(block))
+        if len(received) == 2:
+            break
+    last_event_id = received[-1][0]
+    release.set()
+
+    # Reconexão em outro worker a partir do último id recebido
+    resumed = [_parse(block) for block in other.stream(job.id, last_event_id)]
+
+    ids = [seq for seq, _ in received + resumed]
+    assert ids == list(range(1, len(ids) + 1))
+    assert [data["step"] for _, data in received + resumed] == [0, 1, 2, 3, 4]
+    assert other.status(job.id)["status"] == FINISHED
+    assert other.status(job.id)["last_event_id"] == ids[-1]
+
+
+def test_stream_after_finish_replays_only_missing_events(workers):
+    owner, other = workers
+    job = owner.create("process")
+    owner.start(job, iter([event({"step": step}) for step in range(3)]))
+    list(owner.stream(job.id))
+
+    assert [_parse(block)[1]["step"] for block in other.stream(job.id, 1)] == [1, 2]
+    assert list(other.stream(job.id, 3)) == []
+    assert list(other.stream("nao-existe")) == []
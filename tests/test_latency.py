@@ -0,0 +1,87 @@
+# tests/test_latency.py
+#
+# Histogramas de latência com amostras censuradas: chamadas que estouraram o
+# prazo, falharam ou foram canceladas contam como "levaria pelo menos t" e
+# não deixam p95/p99 (prazos adaptativos e hedging) abaixo do real.
+
+import asyncio
+import concurrent.futures
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+import llm_scheduler as llm_scheduler_module
+from latency import LATENCY_BINS, LatencyTracker, _bin_index, _percentile
+from llm_scheduler import LLMScheduler
+
+
+def _histogram(samples):
+    counts = [0.0] * len(LATENCY_BINS)
+    for seconds in samples:
+        counts[_bin_index(seconds)] += 1
+    return counts
+
+
+def test_percentile_without_censoring_is_the_plain_histogram_percentile():
+    counts = _histogram([1] * 50 + [5] * 45 + [30] * 5)
+    assert _percentile(counts, 0.5) == 1
+    assert _percentile(counts, 0.95) == 5
+    assert _percentile(counts, 0.99) == 30
+
+
+def test_censored_calls_raise_the_tail():
+    # 90 respostas rápidas e 10 chamadas que estouraram o prazo de 60s
+    observed = _histogram([5] * 90)
+    censored = _histogram([60] * 10)
+    # Ignorando as censuradas o p95 seria 5s; com elas, o p95 passa do prazo
+    assert _percentile(observed, 0.95) == 5
+    assert _percentile(observed, 0.95, censored) == LATENCY_BINS[-1]
+    assert _percentile(observed, 0.5, censored) == 5
+
+
+def test_censored_calls_weigh_only_from_their_bin_on():
+    observed = _histogram([2] * 40 + [8] * 40 + [120] * 20)
+    censored = _histogram([3] * 10)
+    # Quem parou em 3s ainda não tinha respondido em 2s: até ali respondeu 40/110...
+    assert _percentile(observed, 0.36, censored) == 2
+    # ...mas, das que passaram de 3s, uma parte maior estaria entre as lentas
+    assert _percentile(observed, 0.4) == 2
+    assert _percentile(observed, 0.4, censored) == 8
+    assert _percentile(observed, 0.8) == 8
+    assert _percentile(observed, 0.8, censored) == 120
+
+
+def test_tracker_records_censored_samples_shared_by_workers(tmp_path, monkeypatch):
+    path = str(tmp_path / "latency.sqlite")
+    writer = LatencyTracker(path)
+    for _ in range(18):
+        writer.record("grok", 100, 4)
+    for _ in range(2):
+        writer.record("grok", 100, 60, censored=True)
+    writer._store.submit(lambda: None).result()
+
+    reader = LatencyTracker(path)
+    status = reader.status()["providers"]["grok"]["<4k"]
+    assert (status["samples"], status["censored"]) == (18, 2)
+    assert status["p50"] == 5
+    assert status["p95"] == LATENCY_BINS[-1]
+
+
+def test_scheduler_records_timeouts_as_censored(tmp_path, monkeypatch):
+    tracker = LatencyTracker(str(tmp_path / "latency.sqlite"))
+    monkeypatch.setattr(llm_scheduler_module, "latency_tracker", tracker)
+    monkeypatch.setattr(llm_scheduler_module, "LLM_CACHE_ENABLED", False)
+    scheduler = LLMScheduler(max_concurrency=2)
+
+    async def slow(_):
+        await asyncio.sleep(1)
+        return "tarde"
+
+    chain = RunnableLambda(lambda _: "ok", afunc=slow)
+    with pytest.raises((TimeoutError, concurrent.futures.TimeoutError)):
+        scheduler.invoke(chain, {"pergunta": "x"}, timeout=0.1, provider="teste-latencia")
+    fast = RunnableLambda(lambda _: "ok", afunc=lambda _: asyncio.sleep(0, "ok"))
+    assert scheduler.invoke(fast, {"pergunta": "x"}, provider="teste-latencia") == "ok"
+
+    observed, censored = tracker._histograms[("teste-latencia", 0)]
+    assert (sum(observed), sum(censored)) == (1, 1)
@@ -0,0 +1,101 @@
+# tests/test_llm_cache.py
+#
+# Single-flight do cache de respostas: pedidos idênticos no mesmo processo
+# dividem uma só chamada (e os deltas), e entre workers a reserva no banco
+# faz o segundo esperar a resposta gravada pelo primeiro. Uma reserva de um
+# worker morto não trava a chave.
+
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMResponseCache
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_POLL_INTERVAL", 0.02)
+
+
+def _provider(calls, pieces=("Olá", ", ", "mundo"), delay=0.05):
+    """`compute` falso: publica os deltas com uma pausa entre eles e conta as chamadas."""
+    async def compute(publish):
+        calls.append(time.monotonic())
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            publish(piece)
+        return "".join(pieces)
+    return compute
+
+
+def test_identical_calls_in_one_process_share_a_single_flight(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    calls = []
+    first_pieces, second_pieces = [], []
+
+    async def scenario():
+        compute = _provider(calls)
+        first = asyncio.ensure_future(cache.run("k", compute, first_pieces.append))
+        await asyncio.sleep(0.07)  # o segundo pedido chega com a chamada já em andamento
+        second = asyncio.ensure_future(cache.run("k", compute, second_pieces.append))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == ["Olá, mundo", "Olá, mundo"]
+    assert len(calls) == 1
+    assert "".join(first_pieces) == "Olá, mundo"
+    # Quem chega depois recebe o que já saiu de uma vez e o resto em deltas
+    assert "".join(second_pieces) == "Olá, mundo"
+    assert cache.stats["misses"] == 1 and cache.stats["coalesced"] == 1
+
+    # A resposta gravada atende o pedido seguinte sem chamar o provedor
+    assert asyncio.run(cache.run("k", _provider(calls))) == "Olá, mundo"
+    assert len(calls) == 1 and cache.stats["hits"] == 1
+
+
+def test_second_worker_waits_for_the_lease_holder(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    worker_a, worker_b = LLMResponseCache(path), LLMResponseCache(path)
+    calls_a, calls_b = [], []
+
+    async def scenario():
+        first = asyncio.ensure_future(worker_a.run("k", _provider(calls_a, delay=0.1)))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(worker_b.run("k", _provider(calls_b)))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == ["Olá, mundo", "Olá, mundo"]
+    assert len(calls_a) == 1 and calls_b == []
+    assert worker_b.stats["coalesced"] == 1
+
+
+def test_wait_for_other_worker_respects_the_timeout(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    worker_a, worker_b = LLMResponseCache(path), LLMResponseCache(path)
+
+    async def scenario():
+        first = asyncio.ensure_future(worker_a.run("k", _provider([], delay=0.5)))
+        await asyncio.sleep(0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await worker_b.run("k", _provider([]), timeout=0.1)
+        first.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_lease_of_a_dead_worker_is_taken_over(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with cache._store.connection() as conn:
+        conn.execute(
+            "INSERT INTO leases (key, pid, expires_at) VALUES (?, ?, ?)",
+            ("k", dead.pid, time.time() + 3600),
+        )
+    calls = []
+
+    assert asyncio.run(cache.run("k", _provider(calls), timeout=5)) == "Olá, mundo"
+    assert len(calls) == 1
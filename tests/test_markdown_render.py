@@ -0,0 +1,62 @@
+# tests/test_markdown_render.py
+#
+# Conversão bloco a bloco com cache: o HTML montado a partir dos blocos é o
+# mesmo da conversão do documento inteiro pelo MarkdownIt, e converter de
+# novo um texto que só cresceu no fim converte apenas os blocos novos.
+
+import pytest
+from markdown_it import MarkdownIt
+
+from markdown_render import MarkdownRenderer, split_blocks
+
+DOCUMENTS = {
+    "paragrafos": "# Título\n\nPrimeiro parágrafo com *ênfase*.\n\n\nSegundo parágrafo\ncom duas linhas.\n",
+    "lista_frouxa": "- item um\n\n- item dois\n\n  continuação recuada\n\n1. outro\n2. tipo\n\nFim.\n",
+    "codigo_cercado": "Antes\n\n```python\ndef f():\n\n    return 1\n```\n\n~~~\n```\n\ntexto\n~~~\n\nDepois\n",
+    "codigo_recuado": "Texto\n\n    código recuado\n\n    mais código\n\nTexto final\n",
+    "tabela_e_citacao": "| a | b |\n|---|---|\n| 1 | 2 |\n\n> citação\n> longa\n\n> outra citação\n",
+    "referencias": "Veja [o site][ref].\n\n[ref]: https://example.com\n",
+    "html_bruto": "<pre>\nlinha\n\noutra\n</pre>\n\nTexto\n",
+    "titulos_setext": "Título\n======\n\nSubtítulo\n---------\n\n***\n\nFim\n",
+}
+
+
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_block_rendering_matches_whole_document(name):
+    text = DOCUMENTS[name]
+    renderer = MarkdownRenderer()
+    expected = MarkdownIt().render(text)
+
+    assert renderer.render(text) == expected
+    # Segunda conversão vem toda do cache e dá o mesmo HTML
+    rendered = renderer.stats["blocks_rendered"]
+    assert renderer.render(text) == expected
+    assert renderer.stats["blocks_rendered"] == rendered
+
+
+def test_growing_stream_renders_only_new_blocks():
+    renderer = MarkdownRenderer()
+    paragraphs = [f"Parágrafo {i} da resposta." for i in range(10)]
+    text = ""
+    for i, paragraph in enumerate(paragraphs):
+        text += paragraph + "\n\n"
+        assert renderer.render(text) == MarkdownIt().render(text)
+        assert renderer.stats["blocks_rendered"] == i + 1
+
+
+def test_blocks_keep_every_non_blank_line_in_order():
+    for text in DOCUMENTS.values():
+        blocks = split_blocks(text)
+        assert all(block.strip() for block in blocks)
+        assert [line for line in "".join(blocks).splitlines() if line.strip()] == [
+            line for line in text.splitlines() if line.strip()
+        ]
+
+
+def test_cache_is_bounded():
+    renderer = MarkdownRenderer(max_chars=200)
+    for i in range(50):
+        renderer.render(f"Parágrafo número {i}.\n")
+    status = renderer.status()
+    assert status["cached_chars"] <= 200
+    assert status["evictions"] > 0
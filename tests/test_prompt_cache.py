@@ -0,0 +1,70 @@
+# tests/test_prompt_cache.py
+#
+# Cache de prompt da Anthropic contra o servidor local
+# (tools/stub_llm_server.py): o prefixo estável vai num bloco com
+# `cache_control` e a marca CACHE_BREAK não chega ao provedor; o uso devolvido
+# é gravação no cache na primeira chamada e leitura na segunda.
+
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+from langchain_anthropic import ChatAnthropic
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from prompt_cache import CACHE_BREAK, PromptCacheUsage, prefix_cached
+from stub_llm_server import REPLY_TEXT, StubState, make_handler
+
+TEMPLATE = "Documentos de referência:\n{documentos}\n" + CACHE_BREAK + "\nPergunta: {pergunta}"
+DOCUMENTS = "Um texto longo e estável, repetido entre as chamadas. " * 20
+
+
+@pytest.fixture
+def stub(tmp_path):
+    log_path = tmp_path / "requests.jsonl"
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(StubState(str(log_path))))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", log_path
+    server.shutdown()
+    server.server_close()
+
+
+def _recorded_bodies(log_path):
+    with open(log_path, encoding="utf-8") as log:
+        return [entry["body"] for entry in map(json.loads, log) if entry["path"].startswith("/v1/messages")]
+
+
+def test_prefix_block_is_cached_between_calls(stub):
+    url, log_path = stub
+    usage = PromptCacheUsage("claude")
+    llm = ChatAnthropic(api_key="stub", model_name="claude-stub", anthropic_api_url=url, max_retries=0, callbacks=[usage])
+    chain = PromptTemplate.from_template(TEMPLATE) | prefix_cached(llm) | StrOutputParser()
+
+    first = chain.invoke({"documentos": DOCUMENTS, "pergunta": "Qual é o tema?"})
+    after_first = dict(usage.totals)
+    second = chain.invoke({"documentos": DOCUMENTS, "pergunta": "Resuma em uma frase."})
+
+    assert first.strip() == second.strip() == (REPLY_TEXT * 3).strip()
+
+    bodies = _recorded_bodies(log_path)
+    assert len(bodies) == 2
+    for body, question in zip(bodies, ("Qual é o tema?", "Resuma em uma frase.")):
+        blocks = body["messages"][0]["content"]
+        assert blocks[0]["cache_control"] == {"type": "ephemeral"}
+        assert DOCUMENTS.strip() in blocks[0]["text"]
+        assert "cache_control" not in blocks[1]
+        assert question in blocks[1]["text"]
+        assert all(CACHE_BREAK not in block["text"] for block in blocks)
+
+    # O prefixo enviado é idêntico nas duas chamadas
+    assert bodies[0]["messages"][0]["content"][0] == bodies[1]["messages"][0]["content"][0]
+
+    # Primeira chamada grava o prefixo; a segunda o lê do cache
+    assert after_first["cache_creation"] > 0
+    assert after_first["cache_read"] == 0
+    assert usage.totals["cache_read"] == after_first["cache_creation"]
+    assert usage.totals["cache_creation"] == after_first["cache_creation"]
+    assert usage.totals["calls"] == 2
+    assert usage.stats()["cache_read_ratio"] > 0
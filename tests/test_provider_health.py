@@ -0,0 +1,142 @@
+# tests/test_provider_health.py
+#
+# Disjuntor por provedor: abre após falhas seguidas, recusa chamadas na hora
+# enquanto aberto, deixa passar uma chamada de teste depois do intervalo e
+# fecha (ou reabre, por mais tempo) conforme o resultado do teste. Só erros
+# do provedor contam como falha; erros do pedido passam direto.
+
+import time
+
+import httpx
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+import provider_health
+from provider_health import CLOSED, HALF_OPEN, OPEN, HealthTracker, ProviderUnavailable, is_provider_failure, with_health
+
+OPEN_SECONDS = 0.1
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(provider_health, "BREAKER_CONSECUTIVE_FAILURES", 3)
+    monkeypatch.setattr(provider_health, "BREAKER_OPEN_SECONDS", OPEN_SECONDS)
+    monkeypatch.setattr(provider_health, "BREAKER_MAX_OPEN_SECONDS", OPEN_SECONDS * 4)
+    monkeypatch.setattr(provider_health, "BREAKER_HALF_OPEN_PROBES", 1)
+    return HealthTracker()
+
+
+def _fail(tracker, times=1):
+    for _ in range(times):
+        tracker.before_call("grok")
+        tracker.record_failure("grok", TimeoutError("prazo excedido"))
+
+
+def _state(tracker):
+    return tracker.status()["grok"]["state"]
+
+
+def test_opens_after_consecutive_failures_and_rejects_calls(tracker):
+    _fail(tracker, 2)
+    assert _state(tracker) == CLOSED
+    _fail(tracker)
+    assert _state(tracker) == OPEN
+    assert not tracker.available("grok")
+
+    with pytest.raises(ProviderUnavailable):
+        tracker.before_call("grok")
+    assert tracker.status()["grok"]["rejected"] == 1
+
+
+def test_successful_probe_closes_the_circuit(tracker):
+    _fail(tracker, 3)
+    time.sleep(OPEN_SECONDS * 1.5)
+    assert tracker.available("grok")
+
+    tracker.before_call("grok")
+    assert _state(tracker) == HALF_OPEN
+    # Só uma chamada de teste por vez no estado meio-aberto
+    with pytest.raises(ProviderUnavailable):
+        tracker.before_call("grok")
+
+    tracker.record_success("grok", 0.2)
+    status = tracker.status()["grok"]
+    assert status["state"] == CLOSED
+    assert status["consecutive_failures"] == 0
+    tracker.before_call("grok")
+
+
+def test_failed_probe_reopens_for_longer(tracker):
+    _fail(tracker, 3)
+    time.sleep(OPEN_SECONDS * 1.5)
+    _fail(tracker)
+    assert _state(tracker) == OPEN
+    # O intervalo dobrou: passado o intervalo original, o circuito segue aberto
+    time.sleep(OPEN_SECONDS * 1.5)
+    assert not tracker.available("grok")
+    time.sleep(OPEN_SECONDS)
+    assert tracker.available("grok")
+
+
+def test_cancelled_probe_frees_the_slot(tracker):
+    _fail(tracker, 3)
+    time.sleep(OPEN_SECONDS * 1.5)
+    tracker.before_call("grok")
+    tracker.record_cancelled("grok")
+    assert _state(tracker) == HALF_OPEN
+    tracker.before_call("grok")
+
+
+class _APIError(Exception):
+    """Erro de SDK com o status HTTP em `status_code` (como anthropic/openai)."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _wrapped(error):
+    """Erro embrulhado como o cliente da Grok faz (raise ValueError(...) from e)."""
+    try:
+        raise ValueError("Erro na chamada da API") from error
+    except ValueError as wrapper:
+        return wrapper
+
+
+@pytest.mark.parametrize("error, failure", [
+    (TimeoutError("prazo"), True),
+    (httpx.ConnectError("recusada"), True),
+    (_APIError(429), True),
+    (_APIError(503), True),
+    (_wrapped(httpx.ReadTimeout("lento")), True),
+    (_APIError(400), False),
+    (_APIError(404), False),
+    (_wrapped(_APIError(413)), False),
+    (ValueError("prompt is too long"), False),
+])
+def test_only_provider_errors_count_as_failures(error, failure):
+    assert is_provider_failure(error) is failure
+
+
+def test_request_errors_do_not_open_the_circuit(tracker, monkeypatch):
+    monkeypatch.setattr(provider_health, "health_tracker", tracker)
+
+    def reject(_):
+        raise _APIError(400)
+
+    guarded = with_health(RunnableLambda(reject), "grok")
+    for _ in range(5):
+        with pytest.raises(_APIError):
+            guarded.invoke("oi")
+    status = tracker.status()["grok"]
+    assert status["state"] == CLOSED
+    assert status["failures"] == 0
+
+    def overloaded(_):
+        raise _APIError(529)
+
+    guarded = with_health(RunnableLambda(overloaded), "grok")
+    for _ in range(3):
+        with pytest.raises(_APIError):
+            guarded.invoke("oi")
+    assert _state(tracker) == OPEN
@@ -0,0 +1,124 @@
+# tests/test_rag_extraction.py
+#
+# Extração dos documentos enviados no pool de processos: os resultados, o
+# progresso e a leitura em streaming seguem a ordem original dos arquivos,
+# mesmo quando as tarefas terminam fora de ordem.
+
+import os
+import time
+
+import pytest
+
+import rag_processor
+from document_cache import DocumentCache
+
+# Atrasos por arquivo: o primeiro termina por último no pool
+DELAYS = {"a.txt": 0.6, "b.txt": 0.3, "c.txt": 0.0, "d.txt": 0.1}
+
+
+def _slow_pages(file_path, part, delay):
+    """Extração falsa (executada nos processos do pool): duas páginas por tarefa."""
+    time.sleep(delay)
+    name = os.path.basename(file_path)
+    return [f"{name}:{part}:1", f"{name}:{part}:2"]
+
+
+def _fake_tasks(file_path):
+    name = os.path.basename(file_path)
+    # "a.txt" é dividido em duas faixas, como um PDF grande
+    parts = 2 if name == "a.txt" else 1
+    return [(_slow_pages, (file_path, part, DELAYS[name])) for part in range(parts)]
+
+
+def _expected_pages(name):
+    parts = 2 if name == "a.txt" else 1
+    return [f"{name}:{part}:{page}" for part in range(parts) for page in (1, 2)]
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_processor, "document_cache", DocumentCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(rag_processor, "_extraction_tasks", _fake_tasks)
+    monkeypatch.setattr(rag_processor, "RAG_EXTRACTION_WORKERS", 2)
+    monkeypatch.setattr(rag_processor, "RAG_EXTRACTION_LOOKAHEAD", 4)
+    rag_processor._reset_extraction_pool()
+    paths = []
+    for name in DELAYS:
+        path = tmp_path / name
+        path.write_text(f"conteúdo de {name}", encoding="utf-8")
+        paths.append(str(path))
+    yield paths
+    rag_processor._reset_extraction_pool()
+
+
+def test_extract_documents_keeps_original_order(files):
+    progress = []
+    results, errors = rag_processor._extract_documents(files, lambda done, total, name: progress.append((done, total, name)))
+
+    assert rag_processor._extraction_pool is not None
+    assert errors == {}
+    assert [pages for _, pages in results] == [_expected_pages(name) for name in DELAYS]
+    assert progress == [(i + 1, len(DELAYS), name) for i, name in enumerate(DELAYS)]
+
+
+def test_second_read_comes_from_cache(files, monkeypatch):
+    first, _ = rag_processor._extract_documents(files)
+    rag_processor._reset_extraction_pool()
+    monkeypatch.setattr(rag_processor, "RAG_EXTRACTION_WORKERS", 0)
+    monkeypatch.setattr(rag_processor, "_extraction_tasks", None)  # qualquer extração falharia
+
+    second, errors = rag_processor._extract_documents(files)
+
+    assert errors == {}
+    assert second == first
+
+
+def test_iter_documents_streams_in_order_and_skips_unsupported(files, tmp_path):
+    other = tmp_path / "notas.xyz"
+    other.write_text("ignorado", encoding="utf-8")
+    paths = files[:2] + [str(other)] + files[2:]
+    progress = []
+
+    documents = rag_processor._iter_documents(paths, lambda done, total, name: progress.append(name))
+    seen = [list(pages) for _, pages in documents]
+
+    assert seen == [_expected_pages(name) for name in DELAYS]
+    assert progress == ["a.txt", "b.txt", "notas.xyz", "c.txt", "d.txt"]
+
+
+def test_stream_full_text_stops_at_budget_and_reports_every_file(files):
+    progress = []
+    budget = len("a.txt:0:1") + len("a.txt:0:2") + 3
+
+    text = rag_processor.stream_full_text(files, budget, lambda done, total, name: progress.append((done, name)))
+
+    assert text == "a.txt:0:1\n\na.txt:0:2\n\na.t"
+    assert progress == [(i + 1, name) for i, name in enumerate(DELAYS)]
+
+
+def test_failed_file_is_reported_and_the_rest_still_arrive(files, monkeypatch):
+    def tasks(file_path):
+        if file_path.endswith("b.txt"):
+            return [(_missing_file, (file_path,))]
+        return _fake_tasks(file_path)
+
+    monkeypatch.setattr(rag_processor, "_extraction_tasks", tasks)
+    results, errors = rag_processor._extract_documents(files)
+
+    assert list(errors) == ["b.txt"]
+    assert [pages for _, pages in results] == [_expected_pages(name) for name in DELAYS if name != "b.txt"]
+
+
+def _missing_file(file_path):
+    raise FileNotFoundError(file_path)
+
+
+def test_retrieval_mode_reads_documents_from_the_pool_in_order(files, monkeypatch):
+    # Tudo cabe no orçamento: o texto volta inteiro, na ordem, sem recuperação vetorial
+    monkeypatch.setattr(rag_processor, "retrieve_chunks", None)
+    progress = []
+
+    context = rag_processor._retrieve_context(files, "pergunta", lambda done, total, name: progress.append(name), ())
+
+    assert context == "\n\n".join("\n\n".join(_expected_pages(name)) for name in DELAYS)
+    assert progress == list(DELAYS)
@@ -0,0 +1,115 @@
+# tests/test_rate_limit.py
+#
+# Cota por provedor em SQLite, compartilhada pelos workers: balde de fichas
+# com rajada limitada, limite de chamadas simultâneas, fila por ordem de
+# chegada (com a posição informada a quem espera) e vagas de processos
+# mortos devolvidas à cota.
+
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BURST_SECONDS", 0.2)
+
+    def configure(rpm=6000, max_in_flight=8):
+        monkeypatch.setattr(rate_limit, "RATE_LIMIT_RPM", {"grok": rpm})
+        monkeypatch.setattr(rate_limit, "RATE_LIMIT_MAX_IN_FLIGHT", {"grok": max_in_flight})
+    return configure
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Dois limitadores no mesmo banco, como dois workers do gunicorn."""
+    path = str(tmp_path / "rate_limit.sqlite")
+    return RateLimiter(path), RateLimiter(path)
+
+
+def test_bucket_allows_the_burst_then_refills(limits, workers, monkeypatch):
+    # 120 por minuto com 1 s de rajada: 2 fichas, repostas a 2 por segundo
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BURST_SECONDS", 1)
+    limits(rpm=120)
+    first, second = workers
+
+    async def scenario():
+        started = time.monotonic()
+        await first.acquire("grok:modelo")
+        await second.acquire("grok:modelo")
+        burst = time.monotonic() - started
+        await first.acquire("grok:modelo")
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.3
+    assert total >= 0.45
+
+
+def test_waiters_are_served_in_arrival_order(limits, workers):
+    limits(max_in_flight=1)
+    first, second = workers
+    served, positions = [], {}
+
+    async def scenario():
+        holder = await first.acquire("grok:modelo")
+
+        async def wait(name, limiter):
+            lease = await limiter.acquire("grok:modelo", lambda key, position: positions.setdefault(name, []).append(position))
+            served.append(name)
+            await asyncio.sleep(0.02)
+            limiter.release(lease)
+
+        tasks = []
+        for name, limiter in (("a", second), ("b", first), ("c", second)):
+            tasks.append(asyncio.ensure_future(wait(name, limiter)))
+            await asyncio.sleep(0.03)  # entra na fila antes do próximo
+        first.release(holder)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert served == ["a", "b", "c"]
+    # Cada um soube a sua posição na chegada e foi avisado ao sair da fila
+    assert [positions[name][0] for name in served] == [1, 2, 3]
+    assert all(positions[name][-1] == 0 for name in served)
+    assert first.status()["quotas"]["grok:modelo"]["waiting"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue(limits, workers):
+    limits(max_in_flight=1)
+    first, second = workers
+
+    async def scenario():
+        holder = await first.acquire("grok:modelo")
+        waiter = asyncio.ensure_future(second.acquire("grok:modelo"))
+        await asyncio.sleep(0.03)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.03)
+        first.release(holder)
+        # O lugar do cancelado não trava a fila
+        return await asyncio.wait_for(first.acquire("grok:modelo"), 1)
+
+    assert asyncio.run(scenario()) is not None
+
+
+def test_leases_of_dead_workers_return_to_the_quota(limits, workers):
+    limits(max_in_flight=1)
+    limiter, _ = workers
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    limiter._store.connection().execute(
+        "INSERT INTO leases (id, key, pid, acquired_at) VALUES (?, ?, ?, ?)",
+        ("esquecida", "grok:modelo", dead.pid, time.time()),
+    )
+
+    assert asyncio.run(asyncio.wait_for(limiter.acquire("grok:modelo"), 1)) is not None
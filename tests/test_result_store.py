@@ -0,0 +1,62 @@
+# tests/test_result_store.py
+#
+# Resultados em SQLite compartilhado: leituras parciais, último acesso
+# regravado no máximo uma vez por RESULTS_TOUCH_INTERVAL e remoção por
+# tamanho a cada RESULTS_EVICT_EVERY gravações, pelo último acesso.
+
+import time
+
+import result_store
+from result_store import ResultStore
+
+
+def _accessed_at(store, output_id):
+    return store._store.connection().execute(
+        "SELECT accessed_at FROM results WHERE job_id = 'job' AND output_id = ?", (output_id,)
+    ).fetchone()[0]
+
+
+def test_partial_reads_from_another_worker(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    ResultStore(path).put("job", "sonnet-output", "ação " * 1000)
+    reader = ResultStore(path)
+
+    assert reader.get("job", "sonnet-output", 5, 5) == ("ação ", 5000)
+    assert reader.get("job", "sonnet-output", 4990) == ("ação ação ", 5000)
+    assert reader.get("job", "openai-output") is None
+    assert (reader.stats["reads"], reader.stats["misses"]) == (2, 1)
+    assert reader.list_outputs("job")[0]["id"] == "sonnet-output"
+
+
+def test_access_time_is_rewritten_at_most_once_per_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "RESULTS_TOUCH_INTERVAL", 0.2)
+    store = ResultStore(str(tmp_path / "results.sqlite"))
+    store.put("job", "final-output", "texto")
+    written = _accessed_at(store, "final-output")
+
+    for _ in range(3):
+        store.get("job", "final-output")
+    assert _accessed_at(store, "final-output") == written
+
+    time.sleep(0.25)
+    store.get("job", "final-output")
+    assert _accessed_at(store, "final-output") > written
+
+
+def test_eviction_runs_every_n_writes_and_keeps_recently_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "RESULTS_EVICT_EVERY", 4)
+    monkeypatch.setattr(result_store, "RESULTS_MAX_BYTES", 250)
+    monkeypatch.setattr(result_store, "RESULTS_TOUCH_INTERVAL", 0)
+    store = ResultStore(str(tmp_path / "results.sqlite"))
+
+    for i in range(3):
+        store.put("job", f"out-{i}", "x" * 100)
+        time.sleep(0.01)
+    store.get("job", "out-0")
+    # Acima do limite, mas a remoção só roda na quarta gravação
+    assert store.status()["entries"] == 3
+
+    store.put("job", "out-3", "x" * 100)
+    remaining = {output["id"] for output in store.list_outputs("job")}
+    assert remaining == {"out-0", "out-3"}
+    assert store.stats["evictions"] == 2
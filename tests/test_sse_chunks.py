@@ -0,0 +1,72 @@
+# tests/test_sse_chunks.py
+#
+# Resultados grandes em eventos 'chunk' numerados: remontando as partes como
+# a página faz, o texto (ou o que falta depois dos deltas) volta inteiro e o
+# CRC32 do evento final confere; partes perdidas ou trocadas não conferem.
+
+import json
+import zlib
+
+from sse import ResultChunks, StreamedOutputs, event
+
+# Acentos e emoji: caracteres de 2 e 4 bytes em UTF-8 nas bordas das partes
+TEXT = "".join(f"Linha {i}: ação, coração e 🚀 — {'x' * (i % 7)}\n" for i in range(200))
+
+
+def _crc32(text):
+    return f"{zlib.crc32(text.encode('utf-8')):08x}"
+
+
+def _send(result, chunk_chars):
+    """Eventos como saem no stream (JSON decodificado) e o resultado final."""
+    chunks = ResultChunks(result, chunk_chars)
+    events = [json.loads(event(chunk)[len("data: "):]) for chunk in chunks]
+    return [e["chunk"] for e in events], chunks.result
+
+
+def _reassemble(parts, result, streamed=""):
+    """A remontagem da página (resultContent em templates/index.html)."""
+    received = [part["content"] for part in sorted(parts, key=lambda part: part["index"])]
+    body = "".join(received)
+    if len(received) != result["chunked"]["count"] or _crc32(body) != result["chunked"]["crc32"]:
+        return None
+    return streamed + body if result["chunked"]["append"] else body
+
+
+def test_large_result_is_reassembled_and_verified():
+    parts, result = _send({"id": "grok-output", "content": TEXT}, 997)
+
+    assert len(parts) == result["chunked"]["count"] > 1
+    assert [part["index"] for part in parts] == list(range(len(parts)))
+    assert "content" not in result
+    assert result["chunked"]["chars"] == len(TEXT)
+    assert result["chunked"]["crc32"] == _crc32(TEXT)
+    # Fora de ordem também remonta (a página guarda cada parte pelo índice)
+    assert _reassemble(list(reversed(parts)), result) == TEXT
+
+
+def test_chunks_complete_the_streamed_text():
+    streamed = StreamedOutputs()
+    sent = TEXT[:5000]
+    streamed.delta("grok-output", sent)
+    parts, result = _send(streamed.result("grok-output", TEXT), 1000)
+
+    assert result["chunked"]["append"] is True
+    assert result["chunked"]["crc32"] == _crc32(TEXT[5000:])
+    assert _reassemble(parts, result, sent) == TEXT
+
+
+def test_missing_or_corrupted_parts_are_rejected():
+    parts, result = _send({"id": "grok-output", "content": TEXT}, 1000)
+
+    assert _reassemble(parts[:-1], result) is None
+    corrupted = [dict(part) for part in parts]
+    corrupted[1]["content"] = corrupted[1]["content"].replace("ação", "acao", 1)
+    assert _reassemble(corrupted, result) is None
+
+
+def test_small_result_is_sent_whole():
+    parts, result = _send({"id": "grok-output", "content": "curto"}, 1000)
+
+    assert parts == []
+    assert result == {"id": "grok-output", "content": "curto"}
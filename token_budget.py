@@ -0,0 +1,125 @@
+# token_budget.py
+
+import os
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Tuple
+
+# --- Limites por provedor (ajustáveis por variáveis de ambiente) ---
+# chars_per_token é a média de caracteres por token medida em textos em
+# português para cada família de tokenizador; funciona como estimador
+# calibrado, sem depender de bibliotecas de tokenização.
+
+PROVIDER_LIMITS = {
+    "openai": {
+        "context_window": int(os.getenv("OPENAI_CONTEXT_WINDOW", 128000)),
+        "max_output_tokens": int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", 16384)),
+        "chars_per_token": float(os.getenv("OPENAI_CHARS_PER_TOKEN", 3.8)),
+    },
+    "claude": {
+        "context_window": int(os.getenv("CLAUDE_CONTEXT_WINDOW", 200000)),
+        "max_output_tokens": int(os.getenv("CLAUDE_MAX_OUTPUT_TOKENS", 64000)),
+        "chars_per_token": float(os.getenv("CLAUDE_CHARS_PER_TOKEN", 3.2)),
+    },
+    "gemini": {
+        "context_window": int(os.getenv("GEMINI_CONTEXT_WINDOW", 1048576)),
+        "max_output_tokens": int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", 65536)),
+        "chars_per_token": float(os.getenv("GEMINI_CHARS_PER_TOKEN", 4.0)),
+    },
+}
+
+# Fração da janela reservada para erros de estimativa
+BUDGET_SAFETY_MARGIN = float(os.getenv("BUDGET_SAFETY_MARGIN", 0.05))
+# Textos em português têm cerca de 18% de espaços sobre os caracteres sem espaço
+SPACES_FACTOR = 1.18
+
+TRIM_MARKER = "\n\n[... conteúdo reduzido para caber na janela de contexto do modelo ...]"
+
+
+@dataclass
+class BudgetDecision:
+    """Resultado do ajuste de um prompt à janela de contexto de um provedor."""
+    provider: str
+    context_window: int
+    prompt_tokens: int
+    max_tokens: int
+    requested_max_tokens: int
+    trimmed_chars: Dict[str, int] = field(default_factory=dict)
+    fits: bool = True
+
+    def describe(self) -> str:
+        trimmed = ", ".join(f"{name}: -{chars} chars" for name, chars in self.trimmed_chars.items()) or "nenhum corte"
+        return (
+            f"[token_budget] {self.provider}: prompt={self.prompt_tokens} tokens, "
+            f"saída={self.max_tokens} (pedido {self.requested_max_tokens}), "
+            f"janela={self.context_window}, {trimmed}, cabe={'sim' if self.fits else 'não'}"
+        )
+
+
+def count_tokens(text: str, provider: str) -> int:
+    """Estima o número de tokens de `text` no tokenizador do provedor."""
+    return math.ceil(len(text) / PROVIDER_LIMITS[provider]["chars_per_token"])
+
+
+def output_tokens_for_chars(max_chars: int, provider: str) -> int:
+    """Converte um tamanho de texto (sem espaços) em tokens de saída estimados."""
+    return math.ceil(max_chars * SPACES_FACTOR / PROVIDER_LIMITS[provider]["chars_per_token"])
+
+
+def _trim(text: str, chars_to_remove: int) -> str:
+    keep = max(0, len(text) - chars_to_remove - len(TRIM_MARKER))
+    return text[:keep] + TRIM_MARKER
+
+
+def fit_prompt(
+    provider: str,
+    template: str,
+    variables: Dict[str, str],
+    max_tokens: Optional[int] = None,
+    min_output_tokens: int = 0,
+    trimmable: Iterable[str] = ("rag_context", "texto_para_analise"),
+) -> Tuple[Dict[str, str], int, BudgetDecision]:
+    """
+    Ajusta as variáveis de um prompt e o `max_tokens` de saída para que
+    prompt + saída caibam na janela do provedor.
+
+    Primeiro reduz `max_tokens` até `min_output_tokens`; se ainda não couber,
+    corta o final dos campos em `trimmable`, proporcionalmente ao tamanho de
+    cada um. Devolve as variáveis ajustadas, o `max_tokens` final e a decisão
+    (que também é registrada no log).
+    """
+    limits = PROVIDER_LIMITS[provider]
+    window = int(limits["context_window"] * (1 - BUDGET_SAFETY_MARGIN))
+    requested = min(max_tokens or limits["max_output_tokens"], limits["max_output_tokens"])
+    min_output_tokens = min(min_output_tokens, requested)
+
+    variables = dict(variables)
+    prompt_tokens = count_tokens(template.format(**variables), provider)
+    output_tokens = min(requested, max(min_output_tokens, window - prompt_tokens))
+    trimmed_chars: Dict[str, int] = {}
+
+    excess_tokens = prompt_tokens + output_tokens - window
+    if excess_tokens > 0:
+        fields = [name for name in trimmable if variables.get(name)]
+        total_chars = sum(len(variables[name]) for name in fields)
+        excess_chars = math.ceil(excess_tokens * limits["chars_per_token"])
+        for name in fields:
+            share = math.ceil(excess_chars * len(variables[name]) / total_chars) if total_chars else 0
+            if share <= 0:
+                continue
+            original_length = len(variables[name])
+            variables[name] = _trim(variables[name], share)
+            trimmed_chars[name] = original_length - len(variables[name])
+        prompt_tokens = count_tokens(template.format(**variables), provider)
+
+    decision = BudgetDecision(
+        provider=provider,
+        context_window=limits["context_window"],
+        prompt_tokens=prompt_tokens,
+        max_tokens=output_tokens,
+        requested_max_tokens=requested,
+        trimmed_chars=trimmed_chars,
+        fits=prompt_tokens + output_tokens <= window,
+    )
+    print(decision.describe(), flush=True)
+    return variables, output_tokens, decision
@@ -0,0 +1,90 @@
+# tools/startup_benchmark.py
+#
+# Mede o tempo de importação do app (o que cada worker do gunicorn paga ao
+# subir ou reiniciar) em processos novos, lista os pacotes que mais pesam
+# (python -X importtime) e compara a mediana com o orçamento. Sai com código
+# 1 se o orçamento for estourado, para poder rodar no CI ou antes do deploy.
+# Com --history, acrescenta o resultado a um arquivo JSONL para acompanhar a
+# evolução entre versões.
+#
+# Uso:
+#   python tools/startup_benchmark.py --runs 5 --budget 4
+#   python tools/startup_benchmark.py --history startup_history.jsonl
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str, env) -> tuple:
+    """Importa `module` num processo novo; devolve (segundos, {pacote: segundos acumulados})."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"A importação de {module} falhou:\n{proc.stderr[-2000:]}")
+    packages = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        # Só o que o módulo importa diretamente (um nível de recuo abaixo dele):
+        # o tempo acumulado de cada um já inclui os seus submódulos
+        if match and len(match.group(3)) == 3:
+            name = match.group(4).split(".")[0]
+            packages[name] = packages.get(name, 0.0) + int(match.group(2)) / 1e6
+    return float(proc.stdout.strip().splitlines()[-1]), packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de importação do app contra um orçamento.")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET_SECONDS", 5)),
+                        help="tempo máximo (mediana, em segundos)")
+    parser.add_argument("--top", type=int, default=10, help="pacotes mais lentos a listar")
+    parser.add_argument("--history", help="arquivo JSONL onde acrescentar o resultado")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Mede só a importação: sem aquecer o modelo de embeddings nem criar os LLMs
+    env.setdefault("EMBEDDING_WARMUP", "0")
+    env.setdefault("LLM_EAGER_PROVIDERS", "")
+
+    timings, packages = [], {}
+    for run in range(args.runs):
+        seconds, run_packages = measure(args.module, env)
+        timings.append(seconds)
+        for name, value in run_packages.items():
+            packages.setdefault(name, []).append(value)
+        print(f"[startup] execução {run + 1}/{args.runs}: {seconds:.3f}s", flush=True)
+
+    median = statistics.median(timings)
+    slowest = sorted(((statistics.median(values), name) for name, values in packages.items()), reverse=True)[:args.top]
+    print(f"[startup] import {args.module}: mediana {median:.3f}s (mín. {min(timings):.3f}s, máx. {max(timings):.3f}s), orçamento {args.budget:.3f}s")
+    for seconds, name in slowest:
+        print(f"    {seconds:8.3f}s  {name}")
+
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as history:
+            history.write(json.dumps({
+                "time": time.time(), "module": args.module, "median": round(median, 4),
+                "runs": [round(t, 4) for t in timings], "budget": args.budget,
+                "slowest": {name: round(seconds, 4) for seconds, name in slowest},
+            }) + "\n")
+
+    if median > args.budget:
+        print(f"[startup] ORÇAMENTO ESTOURADO: {median:.3f}s > {args.budget:.3f}s", flush=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
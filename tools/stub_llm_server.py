@@ -0,0 +1,213 @@
+# tools/stub_llm_server.py
+#
+# Servidor local que imita a API de mensagens da Anthropic (/v1/messages) e a
+# de chat da xAI (/v1/chat/completions, formato OpenAI), para testar os clientes
+# sem gastar tokens. Cada corpo de requisição recebido é gravado (uma linha JSON
+# por requisição). Na Anthropic, o uso de tokens devolvido simula o cache do
+# provedor: o prefixo até o último bloco com `cache_control` é "gravado" na
+# primeira vez e "lido" nas seguintes. --fail-first N responde 503 (ou o
+# status de --fail-status, com o cabeçalho Retry-After de --retry-after) às N
+# primeiras requisições, para exercitar as novas tentativas dos clientes.
+# --malformed-sse inclui no streaming da xAI um evento com JSON cortado.
+#
+# Uso:
+#   python tools/stub_llm_server.py --port 8787 --log stub_requests.jsonl
+#   ANTHROPIC_API_URL=http://127.0.0.1:8787 ANTHROPIC_API_KEY=stub python app.py
+#   X_API_BASE_URL=http://127.0.0.1:8787/v1/chat/completions X_API_KEY=stub python app.py
+
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 4
+REPLY_TEXT = "Resposta simulada pelo servidor local. "
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def _blocks(body):
+    """Blocos de texto do pedido, na ordem em que o modelo os lê (system e mensagens)."""
+    system = body.get("system") or []
+    if isinstance(system, str):
+        system = [{"type": "text", "text": system}]
+    blocks = list(system)
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            blocks.append({"type": "text", "text": content})
+        else:
+            blocks.extend(block for block in content or [] if isinstance(block, dict))
+    return blocks
+
+
+class StubState:
+    def __init__(self, log_path: str, fail_first: int = 0, fail_status: int = 503, retry_after: str = None, malformed_sse: bool = False):
+        self.log_path = log_path
+        self.fail_remaining = fail_first
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.malformed_sse = malformed_sse
+        self.cached_prefixes = set()
+        self.lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            if self.fail_remaining > 0:
+                self.fail_remaining -= 1
+                return True
+            return False
+
+    def record(self, path: str, body) -> None:
+        with self.lock, open(self.log_path, "a", encoding="utf-8") as log:
+            log.write(json.dumps({"time": time.time(), "path": path, "body": body}, ensure_ascii=False) + "\n")
+
+    def usage(self, body):
+        blocks = _blocks(body)
+        texts = [block.get("text", "") for block in blocks]
+        last_marked = max((i for i, block in enumerate(blocks) if block.get("cache_control")), default=-1)
+        prefix = "".join(texts[: last_marked + 1])
+        rest = "".join(texts[last_marked + 1:])
+        usage = {"input_tokens": _tokens(rest), "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        if prefix:
+            key = hashlib.sha256((body.get("model", "") + prefix).encode("utf-8")).hexdigest()
+            with self.lock:
+                hit = key in self.cached_prefixes
+                self.cached_prefixes.add(key)
+            usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = _tokens(prefix)
+        return usage
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            print(f"[stub] {self.address_string()} {format % args}", flush=True)
+
+        def _send_json(self, status: int, payload, headers=None) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_event(self, event: str, payload) -> None:
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            state.record(self.path, body)
+            if state.should_fail():
+                headers = {"Retry-After": state.retry_after} if state.retry_after is not None else None
+                self._send_json(state.fail_status, {"type": "error", "error": {"type": "overloaded_error", "message": "falha simulada"}}, headers)
+                return
+            if self.path.endswith("/chat/completions"):
+                self._chat_completions(body)
+                return
+            if not self.path.startswith("/v1/messages"):
+                self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                return
+
+            usage = state.usage(body)
+            text = REPLY_TEXT * 3
+            output_tokens = _tokens(text)
+            print(f"[stub] uso simulado: {usage}", flush=True)
+            message = {
+                "id": f"msg_stub_{int(time.time() * 1000)}",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model", "stub"),
+                "stop_reason": None,
+                "stop_sequence": None,
+            }
+
+            if not body.get("stream"):
+                self._send_json(200, {
+                    **message,
+                    "content": [{"type": "text", "text": text}],
+                    "stop_reason": "end_turn",
+                    "usage": {**usage, "output_tokens": output_tokens},
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self._send_event("message_start", {"type": "message_start", "message": {**message, "content": [], "usage": {**usage, "output_tokens": 1}}})
+            self._send_event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            for piece in text.split(" "):
+                self._send_event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece + " "}})
+            self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self._send_event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {**usage, "output_tokens": output_tokens}})
+            self._send_event("message_stop", {"type": "message_stop"})
+            self.close_connection = True
+
+        def _chat_completions(self, body):
+            """Resposta no formato OpenAI usado pela xAI, com ou sem streaming."""
+            prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+            text = REPLY_TEXT * 3
+            usage = {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(text), "total_tokens": _tokens(prompt) + _tokens(text)}
+            completion = {"id": f"chatcmpl_stub_{int(time.time() * 1000)}", "object": "chat.completion", "model": body.get("model", "stub")}
+
+            if not body.get("stream"):
+                self._send_json(200, {
+                    **completion,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            if state.malformed_sse:
+                self.wfile.write(b'data: {"choices": [{"delta": {"content": "cort\n\n')
+            for piece in text.split(" "):
+                chunk = {**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece + " "}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self.wfile.write(f"data: {json.dumps({**completion, 'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita as APIs da Anthropic e da xAI e grava os pedidos.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--log", default="stub_requests.jsonl", help="arquivo onde os corpos das requisições são gravados")
+    parser.add_argument("--fail-first", type=int, default=0, help="responde 503 às N primeiras requisições")
+    parser.add_argument("--fail-status", type=int, default=503, help="status HTTP das falhas simuladas (ex. 429)")
+    parser.add_argument("--retry-after", default=None, help="valor do cabeçalho Retry-After das falhas simuladas")
+    parser.add_argument("--malformed-sse", action="store_true", help="envia um evento com JSON cortado no streaming da xAI")
+    args = parser.parse_args()
+
+    state = StubState(args.log, args.fail_first, args.fail_status, args.retry_after, args.malformed_sse)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"[stub] Ouvindo em http://{args.host}:{args.port} (pedidos em {args.log})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()